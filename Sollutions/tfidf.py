@@ -1,3 +1,4 @@
+import heapq
 import re
 from collections import Counter
 from math import log
@@ -56,19 +57,20 @@ def invert_reducer(records):
         records[i]['tf-idf'] = record['tf'] * \
                                log(record['docs_count'] / record[
                                    'docs_contain_word'])
-    records = sorted(records, reverse=True, key=lambda i: i['tf-idf'])
     top = [tuple([record['doc_id'], record['tf-idf']])
-           for record in records[:3]]
+           for record in heapq.nlargest(3, records,
+                                        key=lambda i: i['tf-idf'])]
     yield {
         'term': records[0]['word'],
         'index': top
     }
 
 
-def solve_problem():
+def build_index(path):
     """
-    Sollution to tf-idf problem as it is written in task file
-    :return:
+    Builds graphs of tf-idf problem on corpus from path
+    :param path: path to text corpus
+    :return: graph computing the index
     """
     split_word = computations.ComputationGraph()
     count_docs = computations.ComputationGraph()
@@ -81,19 +83,28 @@ def solve_problem():
 
     count_idf.set_input(split_word)
     count_idf.add_reducer(unique_columns_reducer, ('doc_id', 'word'))
-    count_idf.add_join((count_docs, './data/text_corpus.txt'), (),
+    count_idf.add_join((count_docs, path), (),
                        strategy='outer')
     count_idf.add_reducer(docs_contain_word_reducer, 'word')
 
     calc_index.add_reducer(term_frequency_reducer, 'doc_id')
-    calc_index.add_join((count_idf, split_word), ('word',), strategy='left')
+    calc_index.add_join((count_idf, split_word), ('word',), strategy='left',
+                        method='hash')
 
     calc_index.add_reducer(invert_reducer, 'word')
 
-    split_word.set_input('./data/text_corpus.txt')
-    count_docs.set_input('./data/text_corpus.txt')
+    split_word.set_input(path)
+    count_docs.set_input(path)
     calc_index.set_input(split_word)
+    return calc_index
 
+
+def solve_problem():
+    """
+    Sollution to tf-idf problem as it is written in task file
+    :return:
+    """
+    calc_index = build_index('./data/text_corpus.txt')
     calc_index.run()
     calc_index.write_output("./results/tf-idf.txt")
 
@@ -0,0 +1,83 @@
+"""
+Generators of synthetic inputs for benchmarks. Every generator writes
+a json-lines file, gives the same file for the same seed and returns
+the number of lines written.
+"""
+import itertools
+import json
+import random
+
+
+def _zipf_weights(count, skew):
+    return list(itertools.accumulate(1 / rank ** skew
+                                     for rank in range(1, count + 1)))
+
+
+def make_corpus(path, docs_count, words_count=20000, doc_length=100,
+                seed=0):
+    """
+    Text corpus like data/text_corpus.txt for word count and tf-idf:
+    lines with doc_id and text, word frequencies follow Zipf's law
+    """
+
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                     for _ in range(rng.randint(2, 10)))
+             for _ in range(words_count)]
+    weights = _zipf_weights(words_count, 1.0)
+    with open(path, 'w') as output:
+        for doc_id in range(docs_count):
+            text = ' '.join(
+                word.capitalize() + '.' if rng.random() < 0.05 else word
+                for word in rng.choices(words, cum_weights=weights,
+                                        k=doc_length))
+            output.write(json.dumps({'doc_id': doc_id, 'text': text}) + '\n')
+    return docs_count
+
+
+def make_road_edges(path, edges_count, seed=0):
+    """
+    Road graph edges like data/graph_data.txt: start and end as
+    [longitude, latitude] within Moscow and random 63-bit edge_id
+    """
+
+    rng = random.Random(seed)
+    with open(path, 'w') as output:
+        for _ in range(edges_count):
+            start = [rng.uniform(37.3, 37.9), rng.uniform(55.55, 55.95)]
+            end = [start[0] + rng.uniform(-0.001, 0.001),
+                   start[1] + rng.uniform(-0.001, 0.001)]
+            output.write(json.dumps({'start': start, 'end': end,
+                                     'edge_id': rng.getrandbits(63)}) + '\n')
+    return edges_count
+
+
+def make_skewed_table(path, rows_count, keys_count, skew=1.2, seed=0):
+    """
+    Table of key, value and row_id, keys 0..keys_count - 1 follow Zipf's
+    law with exponent skew, so a few keys take most of the lines
+    """
+
+    rng = random.Random(seed)
+    weights = _zipf_weights(keys_count, skew)
+    keys = range(keys_count)
+    with open(path, 'w') as output:
+        for row_id in range(rows_count):
+            key = rng.choices(keys, cum_weights=weights)[0]
+            output.write(json.dumps({'key': key, 'value': rng.random(),
+                                     'row_id': row_id}) + '\n')
+    return rows_count
+
+
+def make_dimension_table(path, keys_count, seed=0):
+    """
+    Table with one line for every key of make_skewed_table
+    """
+
+    rng = random.Random(seed)
+    with open(path, 'w') as output:
+        for key in range(keys_count):
+            output.write(json.dumps({'key': key,
+                                     'name': 'key_{}'.format(key),
+                                     'weight': rng.random()}) + '\n')
+    return keys_count
@@ -0,0 +1,43 @@
+"""
+Compares reading of a json-lines file with readlines and json.loads
+to JsonLinesSource with different decoders.
+Run from the repository root:
+
+    python -m benchmarks.json_reader [path] [repeat]
+"""
+import json
+import sys
+import time
+
+import computations
+
+
+def readlines_json(path):
+    table = []
+    with open(path, 'r') as input:
+        for line in input.readlines():
+            table.append(json.loads(line))
+    return table
+
+
+def measure(name, read, path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lines = sum(1 for _ in read(path))
+    elapsed = (time.perf_counter() - start) / repeat
+    print('{:>24}: {:.3f}s, {:.0f} lines/s'.format(name, elapsed,
+                                                   lines / elapsed))
+
+
+def main(path='./data/graph_data.txt', repeat=5):
+    repeat = int(repeat)
+    measure('readlines + json', readlines_json, path, repeat)
+    for decoder in sorted(computations.JSON_DECODERS):
+        for use_mmap in (True, False):
+            measure('{} {}'.format(decoder, 'mmap' if use_mmap else 'read'),
+                    lambda path: computations.JsonLinesSource(
+                        path, decoder, use_mmap), path, repeat)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
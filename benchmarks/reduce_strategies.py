@@ -0,0 +1,63 @@
+"""
+Compares sort and hash strategies of Reduce, with and without
+a combiner, on the word count problem.
+Run from the repository root:
+
+    python -m benchmarks.reduce_strategies [docs_count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import computations
+from Sollutions.word_count import term_frequency_reducer, tokenizer_mapper
+from benchmarks.generators import make_corpus
+
+
+def counting_tokenizer_mapper(line):
+    for record in tokenizer_mapper(line):
+        yield {'word': record['word'], 'total': 1}
+
+
+def merge_totals(first, second):
+    return {'word': first['word'], 'total': first['total'] + second['total']}
+
+
+def total_reducer(records):
+    yield {'word': records[0]['word'],
+           'total': sum(record['total'] for record in records)}
+
+
+def word_count(path, strategy, combiner=False):
+    g = computations.ComputationGraph(streaming=True)
+    if combiner:
+        g.add_mapper(counting_tokenizer_mapper)
+        g.add_reducer(total_reducer, 'word', strategy=strategy,
+                      combiner=merge_totals)
+    else:
+        g.add_mapper(tokenizer_mapper)
+        g.add_reducer(term_frequency_reducer, 'word', strategy=strategy)
+    g.set_input(path)
+    start = time.perf_counter()
+    g.run()
+    return time.perf_counter() - start, len(g.result)
+
+
+def main(docs_count=20000):
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        make_corpus(path, docs_count)
+        for combiner in (False, True):
+            for strategy in ('sort', 'hash'):
+                elapsed, lines = word_count(path, strategy, combiner)
+                print('{:>5}{}: {:.3f}s, {} words'.format(
+                    strategy, ' + combiner' if combiner else '', elapsed,
+                    lines))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Compares handoff of a graph result to the next graph through a json-lines
+file and through a file in binary row format.
+Run from the repository root:
+
+    python -m benchmarks.row_format [path] [repeat]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import computations
+
+
+def handoff(result, path, format, compression=None):
+    start = time.perf_counter()
+    result.write_output(path, format, compression)
+    written = time.perf_counter()
+    g = computations.ComputationGraph()
+    if format == 'rows':
+        g.set_input(computations.RowsSource(path))
+    else:
+        g.set_input(path)
+    g.run()
+    return (written - start, time.perf_counter() - written,
+            os.path.getsize(path))
+
+
+def main(path='./data/graph_data.txt', repeat=3):
+    repeat = int(repeat)
+    result = computations.ComputationGraph()
+    result.set_input(path)
+    result.run()
+    fd, output = tempfile.mkstemp()
+    os.close(fd)
+    formats = [('json', None), ('rows', None)]
+    formats.extend(('rows', name) for name in sorted(
+        computations.COMPRESSIONS))
+    try:
+        for format, compression in formats:
+            write = read = 0
+            for _ in range(repeat):
+                write_time, read_time, size = handoff(result, output, format,
+                                                      compression)
+                write += write_time / repeat
+                read += read_time / repeat
+            print('{:>10}: write {:.3f}s, read {:.3f}s, {:.1f} MB'.format(
+                format + (' ' + compression if compression else ''), write,
+                read, size / 2 ** 20))
+    finally:
+        os.remove(output)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,288 @@
+"""
+Benchmark suite: operators and end-to-end pipelines on synthetic inputs
+from benchmarks.generators. Every case runs in its own process, reports
+the best wall time of several runs, input lines per second, peak RSS of
+the process and times of operations from a profiled run.
+Results can be saved as a baseline and compared with it: cases slower
+than the baseline by more than the threshold are reported as
+regressions and the suite exits with code 1.
+Run from the repository root:
+
+    python -m benchmarks.suite --scale 1 --save baseline.json
+    python -m benchmarks.suite --scale 1 --compare baseline.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import computations
+from Sollutions import tfidf, word_count
+from benchmarks import generators
+
+# Number of lines of inputs for scale 1
+DOCS_COUNT = 2000
+EDGES_COUNT = 100000
+ROWS_COUNT = 200000
+KEYS_COUNT = 10000
+
+
+def edge_length_mapper(line):
+    (start_lon, start_lat), (end_lon, end_lat) = map(
+        lambda point: map(math.radians, point), (line['start'], line['end']))
+    a = math.sin((end_lat - start_lat) / 2) ** 2 + \
+        math.cos(start_lat) * math.cos(end_lat) * \
+        math.sin((end_lon - start_lon) / 2) ** 2
+    yield {'cell': '{:.2f},{:.2f}'.format(*line['start']),
+           'length': 2 * 6373 * math.asin(math.sqrt(a))}
+
+
+def scale_mapper(line):
+    yield {'key': line['key'], 'value': line['value'] * 2,
+           'row_id': line['row_id']}
+
+
+def sum_reducer(records):
+    yield {'key': records[0]['key'],
+           'value': sum(record['value'] for record in records)}
+
+
+def merge_values(first, second):
+    return {'key': first['key'], 'value': first['value'] + second['value']}
+
+
+def skewed_graph(data, *operations, source='skewed'):
+    g = computations.ComputationGraph(streaming=True)
+    for name, args, kwargs in operations:
+        getattr(g, name)(*args, **kwargs)
+    if source.endswith('_rows'):
+        g.set_input(computations.RowsSource(data[source]))
+    else:
+        g.set_input(data[source])
+    return g
+
+
+def join_graph(data, method):
+    dimension = computations.ComputationGraph()
+    return skewed_graph(
+        data,
+        ('add_join', ((dimension, data['dimension']), ('key',), 'inner'),
+         {'method': method}),
+        ('add_aggregate', ('name',), {'sum': {'value': 'total'}}))
+
+
+def sharded_graph(data):
+    g = computations.ComputationGraph(streaming=True)
+    g.add_mapper(scale_mapper)
+    g.set_input(computations.ShardedSource(data['skewed'], workers=4,
+                                           split_size=1 << 20))
+    return g
+
+
+def word_count_graph(data):
+    g = computations.ComputationGraph(streaming=True)
+    g.add_mapper(word_count.tokenizer_mapper)
+    g.add_reducer(word_count.term_frequency_reducer, 'word')
+    g.set_input(data['corpus'])
+    return g
+
+
+def road_graph(data):
+    g = computations.ComputationGraph(streaming=True)
+    g.add_mapper(edge_length_mapper)
+    g.add_aggregate('cell', count='edges', sum={'length': 'total_length'})
+    g.add_top_k(10, 'total_length')
+    g.set_input(data['edges'])
+    return g
+
+
+# name -- (input, function of paths of inputs returning graph to run)
+CASES = {
+    'read_json': ('skewed', lambda data: skewed_graph(data)),
+    'read_rows': ('skewed', lambda data: skewed_graph(
+        data, source='skewed_rows')),
+    'map': ('skewed', lambda data: skewed_graph(
+        data, ('add_mapper', (scale_mapper,), {}))),
+    'map_sharded': ('skewed', sharded_graph),
+    'sort': ('skewed', lambda data: skewed_graph(
+        data, ('add_sort', ('value',), {}))),
+    'reduce_sort': ('skewed', lambda data: skewed_graph(
+        data, ('add_reducer', (sum_reducer, 'key'), {}))),
+    'reduce_hash': ('skewed', lambda data: skewed_graph(
+        data, ('add_reducer', (sum_reducer, 'key', 'hash'), {}))),
+    'reduce_combiner': ('skewed', lambda data: skewed_graph(
+        data, ('add_reducer', (sum_reducer, 'key', 'hash'),
+               {'combiner': merge_values}))),
+    'aggregate': ('skewed', lambda data: skewed_graph(
+        data, ('add_aggregate', ('key',),
+               {'count': 'n', 'mean': {'value': 'mean'}}))),
+    'top_k': ('skewed', lambda data: skewed_graph(
+        data, ('add_top_k', (10, 'value'), {'group_by': 'key'}))),
+    'join_merge': ('skewed', lambda data: join_graph(data, 'merge')),
+    'join_hash': ('skewed', lambda data: join_graph(data, 'hash')),
+    'word_count': ('corpus', word_count_graph),
+    'tf_idf': ('corpus', lambda data: tfidf.build_index(data['corpus'])),
+    'road_lengths': ('edges', road_graph),
+}
+
+
+def generate(directory, scale, seed=0):
+    """
+    :param directory: directory for inputs
+    :param scale: multiplier of numbers of lines
+    :param seed: seed of generators
+    :return: dict of paths of inputs and dict of their numbers of lines
+    """
+
+    data = {name: os.path.join(directory, name + '.txt')
+            for name in ('corpus', 'edges', 'skewed', 'dimension')}
+    data['skewed_rows'] = os.path.join(directory, 'skewed.rows')
+    lines = {
+        'corpus': generators.make_corpus(
+            data['corpus'], int(DOCS_COUNT * scale), seed=seed),
+        'edges': generators.make_road_edges(
+            data['edges'], int(EDGES_COUNT * scale), seed=seed),
+        'skewed': generators.make_skewed_table(
+            data['skewed'], int(ROWS_COUNT * scale), KEYS_COUNT, seed=seed),
+        'dimension': generators.make_dimension_table(
+            data['dimension'], KEYS_COUNT, seed=seed),
+    }
+    computations.write_rows(data['skewed_rows'],
+                            computations.JsonLinesSource(data['skewed']))
+    return data, lines
+
+
+def run_case(name, data, lines, repeat):
+    """
+    Runs a case in the current process
+    :return: dict with results of the case
+    """
+
+    source, build = CASES[name]
+    best = None
+    for _ in range(repeat):
+        g = build(data)
+        start = time.perf_counter()
+        g.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    g = build(data)
+    g.run(profile=True)
+    operations = [{'graph': graph['graph'],
+                   'operation': operation['operation'],
+                   'wall': operation['wall'],
+                   'rows_in': operation['rows_in'],
+                   'rows_out': operation['rows_out'],
+                   'spills': operation['spills']}
+                  for graph in g.stats()['graphs']
+                  for operation in graph['operations']]
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    return {'wall': best, 'rows': lines[source],
+            'rows_per_second': lines[source] / best,
+            'peak_rss': peak_rss, 'operations': operations}
+
+
+def run_suite(names, data, lines, repeat):
+    """
+    Runs every case in a new process, so peak RSS is measured per case
+    :return: dict of case name and its results
+    """
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            results[name] = pool.submit(run_case, name, data, lines,
+                                        repeat).result()
+        report(name, results[name])
+    return results
+
+
+def report(name, result, baseline=None):
+    line = '{:>16}: {:8.3f}s {:>12,.0f} lines/s {:8.1f} MB'.format(
+        name, result['wall'], result['rows_per_second'],
+        result['peak_rss'] / 2 ** 20)
+    if baseline is not None:
+        line += ' {:+7.1%}'.format(result['wall'] / baseline['wall'] - 1)
+    print(line)
+
+
+def compare(results, baseline, threshold):
+    """
+    :param results: dict of case name and its results
+    :param baseline: dict of case name and its results
+    :param threshold: allowed relative growth of wall time
+    :return: list of names of cases slower than the baseline
+    """
+
+    regressions = []
+    print('\nCompared to baseline:')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        report(name, result, baseline[name])
+        if result['wall'] > baseline[name]['wall'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of numbers of input lines')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of every case')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help='comma separated names of cases')
+    parser.add_argument('--save', help='save results as baseline to file')
+    parser.add_argument('--compare', help='compare results with baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as regression')
+    arguments = parser.parse_args(arguments)
+
+    names = arguments.cases.split(',')
+    for name in names:
+        if name not in CASES:
+            parser.error('unknown case {}'.format(name))
+
+    directory = tempfile.mkdtemp(prefix='cg_bench_')
+    try:
+        data, lines = generate(directory, arguments.scale)
+        results = run_suite(names, data, lines, arguments.repeat)
+    finally:
+        shutil.rmtree(directory)
+
+    if arguments.save:
+        with open(arguments.save, 'w') as output:
+            json.dump({'scale': arguments.scale,
+                       'python': platform.python_version(),
+                       'cases': results}, output, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as input:
+            baseline = json.load(input)
+        if baseline['scale'] != arguments.scale:
+            print('Baseline was measured with scale {}'.format(
+                baseline['scale']))
+        regressions = compare(results, baseline['cases'],
+                              arguments.threshold)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
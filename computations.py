@@ -1,8 +1,181 @@
+import copy
 import functools
+import glob
+import hashlib
+import heapq
 import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import zlib
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed, wait)
 from inspect import isgeneratorfunction, signature
+from itertools import chain, groupby, islice
 from operator import itemgetter
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Memory budget of sorting operations, in lines. Longer tables are sorted
+# in runs of this size, which are spilled to disk and merged
+SORT_BUFFER_SIZE = 1000000
+# Maximal number of runs merged at once
+MERGE_FAN_IN = 64
+# Number of lines serialized together in spill files
+SPILL_BLOCK_SIZE = 1024
+# Number of lines sent to a worker process at once
+CHUNK_SIZE = 1000
+# Number of keys combined in memory before lines are passed further
+COMBINE_BUFFER_SIZE = 100000
+# Number of lines passed to a batch mapper at once
+BATCH_SIZE = 1024
+# Number of bytes of input split into lines at once
+READ_CHUNK_SIZE = 1 << 20
+# Number of bytes of a json-lines file read by one worker of ShardedSource,
+# longer files are split into byte ranges of about this size
+SPLIT_SIZE = 16 << 20
+# Number of bytes before the consumed part of an input, which are
+# checked to be unchanged by incremental runs
+TAIL_SIZE = 4096
+# Number of parts an operation splits its state into, when the state does
+# not fit in the memory budget of the graph
+SPILL_PARTITIONS = 16
+# Maximal number of times a part is split again, when it does not fit
+# in the memory budget either
+SPILL_LEVELS = 3
+# Sizes of lines are estimated by measuring every SIZE_SAMPLE-th line
+SIZE_SAMPLE = 64
+# Compression of spill files, None -- blocks are not compressed
+SPILL_COMPRESSION = None
+# Start of files in binary row format
+ROWS_MAGIC = b'CGROWS\x00\x01'
+# Lines in binary row format are pickled with this protocol
+ROWS_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+JSON_DECODERS = {'json': json.loads}
+if ujson is not None:
+    JSON_DECODERS['ujson'] = ujson.loads
+if orjson is not None:
+    JSON_DECODERS['orjson'] = orjson.loads
+
+# Block compressions of binary row format: name -- (compress, decompress)
+COMPRESSIONS = {'zlib': (functools.partial(zlib.compress, level=1),
+                         zlib.decompress)}
+if lz4 is not None:
+    COMPRESSIONS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+_FRAME = struct.Struct('<I')
+
+# Statistics of the operation being profiled in the current thread and
+# time spent in nested profiled calls, unset when profiling is off
+_PROFILE = threading.local()
+
+
+def _count(name, value=1):
+    stats = getattr(_PROFILE, 'stats', None)
+    if stats is not None:
+        stats[name] += value
+
+
+def _operation_stats(name):
+    return {'operation': name, 'wall': 0.0, 'cpu': 0.0, 'rows_in': 0,
+            'rows_out': 0, 'sorts': 0, 'spills': 0, 'bytes_written': 0,
+            'peak_memory': None, 'start': None, 'end': None}
+
+
+def _measure(stats, function, *args):
+    """
+    Calls function, adds wall and thread CPU time spent in it to stats,
+    except time of nested measured calls. Sorts and spills made in the
+    call are counted in stats
+    :param stats: dict, see _operation_stats
+    :param function: function to call
+    :param args: arguments of function
+    :return: result of function
+    """
+
+    # time is taken first and last, so the caller does not count
+    # overhead of measuring as its own time
+    start, cpu = time.perf_counter(), time.thread_time()
+    saved, nested = getattr(_PROFILE, 'stats', None), \
+        getattr(_PROFILE, 'nested', None)
+    _PROFILE.stats, _PROFILE.nested = stats, [0.0, 0.0]
+    try:
+        return function(*args)
+    finally:
+        end = time.perf_counter()
+        stats['wall'] += end - start - _PROFILE.nested[0]
+        stats['cpu'] += time.thread_time() - cpu - _PROFILE.nested[1]
+        if stats['start'] is None:
+            stats['start'] = start
+        stats['end'] = end
+        _PROFILE.stats, _PROFILE.nested = saved, nested
+        if nested is not None:
+            nested[0] += time.perf_counter() - start
+            nested[1] += time.thread_time() - cpu
+
+
+def _profiled(table, stats):
+    """
+    :param table: iterable of lines
+    :param stats: dict, see _operation_stats
+    :return: yields lines of table, measuring time spent getting them
+    """
+
+    lines = iter(table)
+    while True:
+        try:
+            line = _measure(stats, next, lines)
+        except StopIteration:
+            return
+        stats['rows_out'] += 1
+        yield line
+
+
+def _profiled_call(stats, function, *args, **kwargs):
+    """
+    :param stats: dict, see _operation_stats
+    :param function: operation or columnar_call of it
+    :return: ColumnarTable or profiled iterable of lines
+    """
+
+    result = _measure(stats, functools.partial(function, *args, **kwargs))
+    if isinstance(result, ColumnarTable):
+        stats['rows_out'] += len(result)
+        return result
+    return _profiled(result, stats)
+
 
 def operation_deprecated(func):
     @functools.wraps(func)
@@ -14,10 +187,776 @@ def operation_deprecated(func):
     return wrapper
 
 
+def _compressor(compression, index):
+    if compression is None:
+        return None
+    if compression not in COMPRESSIONS:
+        raise TypeError('Compression {} is not available'.format(compression))
+    return COMPRESSIONS[compression][index]
+
+
+def _write_frame(output, data):
+    output.write(_FRAME.pack(len(data)))
+    output.write(data)
+
+
+def _read_frame(input):
+    size = input.read(_FRAME.size)
+    if not size:
+        return None
+    return input.read(_FRAME.unpack(size)[0])
+
+
+def _schema_strings(schema):
+    """
+    :param schema: dict of column name and dtype
+    :return: dict of column name and name of dtype
+    """
+
+    return {column: str(numpy.dtype(dtype)) if numpy is not None
+            else str(dtype) for column, dtype in schema.items()}
+
+
+def _write_header(output, compression=None, schema=None):
+    """
+    Starts a file in binary row format: ROWS_MAGIC and a frame with
+    json header, which states compression of blocks and schema
+    :param output: binary file
+    :param compression: name of compression from COMPRESSIONS or None
+    :param schema: dict of column name and dtype or None
+    :return: compress function or None
+    """
+
+    compress = _compressor(compression, 0)
+    if schema is not None:
+        schema = _schema_strings(schema)
+    output.write(ROWS_MAGIC)
+    _write_frame(output, json.dumps({'compression': compression,
+                                     'schema': schema}).encode())
+    return compress
+
+
+def _write_block(output, block, compress=None):
+    data = pickle.dumps(block, ROWS_PROTOCOL)
+    _write_frame(output, compress(data) if compress is not None else data)
+
+
+def _write_rows(output, lines, compression=None, schema=None):
+    """
+    Writes lines in binary row format: header, then frames with blocks
+    of SPILL_BLOCK_SIZE lines, pickled and compressed. Every frame is
+    prefixed with its length
+    :param output: binary file
+    :param lines: iterable of lines
+    :param compression: name of compression from COMPRESSIONS or None
+    :param schema: dict of column name and dtype or None
+    :return:
+    """
+
+    compress = _write_header(output, compression, schema)
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == SPILL_BLOCK_SIZE:
+            _write_block(output, block, compress)
+            block = []
+    if block:
+        _write_block(output, block, compress)
+
+
+def _read_header(input):
+    if input.read(len(ROWS_MAGIC)) != ROWS_MAGIC:
+        raise TypeError('File is not in binary row format')
+    return json.loads(_read_frame(input).decode())
+
+
+def _read_rows(input):
+    decompress = _compressor(_read_header(input)['compression'], 1)
+    while True:
+        data = _read_frame(input)
+        if data is None:
+            return
+        if decompress is not None:
+            data = decompress(data)
+        yield from pickle.loads(data)
+
+
+def _spill_run(lines, directory=None, compression=SPILL_COMPRESSION):
+    """
+    Writes lines to a temporary file in binary row format
+    :param lines: iterable of lines
+    :param directory: directory for the file, system default if None
+    :param compression: name of compression from COMPRESSIONS or None
+    :return: path to the file
+    """
+
+    fd, path = tempfile.mkstemp(prefix='cg_run_', dir=directory)
+    with os.fdopen(fd, 'wb') as output:
+        _write_rows(output, lines, compression)
+        _count('spills')
+        _count('bytes_written', output.tell())
+    return path
+
+
+def _read_run(path):
+    with open(path, 'rb') as input:
+        yield from _read_rows(input)
+
+
+def write_rows(path, table, compression=None, schema=None):
+    """
+    Writes table to a file in binary row format, which can be used as
+    input of a graph. It is read without parsing json
+    :param path: path to file
+    :param table: iterable of lines
+    :param compression: name of compression from COMPRESSIONS or None
+    :param schema: dict of column name and dtype, stored in the header
+    :return:
+    """
+
+    with open(path, 'wb') as output:
+        _write_rows(output, table, compression, schema)
+
+
+def is_rows_file(path):
+    """
+    :param path: path to file
+    :return: True if file is in binary row format
+    """
+
+    with open(path, 'rb') as input:
+        return input.read(len(ROWS_MAGIC)) == ROWS_MAGIC
+
+
+def _deep_size(value):
+    """
+    :param value: line or state
+    :return: approximate size in bytes with nested values of dicts,
+    lists and tuples
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(map(_deep_size, value.values()))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(map(_deep_size, value))
+    return size
+
+
+class _Sizes(object):
+    """
+    Estimates sizes of lines: every SIZE_SAMPLE-th line is measured,
+    other lines get the mean size of measured ones
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.measured = 0
+        self.total = 0
+
+    def __call__(self, line):
+        if self.count % SIZE_SAMPLE == 0:
+            self.measured += 1
+            self.total += _deep_size(line)
+        self.count += 1
+        return self.total // self.measured
+
+
+class MemoryBudget(object):
+    """
+    Approximate memory budget of blocking operations of a graph in bytes.
+    Operations reserve estimated sizes of lines and states they keep and
+    release them when they spill them to disk or pass them further
+    """
+
+    def __init__(self, limit):
+        """
+        :param limit: number of bytes
+        """
+
+        if not (isinstance(limit, int) and limit > 0):
+            raise TypeError('Memory limit must be positive int')
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+
+    def reserve(self, size):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        self.used -= size
+
+    def full(self, reserved):
+        """
+        :param reserved: number of bytes reserved by an operation
+        :return: True if the budget is exceeded and the operation should
+        spill. Operations holding less than 1 / SPILL_PARTITIONS of the
+        limit keep their lines, so tiny runs are not spilled
+        """
+
+        return self.used > self.limit \
+            and reserved * SPILL_PARTITIONS >= self.limit
+
+
+def external_sorted(table, key, buffer_size=SORT_BUFFER_SIZE,
+                    directory=None, budget=None):
+    """
+    Stable sort of a table which does not have to fit in memory.
+    Lines are sorted in runs of buffer_size lines, every run but the last
+    is spilled to a temporary file, runs are merged with a heap
+    :param table: iterable of dict-like objects
+    :param key: function to get comparison key from a line
+    :param buffer_size: number of lines kept in memory,
+     None -- sort whole table in memory
+    :param directory: directory for spill files, system default if None
+    :param budget: MemoryBudget, a run is also spilled when the budget
+    is full
+    :return: yields lines of sorted table
+    """
+
+    _count('sorts')
+    runs = []
+    buffer = []
+    sizes = _Sizes()
+    reserved = 0
+    try:
+        for line in table:
+            buffer.append(line)
+            if budget is not None:
+                size = sizes(line)
+                reserved += size
+                budget.reserve(size)
+            if buffer_size is not None and len(buffer) >= buffer_size \
+                    or budget is not None and budget.full(reserved):
+                buffer.sort(key=key)
+                runs.append(_spill_run(buffer, directory))
+                buffer = []
+                if budget is not None:
+                    budget.release(reserved)
+                    reserved = 0
+        buffer.sort(key=key)
+
+        if not runs:
+            buffer.reverse()
+            while buffer:
+                yield buffer.pop()
+            return
+
+        while len(runs) >= MERGE_FAN_IN:
+            merged = heapq.merge(*map(_read_run, runs[:MERGE_FAN_IN]),
+                                 key=key)
+            path = _spill_run(merged, directory)
+            for run in runs[:MERGE_FAN_IN]:
+                os.remove(run)
+            runs = [path] + runs[MERGE_FAN_IN:]
+
+        yield from heapq.merge(*map(_read_run, runs), buffer, key=key)
+    finally:
+        if budget is not None:
+            budget.release(reserved)
+        for run in runs:
+            if os.path.exists(run):
+                os.remove(run)
+
+
+def _chunks(table, chunk_size):
+    table = iter(table)
+    while True:
+        chunk = list(islice(table, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _check_workers(workers, chunk_size, function, name):
+    """
+    Checks parameters of an operation running in worker processes
+    :param workers: number of processes, None or 1 -- run in this process
+    :param chunk_size: number of lines sent to a process at once
+    :param function: user function, which is sent to processes
+    :param name: name of the function to use in messages
+    :return:
+    """
+
+    if workers is not None and not (isinstance(workers, int)
+                                    and workers > 0):
+        raise TypeError('Number of workers must be positive int')
+    if not (isinstance(chunk_size, int) and chunk_size > 0):
+        raise TypeError('Chunk size must be positive int')
+    if workers is not None and workers > 1 and function is not None:
+        try:
+            pickle.dumps(function)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            raise TypeError('{} must be picklable to run in worker '
+                            'processes, define it at module '
+                            'level'.format(name))
+
+
+def _process_chunks(function, table, workers, chunk_size, ordered=True):
+    """
+    Calls function on chunks of table in a pool of worker processes.
+    At most two chunks per worker are in flight, so table is read
+    lazily
+    :param function: picklable function of a list of lines
+    :param table: iterable of lines
+    :param workers: number of processes
+    :param chunk_size: number of lines in a chunk
+    :param ordered: yield results in order of chunks,
+    otherwise as soon as they are ready
+    :return: yields results of function
+    """
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque() if ordered else set()
+        for chunk in _chunks(table, chunk_size):
+            if ordered:
+                pending.append(pool.submit(function, chunk))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            else:
+                pending.add(pool.submit(function, chunk))
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+        if ordered:
+            while pending:
+                yield pending.popleft().result()
+        else:
+            for future in wait(pending).done:
+                yield future.result()
+
+
+def _append_run(path, lines):
+    with open(path, 'ab') as output:
+        start = output.tell()
+        _write_block(output, lines, _compressor(SPILL_COMPRESSION, 0))
+        _count('spills')
+        _count('bytes_written', output.tell() - start)
+
+
+def _part_number(value, count, level=0):
+    """
+    :param value: value of keys
+    :param count: number of parts
+    :param level: number of times lines were split into parts before,
+    lines of one part are split by other bits of hash
+    :return: number of part of value
+    """
+
+    return hash((level, value) if level else value) % count
+
+
+def _part_files(count):
+    """
+    :param count: number of parts
+    :return: list of paths to empty files in binary row format,
+    lines are added to them with _append_run
+    """
+
+    paths = []
+    for _ in range(count):
+        fd, path = tempfile.mkstemp(prefix='cg_part_')
+        with os.fdopen(fd, 'wb') as output:
+            _write_header(output, SPILL_COMPRESSION)
+        paths.append(path)
+    return paths
+
+
+def _spill_parts(paths, items, key, level=0):
+    """
+    Appends items to files of parts by hash of key, at most
+    SPILL_BLOCK_SIZE items are kept in memory before they are written
+    :param paths: list of paths, see _part_files
+    :param items: iterable of lines or other items
+    :param key: function to get value of keys from an item
+    :param level: see _part_number
+    :return:
+    """
+
+    parts = [[] for _ in paths]
+    count = 0
+    for item in items:
+        parts[_part_number(key(item), len(paths), level)].append(item)
+        count += 1
+        if count >= SPILL_BLOCK_SIZE:
+            _flush_parts(paths, parts)
+            count = 0
+    _flush_parts(paths, parts)
+
+
+def _flush_parts(paths, parts):
+    for number, (path, part) in enumerate(zip(paths, parts)):
+        if part:
+            _append_run(path, part)
+            parts[number] = []
+
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _partition(table, key, count, buffer_size=SORT_BUFFER_SIZE):
+    """
+    Splits table into parts by hash of key. While the table fits in
+    buffer_size lines parts are kept in memory, after that they are
+    appended to temporary files
+    :param table: iterable of lines
+    :param key: function to get partitioning key from a line
+    :param count: number of parts
+    :param buffer_size: number of lines kept in memory,
+     None -- keep everything in memory
+    :return: list of parts, each part is a list of lines or a path to
+    a spill file, which can be read with _read_run
+    """
+
+    parts = [[] for _ in range(count)]
+    paths = None
+    size = 0
+    for line in table:
+        parts[_part_number(key(line), count)].append(line)
+        size += 1
+        if buffer_size is not None and size >= buffer_size:
+            if paths is None:
+                paths = _part_files(count)
+            for path, part in zip(paths, parts):
+                if part:
+                    _append_run(path, part)
+            parts = [[] for _ in range(count)]
+            size = 0
+
+    if paths is None:
+        return parts
+    for path, part in zip(paths, parts):
+        if part:
+            _append_run(path, part)
+    return paths
+
+
+def _reduce_part(reducer, columns, strategy, buffer_size, part):
+    operation = Reduce(reducer, columns, buffer_size=buffer_size,
+                       strategy=strategy)
+    lines = _read_run(part) if isinstance(part, str) else part
+    return [(value, list(reducer(bucket)))
+            for value, bucket in operation._buckets(lines)]
+
+
+def _map_chunk(mapper, lines):
+    result = []
+    for line in lines:
+        result.extend(mapper(line))
+    return result
+
+
+def _chain_mappers(mappers, line):
+    lines = (line,)
+    for mapper in mappers:
+        lines = chain.from_iterable(map(mapper, lines))
+    yield from lines
+
+
+def _empty_key(line):
+    return ()
+
+
+def _function_name(function):
+    if isinstance(function, functools.partial):
+        return _function_name(function.func)
+    return getattr(function, '__qualname__', repr(function))
+
+
+def _sorted_prefix(order, keys):
+    """
+    :param order: columns a table is sorted by
+    :param keys: columns kept by an operation
+    :return: longest prefix of order made of keys
+    """
+
+    prefix = []
+    for column in order:
+        if column not in keys:
+            break
+        prefix.append(column)
+    return tuple(prefix)
+
+
+def _check_batch_function(function, name):
+    if not callable(function):
+        raise TypeError('{} must be callable'.format(name))
+    if len(signature(function).parameters) != 1:
+        raise TypeError('{} must take one argument'.format(name))
+
+
+def _batch_rows(batch):
+    """
+    :param batch: result of a batch function -- ColumnarTable,
+    dict of column name and sequence of values, iterable of lines or None
+    :return: iterable of lines
+    """
+
+    if batch is None:
+        return ()
+    if isinstance(batch, ColumnarTable):
+        return batch.to_rows()
+    if isinstance(batch, dict):
+        names = list(batch)
+        values = [column.tolist() if numpy is not None
+                  and isinstance(column, numpy.ndarray) else column
+                  for column in batch.values()]
+        return (dict(zip(names, row)) for row in zip(*values))
+    return batch
+
+
+def _reduce_batch(function, records):
+    columns = {name: [record[name] for record in records]
+               for name in records[0]}
+    yield from _batch_rows(function(columns))
+
+
+def _code_fingerprint(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_fingerprint(const, digest)
+        elif isinstance(const, frozenset):
+            digest.update(repr(sorted(map(repr, const))).encode())
+        else:
+            digest.update(repr(const).encode())
+
+
+def _function_fingerprint(function):
+    """
+    :param function: user function of an operation
+    :return: hex digest of function's qualified name and bytecode
+    """
+
+    digest = hashlib.sha256()
+    digest.update('{}.{}'.format(
+        getattr(function, '__module__', None),
+        getattr(function, '__qualname__', repr(function))).encode())
+    code = getattr(function, '__code__', None)
+    if code is not None:
+        _code_fingerprint(code, digest)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path):
+    """
+    :param path: path to file
+    :return: bytes -- digest of size, modification time and content
+    """
+
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    digest.update('{} {}'.format(stat.st_size, stat.st_mtime_ns).encode())
+    with open(path, 'rb') as input:
+        for block in iter(functools.partial(input.read, 1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _last_line_end(path):
+    """
+    :param path: path to file
+    :return: offset after the last newline of the file, the line after
+    it may be still being written
+    """
+
+    with open(path, 'rb') as input:
+        end = os.fstat(input.fileno()).st_size
+        while end > 0:
+            start = max(0, end - TAIL_SIZE)
+            input.seek(start)
+            position = input.read(end - start).rfind(b'\n')
+            if position != -1:
+                return start + position + 1
+            end = start
+    return 0
+
+
+def _split_file(path, split_size):
+    """
+    Splits a file into byte ranges of about split_size bytes. Every range
+    starts at a beginning of a line and includes the line crossing
+    split_size bytes from its start
+    :param path: path to file
+    :param split_size: number of bytes
+    :return: list of pairs of start and end offsets
+    """
+
+    ranges = []
+    with open(path, 'rb') as input:
+        size = os.fstat(input.fileno()).st_size
+        start = 0
+        while start < size:
+            end = start + split_size
+            if end < size:
+                input.seek(end - 1)
+                while True:
+                    block = input.read(TAIL_SIZE)
+                    position = block.find(b'\n')
+                    if position != -1:
+                        end = input.tell() - len(block) + position + 1
+                        break
+                    if len(block) < TAIL_SIZE:
+                        end = size
+                        break
+            ranges.append((start, min(end, size)))
+            start = end
+    return ranges
+
+
+def _tail_digest(path, offset):
+    """
+    :param path: path to file
+    :param offset: offset in bytes
+    :return: hex digest of TAIL_SIZE bytes before offset
+    """
+
+    with open(path, 'rb') as input:
+        input.seek(max(0, offset - TAIL_SIZE))
+        return hashlib.sha256(
+            input.read(min(offset, TAIL_SIZE))).hexdigest()
+
+
+class ColumnarTable(object):
+    """
+    Table stored as a dict of NumPy arrays, one array per column, with
+    an explicit schema: dict of column name and dtype. Columns of lists
+    (like coordinates) become two-dimensional arrays. Requires numpy
+    """
+
+    def __init__(self, columns, schema=None):
+        """
+        :param columns: dict of column name and array-like of values
+        :param schema: dict of column name and dtype, inferred if None
+        """
+
+        if numpy is None:
+            raise ImportError('numpy is required for columnar tables')
+        schema = schema or {}
+        self.columns = {name: numpy.asarray(values, dtype=schema.get(name))
+                        for name, values in columns.items()}
+        self.schema = {name: values.dtype
+                       for name, values in self.columns.items()}
+        lengths = {len(values) for values in self.columns.values()}
+        if len(lengths) > 1:
+            raise TypeError('Columns must have equal length')
+
+    @classmethod
+    def from_rows(cls, rows, schema):
+        """
+        :param rows: iterable of dict-like lines
+        :param schema: dict of column name and dtype,
+        must describe every column
+        :return: ColumnarTable
+        """
+
+        names = list(schema)
+        values = {name: [] for name in names}
+        appends = [(itemgetter(name), values[name].append) for name in names]
+        for row in rows:
+            if len(row) != len(names):
+                raise TypeError('Schema must describe every column '
+                                'of the table')
+            for get, append in appends:
+                append(get(row))
+        return cls(values, schema)
+
+    def to_rows(self):
+        """
+        :return: yields lines as dicts of python objects
+        """
+
+        names = list(self.columns)
+        values = [self.columns[name].tolist() for name in names]
+        for row in zip(*values):
+            yield dict(zip(names, row))
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        :param tables: list of ColumnarTable with same columns
+        :return: ColumnarTable with lines of all tables
+        """
+
+        return cls({name: numpy.concatenate([table[name]
+                                             for table in tables])
+                    for name in tables[0].columns})
+
+    def take(self, indices):
+        """
+        :param indices: array of indices or a slice
+        :return: ColumnarTable of selected lines
+        """
+
+        return ColumnarTable({name: values[indices]
+                              for name, values in self.columns.items()})
+
+    def __sort_keys(self, keys):
+        sort_keys = []
+        for key in keys:
+            values = self.columns[key]
+            if values.ndim == 1:
+                sort_keys.append(values)
+            else:
+                sort_keys.extend(values.reshape(len(values), -1).T)
+        return sort_keys
+
+    def sort(self, keys):
+        """
+        Stable sort by values in keys, lists are compared
+        lexicographically like in python
+        :param keys: tuple of column names
+        :return: sorted ColumnarTable
+        """
+
+        return self.take(numpy.lexsort(self.__sort_keys(keys)[::-1]))
+
+    def groups(self, keys):
+        """
+        Splits table into groups of lines with equal values in keys
+        :param keys: tuple of column names
+        :return: yields ColumnarTable for every group in order of keys
+        """
+
+        table = self.sort(keys)
+        if len(table) == 0:
+            return
+        changed = numpy.zeros(len(table) - 1, dtype=bool)
+        for values in table.__sort_keys(keys):
+            changed |= values[1:] != values[:-1]
+        bounds = [0] + (numpy.flatnonzero(changed) + 1).tolist() + \
+                 [len(table)]
+        for start, end in zip(bounds, bounds[1:]):
+            yield table.take(slice(start, end))
+
+
 class Operation(object):
     """ Abstract class for operations
     """
 
+    # operation can take ColumnarTable in columnar_call
+    columnar = False
+    # operation reads the whole table before its result is known,
+    # its result is checkpointed
+    materializing = False
+    # operation takes MemoryBudget of the graph in budget argument
+    spilling = False
+
     def __init__(self, _input=None, _output=None):
         self.input = _input
         self.output = _output
@@ -27,6 +966,28 @@ class Operation(object):
         self.table = table
         yield None
 
+    def _release(self):
+        """
+        Drops references to tables of the last call
+        :return:
+        """
+
+        self.table = []
+
+    def fingerprint(self):
+        """
+        :return: tuple of everything that defines result of the operation
+        """
+
+        return (type(self).__name__,)
+
+    def describe(self):
+        """
+        :return: short description of the operation for explain
+        """
+
+        return type(self).__name__
+
     @operation_deprecated
     def set_input(self, _input):
         """
@@ -51,9 +1012,7 @@ class Operation(object):
         :return:
         """
         if isinstance(self.input, str):
-            with open(self.input, 'r') as input:
-                for line in input.readlines():
-                    self.table.append(json.loads(line))
+            self.table.extend(JsonLinesSource(self.input))
 
         if isinstance(self.input, ComputationGraph):
             if self.input.is_counted:
@@ -72,7 +1031,8 @@ class Operation(object):
 
 
 class Map(Operation):
-    def __init__(self, mapper, _input=None, _output=None):
+    def __init__(self, mapper, _input=None, _output=None, workers=None,
+                 chunk_size=CHUNK_SIZE, ordered=True, pushdown=False):
         super().__init__(_input, _output)
         self.mapper = None
         if isgeneratorfunction(mapper):
@@ -84,21 +1044,114 @@ class Map(Operation):
                 raise TypeError("Mapper must take one argument")
         else:
             raise TypeError("Mapper must be a generator function")
+        _check_workers(workers, chunk_size, mapper, 'Mapper')
+        self.mappers = (mapper,)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.ordered = ordered
+        self.pushdown = pushdown
 
     def __call__(self, table):
         """
+        With several workers chunks of table are mapped in worker
+        processes
         :param table: a table to apply map-function on
         :return: for each line in table, yields results from mapper
         """
 
         self.table = table
-        for line in self.table:
-            yield from self.mapper(line)
+        if self.workers is None or self.workers == 1:
+            for line in self.table:
+                yield from self.mapper(line)
+            return
+
+        for lines in _process_chunks(
+                functools.partial(_map_chunk, self.mapper), table,
+                self.workers, self.chunk_size, self.ordered):
+            yield from lines
+
+    def fingerprint(self):
+        return (type(self).__name__,
+                tuple(map(_function_fingerprint, self.mappers)),
+                self.workers is None or self.ordered)
+
+    def describe(self):
+        return 'Map ' + ' + '.join(_function_name(mapper)
+                                   for mapper in self.mappers)
+
+    def fuse(self, other):
+        """
+        :param other: Map applied to results of this one
+        :return: Map applying both mappers to a line in one pass,
+        None if they are computed in different ways
+        """
+
+        workers = self.workers or 1
+        if workers != (other.workers or 1):
+            return None
+        if workers > 1 and (self.chunk_size, self.ordered) != \
+                (other.chunk_size, other.ordered):
+            return None
+        fused = copy.copy(self)
+        fused.mappers = self.mappers + other.mappers
+        fused.mapper = functools.partial(_chain_mappers, fused.mappers)
+        return fused
+
+
+class BatchMap(Operation):
+    columnar = True
+
+    def __init__(self, function, _input=None, _output=None,
+                 batch_size=BATCH_SIZE):
+        super().__init__(_input, _output)
+        _check_batch_function(function, 'Batch mapper')
+        if not (isinstance(batch_size, int) and batch_size > 0):
+            raise TypeError('Batch size must be positive int')
+        self.function = function
+        self.batch_size = batch_size
+
+    def __call__(self, table):
+        """
+        :param table: a table to apply function on
+        :return: for each batch of lines, yields lines of function result
+        """
+
+        self.table = table
+        for batch in _chunks(table, self.batch_size):
+            yield from _batch_rows(self.function(batch))
+
+    def columnar_call(self, table):
+        """
+        :param table: ColumnarTable, function gets its slices
+        :return: ColumnarTable if function returns ColumnarTable,
+        otherwise lines
+        """
+
+        batches = [self.function(table.take(slice(start,
+                                                  start + self.batch_size)))
+                   for start in range(0, len(table), self.batch_size)]
+        if batches and all(isinstance(batch, ColumnarTable)
+                           for batch in batches):
+            return ColumnarTable.concat(batches)
+        return chain.from_iterable(map(_batch_rows, batches))
+
+    def fingerprint(self):
+        return (type(self).__name__, _function_fingerprint(self.function),
+                self.batch_size)
+
+    def describe(self):
+        return 'BatchMap {}'.format(_function_name(self.function))
 
 
 class Sort(Operation):
-    def __init__(self, keys, _input=None, _output=None):
+    columnar = True
+    materializing = True
+    spilling = True
+
+    def __init__(self, keys, _input=None, _output=None,
+                 buffer_size=SORT_BUFFER_SIZE):
         super().__init__(_input, _output)
+        self.buffer_size = buffer_size
         if isinstance(keys, str):
             self.keys = (keys,)
         elif isinstance(keys, tuple):
@@ -110,22 +1163,48 @@ class Sort(Operation):
             raise TypeError('Keys to sort must be string '
                             'or tuple of string')
 
-    def __call__(self, table):
+    def __call__(self, table, budget=None):
         """
         Sorts table in increasing order, using values in self.keys to
-        compare lines
+        compare lines. Tables longer than self.buffer_size or than
+        the memory budget are sorted on disk
         :param table: a table to sort
+        :param budget: MemoryBudget or None
         :return: yields lines from sorted table
         """
 
         self.table = table
-        self.table = sorted(self.table, key=itemgetter(*self.keys))
-        for line in self.table:
-            yield line
+        yield from external_sorted(table, itemgetter(*self.keys),
+                                   self.buffer_size, budget=budget)
+
+    def columnar_call(self, table):
+        """
+        :param table: ColumnarTable
+        :return: ColumnarTable sorted with numpy.lexsort
+        """
+
+        return table.sort(self.keys)
+
+    def fingerprint(self):
+        return type(self).__name__, self.keys
+
+    def describe(self):
+        return 'Sort by {}'.format(self.keys)
+
+
+def _fold_chunk(folder, begin_state, lines):
+    state = copy.deepcopy(begin_state)
+    for line in lines:
+        state = folder(line, state)
+    return state
 
 
 class Fold(Operation):
-    def __init__(self, folder, begin_state, _input=None, _output=None):
+    materializing = True
+    spilling = True
+
+    def __init__(self, folder, begin_state, _input=None, _output=None,
+                 merge=None, workers=None, chunk_size=CHUNK_SIZE):
         super().__init__(_input, _output)
         self.folder = None
         if callable(folder) and not isgeneratorfunction(folder):
@@ -138,24 +1217,600 @@ class Fold(Operation):
         else:
             raise TypeError("Folder must be a callable non-generator"
                             "function")
+        if merge is not None:
+            if not callable(merge) or isgeneratorfunction(merge):
+                raise TypeError("Merge must be a callable non-generator "
+                                "function")
+            if len(signature(merge).parameters) != 2:
+                raise TypeError("Merge function must get 2 arguments")
+        _check_workers(workers, chunk_size, folder, 'Folder')
+        if workers is not None and workers > 1 and merge is None:
+            raise TypeError("Merge function is required to fold "
+                            "in workers")
+        self.begin_state = begin_state
         self.state = begin_state
+        self.merge = merge
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def __call__(self, table, budget=None):
+        """
+        Applies fold function to a table, starting from a copy of
+        begin_state, updates state with result.
+        With several workers chunks of the table are folded in worker
+        processes and their states are merged pairwise, in order
+        :param table: A table to apply function
+        :param budget: MemoryBudget, size of the state is reserved in it.
+        The state can not be spilled, so it is only reported
+        :return: yields new state
+        """
+
+        self.table = table
+        if self.workers is None or self.workers == 1:
+            if budget is None:
+                self.state = _fold_chunk(self.folder, self.begin_state,
+                                         table)
+            else:
+                self.state = self.__reported_fold(table, budget)
+            yield self.state
+            return
+
+        # states of 2 ** level chunks, merged like a binary counter
+        levels = []
+        for state in _process_chunks(
+                functools.partial(_fold_chunk, self.folder,
+                                  self.begin_state),
+                table, self.workers, self.chunk_size):
+            level = 0
+            while levels and levels[-1][0] == level:
+                state = self.merge(levels.pop()[1], state)
+                level += 1
+            levels.append((level, state))
+
+        if not levels:
+            self.state = copy.deepcopy(self.begin_state)
+        else:
+            self.state = levels.pop()[1]
+            while levels:
+                self.state = self.merge(levels.pop()[1], self.state)
+        yield self.state
+
+    def __reported_fold(self, table, budget):
+        """
+        Folds table, size of the state is measured after 2 ** n lines
+        and reserved in budget
+        :return: state
+        """
+
+        state = copy.deepcopy(self.begin_state)
+        reserved = _deep_size(state)
+        budget.reserve(reserved)
+        try:
+            number = 0
+            for number, line in enumerate(table, 1):
+                state = self.folder(line, state)
+                if number & (number - 1) == 0:
+                    size = _deep_size(state)
+                    budget.reserve(size - reserved)
+                    reserved = size
+            if number & (number - 1) != 0:
+                size = _deep_size(state)
+                budget.reserve(size - reserved)
+                reserved = size
+            return state
+        finally:
+            budget.release(reserved)
+
+    def fingerprint(self):
+        return (type(self).__name__, _function_fingerprint(self.folder),
+                repr(self.begin_state))
+
+    def describe(self):
+        return 'Fold {}'.format(_function_name(self.folder))
+
+
+class Combine(Operation):
+    def __init__(self, merge, keys, _input=None, _output=None,
+                 buffer_size=COMBINE_BUFFER_SIZE):
+        super().__init__(_input, _output)
+        if callable(merge) and not isgeneratorfunction(merge):
+            if len(signature(merge).parameters) != 2:
+                raise TypeError("Merge function must get 2 arguments")
+        else:
+            raise TypeError("Merge must be a callable non-generator "
+                            "function")
+        self.merge = merge
+        if isinstance(keys, str):
+            self.keys = (keys,)
+        elif isinstance(keys, tuple):
+            for key in keys:
+                if not isinstance(key, str):
+                    raise TypeError('Keys must be strings')
+            self.keys = keys
+        else:
+            raise TypeError('Keys to combine must be string '
+                            'or tuple of string')
+        if not (isinstance(buffer_size, int) and buffer_size > 0):
+            raise TypeError('Buffer size must be positive int')
+        self.buffer_size = buffer_size
+
+    def __call__(self, table):
+        """
+        Merges lines with equal keys with associative merge function.
+        Lines are combined until buffer_size different keys are met,
+        then combined lines are passed further and combining starts over,
+        so equal keys may still occur in result
+        :param table: A table to apply function
+        :return: yields combined lines
+        """
+
+        self.table = table
+        key = itemgetter(*self.keys)
+        combined = {}
+        for line in table:
+            value = key(line)
+            current = combined.get(value)
+            if current is None:
+                if len(combined) >= self.buffer_size:
+                    yield from combined.values()
+                    combined = {}
+                combined[value] = line
+            else:
+                combined[value] = self.merge(current, line)
+        yield from combined.values()
+
+    def fingerprint(self):
+        return type(self).__name__, _function_fingerprint(self.merge), \
+               self.keys, self.buffer_size
+
+    def describe(self):
+        return 'Combine {} by {}'.format(_function_name(self.merge),
+                                         self.keys)
+
+
+class _Aggregation(object):
+    """
+    Aggregation of one column, state of a key is updated by every line
+    and partial states of one key can be merged
+    """
+
+    def __init__(self, column, name):
+        self.column = column
+        self.name = name
+
+    def start(self):
+        return None
+
+    def update(self, state, line):
+        return state
+
+    def merge(self, first, second):
+        return first
+
+    def result(self, state):
+        return state
+
+    def fingerprint(self):
+        return type(self).__name__, self.column, self.name
+
+
+class _Count(_Aggregation):
+    def start(self):
+        return 0
+
+    def update(self, state, line):
+        return state + 1
+
+    def merge(self, first, second):
+        return first + second
+
+
+class _Sum(_Aggregation):
+    def start(self):
+        return 0
+
+    def update(self, state, line):
+        return state + line[self.column]
+
+    def merge(self, first, second):
+        return first + second
+
+
+class _Mean(_Aggregation):
+    def start(self):
+        return 0, 0
+
+    def update(self, state, line):
+        return state[0] + line[self.column], state[1] + 1
+
+    def merge(self, first, second):
+        return first[0] + second[0], first[1] + second[1]
+
+    def result(self, state):
+        return state[0] / state[1]
+
+
+class _Min(_Aggregation):
+    def update(self, state, line):
+        value = line[self.column]
+        return value if state is None or value < state else state
+
+    def merge(self, first, second):
+        if first is None:
+            return second
+        return first if second is None or first <= second else second
+
+
+class _Max(_Aggregation):
+    def update(self, state, line):
+        value = line[self.column]
+        return value if state is None or value > state else state
+
+    def merge(self, first, second):
+        if first is None:
+            return second
+        return first if second is None or first >= second else second
+
+
+class _CountDistinct(_Aggregation):
+    def start(self):
+        return set()
+
+    def update(self, state, line):
+        state.add(line[self.column])
+        return state
+
+    def merge(self, first, second):
+        first |= second
+        return first
+
+    def result(self, state):
+        return len(state)
+
+
+AGGREGATIONS = {
+    'sum': _Sum,
+    'mean': _Mean,
+    'min': _Min,
+    'max': _Max,
+    'count_distinct': _CountDistinct,
+}
+
+
+def _aggregate_chunk(keys, aggregations, lines):
+    return Aggregate(keys, aggregations).partial(lines)
+
+
+class Aggregate(Operation):
+    materializing = True
+    spilling = True
+
+    def __init__(self, keys, aggregations, _input=None, _output=None,
+                 workers=None, chunk_size=CHUNK_SIZE):
+        """
+        :param keys: column or tuple of columns to group lines by,
+        empty tuple -- aggregate whole table
+        :param aggregations: list of _Aggregation
+        :param workers: number of worker processes computing partial
+        aggregates of chunks
+        :param chunk_size: number of lines in a chunk
+        """
+
+        super().__init__(_input, _output)
+        if isinstance(keys, str):
+            self.keys = (keys,)
+        elif isinstance(keys, tuple):
+            for key in keys:
+                if not isinstance(key, str):
+                    raise TypeError('Keys must be strings')
+            self.keys = keys
+        else:
+            raise TypeError('Keys to aggregate must be string '
+                            'or tuple of string')
+        if not aggregations:
+            raise TypeError('At least one aggregation must be stated')
+        self.aggregations = aggregations
+        _check_workers(workers, chunk_size, None, 'Aggregation')
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.key = itemgetter(*self.keys) if self.keys else _empty_key
+
+    def __call__(self, table, budget=None):
+        """
+        Aggregates lines with equal keys in one pass, keeping one state
+        per key and aggregation
+        :param table: A table to aggregate
+        :param budget: MemoryBudget, when states do not fit in it they
+        are aggregated in parts, see __spilled
+        :return: yields a line for every key, in order of first appearance
+        """
+
+        self.table = table
+        if budget is not None and (self.workers or 1) == 1:
+            key = self.key
+            yield from self.__spilled(((key(line), line) for line in table),
+                                      budget)
+            return
+        if self.workers is None or self.workers == 1:
+            states = self.partial(table)
+        else:
+            states = {}
+            for chunk_states in _process_chunks(
+                    functools.partial(_aggregate_chunk, self.keys,
+                                      self.aggregations),
+                    table, self.workers, self.chunk_size):
+                self.merge(states, chunk_states)
+        yield from self.lines(states)
+
+    def partial(self, table):
+        """
+        :param table: iterable of lines
+        :return: dict of key value and list of states of aggregations
+        """
+
+        states = {}
+        key = self.key
+        aggregations = self.aggregations
+        for line in table:
+            value = key(line)
+            state = states.get(value)
+            if state is None:
+                state = [aggregation.start() for aggregation in aggregations]
+                states[value] = state
+            for i, aggregation in enumerate(aggregations):
+                state[i] = aggregation.update(state[i], line)
+        return states
+
+    def merge(self, states, other):
+        """
+        Merges partial states other into states
+        :param states: dict of key value and list of states
+        :param other: dict of key value and list of states
+        :return: states
+        """
+
+        for value, other_state in other.items():
+            state = states.get(value)
+            if state is None:
+                states[value] = other_state
+            else:
+                for i, aggregation in enumerate(self.aggregations):
+                    state[i] = aggregation.merge(state[i], other_state[i])
+        return states
+
+    def __spilled(self, items, budget, merge=False, level=0):
+        """
+        Partitioned hash aggregation: when states do not fit in budget,
+        they are spilled to SPILL_PARTITIONS files by hash of keys and
+        every file is aggregated in its own pass. Keys go in order of
+        first appearance within a file then
+        :param items: iterable of pairs of key value and line,
+        or partial states with merge
+        :param budget: MemoryBudget
+        :param merge: items are partial states
+        :param level: number of times states were spilled before
+        :return: yields resulting lines
+        """
+
+        states = {}
+        paths = None
+        sizes = _Sizes()
+        reserved = 0
+        aggregations = self.aggregations
+        try:
+            for value, item in items:
+                state = states.get(value)
+                if state is None:
+                    if merge:
+                        state = item
+                    else:
+                        state = [aggregation.start()
+                                 for aggregation in aggregations]
+                    states[value] = state
+                    size = sizes((value, state))
+                    reserved += size
+                    budget.reserve(size)
+                elif merge:
+                    for i, aggregation in enumerate(aggregations):
+                        state[i] = aggregation.merge(state[i], item[i])
+                if not merge:
+                    for i, aggregation in enumerate(aggregations):
+                        state[i] = aggregation.update(state[i], item)
+                if level < SPILL_LEVELS and budget.full(reserved):
+                    if paths is None:
+                        paths = _part_files(SPILL_PARTITIONS)
+                    _spill_parts(paths, states.items(), itemgetter(0),
+                                 level)
+                    states = {}
+                    budget.release(reserved)
+                    reserved = 0
+
+            if paths is None:
+                yield from self.lines(states)
+                return
+            _spill_parts(paths, states.items(), itemgetter(0), level)
+            states = {}
+            budget.release(reserved)
+            reserved = 0
+            for path in paths:
+                yield from self.__spilled(_read_run(path), budget, True,
+                                          level + 1)
+        finally:
+            budget.release(reserved)
+            if paths is not None:
+                _remove_files(paths)
+
+    def lines(self, states):
+        """
+        :param states: dict of key value and list of states
+        :return: yields resulting lines
+        """
+
+        for value, state in states.items():
+            if len(self.keys) == 1:
+                value = (value,)
+            line = dict(zip(self.keys, value))
+            for aggregation, aggregation_state in zip(self.aggregations,
+                                                      state):
+                line[aggregation.name] = aggregation.result(
+                    aggregation_state)
+            yield line
+
+    def fingerprint(self):
+        return (type(self).__name__, self.keys,
+                tuple(aggregation.fingerprint()
+                      for aggregation in self.aggregations))
+
+    def describe(self):
+        return 'Aggregate by {}'.format(self.keys)
+
+
+class _Reversed(object):
+    """
+    Wrapper of a value with reversed comparison
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+
+def _top_chunk(k, by, group_by, descending, lines):
+    top = TopK(k, by, group_by, descending)
+    return top.select(enumerate(lines))
+
+
+class TopK(Operation):
+    materializing = True
+
+    def __init__(self, k, by, group_by=(), descending=True,
+                 _input=None, _output=None, workers=None,
+                 chunk_size=CHUNK_SIZE):
+        """
+        :param k: number of lines to keep
+        :param by: column or tuple of columns to compare lines
+        :param group_by: column or tuple of columns, k lines are kept
+        for every value of them, empty tuple -- for the whole table
+        :param descending: keep the largest lines, otherwise the smallest
+        :param workers: number of worker processes selecting top lines of
+        chunks, which are merged afterwards
+        :param chunk_size: number of lines in a chunk
+        """
+
+        super().__init__(_input, _output)
+        if not (isinstance(k, int) and k > 0):
+            raise TypeError('Number of lines must be positive int')
+        self.k = k
+        columns = []
+        for keys in (by, group_by):
+            if isinstance(keys, str):
+                keys = (keys,)
+            elif isinstance(keys, tuple):
+                for key in keys:
+                    if not isinstance(key, str):
+                        raise TypeError('Keys must be strings')
+            else:
+                raise TypeError('Keys must be string or tuple of string')
+            columns.append(keys)
+        self.by, self.group_by = columns
+        if not self.by:
+            raise TypeError('Columns to compare lines must be stated')
+        self.descending = descending
+        _check_workers(workers, chunk_size, None, 'TopK')
+        self.workers = workers
+        self.chunk_size = chunk_size
 
     def __call__(self, table):
         """
-        Applies fold function to a table, updates state with result
-        :param table: A table to apply function
-        :return: yields new state
+        Keeps k largest (or smallest) lines of every group in bounded
+        heaps, equal lines are taken in order of the table
+        :param table: A table to select lines from
+        :return: yields selected lines of each group, best first,
+        groups in order of first appearance
+        """
+
+        self.table = table
+        if self.workers is None or self.workers == 1:
+            tops = self.select(enumerate(table))
+        else:
+            def lines():
+                chunks = _process_chunks(
+                    functools.partial(_top_chunk, self.k, self.by,
+                                      self.group_by, self.descending),
+                    table, self.workers, self.chunk_size)
+                for number, chunk_tops in enumerate(chunks):
+                    offset = number * self.chunk_size
+                    for top in chunk_tops.values():
+                        for index, line in top:
+                            yield offset + index, line
+
+            tops = self.select(lines())
+
+        for top in tops.values():
+            for _, line in top:
+                yield line
+
+    def select(self, lines):
+        """
+        :param lines: iterable of pairs of index and line
+        :return: dict of group value and list of pairs of index and line,
+        best first
         """
 
-        self.table = table
-        for line in self.table:
-            self.state = self.folder(line, self.state)
-        yield self.state
+        key = itemgetter(*self.by)
+        group = itemgetter(*self.group_by) if self.group_by \
+            else lambda line: ()
+        heaps = {}
+        for index, line in lines:
+            rank = key(line) if self.descending else _Reversed(key(line))
+            # indices are unique, so lines are never compared
+            item = (rank, -index, line)
+            heap = heaps.setdefault(group(line), [])
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return {value: [(-index, line)
+                        for _, index, line in sorted(heap, reverse=True)]
+                for value, heap in heaps.items()}
+
+    def fingerprint(self):
+        return (type(self).__name__, self.k, self.by, self.group_by,
+                self.descending)
+
+    def describe(self):
+        return 'TopK {} by {}{}'.format(
+            self.k, self.by,
+            ' in groups by {}'.format(self.group_by) if self.group_by
+            else '')
 
 
 class Reduce(Operation):
-    def __init__(self, reducer, columns, _input=None, _output=None):
+    columnar = True
+    materializing = True
+    spilling = True
+
+    def __init__(self, reducer, columns, _input=None, _output=None,
+                 buffer_size=SORT_BUFFER_SIZE, strategy='sort',
+                 ordered=False, workers=None):
         super().__init__(_input, _output)
+        self.buffer_size = buffer_size
+        if strategy not in ['sort', 'hash']:
+            raise TypeError('Strategy is not supported')
+        if ordered:
+            strategy = 'sort'
+        self.strategy = strategy
+        self.ordered = ordered
         self.reducer = None
         if isgeneratorfunction(reducer):
             sig = signature(reducer)
@@ -177,42 +1832,224 @@ class Reduce(Operation):
         else:
             raise TypeError('Reducers columns must be '
                             'string or tuple of string')
+        _check_workers(workers, CHUNK_SIZE, reducer, 'Reducer')
+        self.workers = workers
 
-    def __call__(self, table):
+    def __call__(self, table, presorted=False, budget=None):
         """
         Applies reduce function to table in following way:
         sorts table,
         creates blocks with equal values in stated columns
-        yields folder result on each block
+        yields folder result on each block.
+        With hash strategy blocks are collected in a dict instead of
+        sorting, in order of the first appearance of their keys.
+        With several workers the table is split into parts by hash of
+        keys and every part is reduced in its own process, ordered
+        results of parts are merged by keys
         :param table: A table to apply function
+        :param presorted: table is already sorted by columns,
+        sort strategy does not sort it again
+        :param budget: MemoryBudget, sort strategy spills runs of sorting
+        when it is full, hash strategy reduces in parts, see
+        __spilled_buckets. Workers do not use it
         :return: yields results from reducer
         """
 
         self.table = table
-        self.table = sorted(self.table, key=itemgetter(*self.columns))
-
-        def check_equal(first_line, second_line):
-            equal = True
-            for column in self.columns:
-                equal &= (first_line[column] == second_line[column])
-            return equal
-
-        bucket = []
-        for line in self.table:
-            if len(bucket) == 0:
-                bucket.append(line)
-                continue
-            if check_equal(bucket[-1], line):
-                bucket.append(line)
-            else:
+        if self.workers is None or self.workers == 1:
+            for _, bucket in self._buckets(table, presorted, budget):
                 yield from self.reducer(bucket)
-                bucket = [line]
+            return
+
+        parts = _partition(table, itemgetter(*self.columns), self.workers,
+                           self.buffer_size)
+        try:
+            with ProcessPoolExecutor(self.workers) as pool:
+                futures = [pool.submit(_reduce_part, self.reducer,
+                                       self.columns, self.strategy,
+                                       self.buffer_size, part)
+                           for part in parts]
+                if self.ordered:
+                    results = [future.result() for future in futures]
+                    for _, lines in heapq.merge(*results, key=itemgetter(0)):
+                        yield from lines
+                else:
+                    for future in as_completed(futures):
+                        for _, lines in future.result():
+                            yield from lines
+        finally:
+            for part in parts:
+                if isinstance(part, str) and os.path.exists(part):
+                    os.remove(part)
+
+    def columnar_call(self, table):
+        """
+        Groups ColumnarTable with numpy, every group is passed to
+        reducer as a list of lines
+        :param table: ColumnarTable
+        :return: yields results from reducer
+        """
+
+        if self.workers is not None and self.workers > 1:
+            yield from self(table.to_rows())
+            return
+        for group in table.groups(self.columns):
+            yield from self.reducer(list(group.to_rows()))
+
+    def _buckets(self, table, presorted=False, budget=None):
+        """
+        :param table: A table to split
+        :param presorted: table is already sorted by columns
+        :param budget: MemoryBudget or None. A bucket is passed to
+        reducer whole, so its size is only reserved
+        :return: yields pairs of key value and list of lines
+        with this key value
+        """
+
+        key = itemgetter(*self.columns)
+
+        if self.strategy == 'hash' and budget is not None:
+            yield from self.__spilled_buckets(table, key, budget)
+            return
+        if self.strategy == 'hash':
+            buckets = {}
+            for line in table:
+                value = key(line)
+                bucket = buckets.get(value)
+                if bucket is None:
+                    buckets[value] = [line]
+                else:
+                    bucket.append(line)
+            for value in list(buckets):
+                yield value, buckets.pop(value)
+            return
+
+        if not presorted:
+            table = external_sorted(table, key, self.buffer_size,
+                                    budget=budget)
+        sizes = _Sizes()
+        for value, bucket in groupby(table, key=key):
+            bucket = list(bucket)
+            if budget is None:
+                yield value, bucket
+                continue
+            reserved = sum(map(sizes, bucket))
+            budget.reserve(reserved)
+            try:
+                yield value, bucket
+            finally:
+                budget.release(reserved)
+
+    def __spilled_buckets(self, table, key, budget, level=0):
+        """
+        Hash grouping in parts: when buckets do not fit in budget, their
+        lines are spilled to SPILL_PARTITIONS files by hash of keys and
+        every file is grouped in its own pass. Buckets go in order of
+        first appearance within a file then
+        :param table: iterable of lines
+        :param key: function to get value of keys from a line
+        :param budget: MemoryBudget
+        :param level: number of times lines were spilled before
+        :return: yields pairs of key value and list of lines
+        """
+
+        buckets = {}
+        paths = None
+        sizes = _Sizes()
+        reserved = 0
+        try:
+            for line in table:
+                value = key(line)
+                bucket = buckets.get(value)
+                if bucket is None:
+                    buckets[value] = [line]
+                else:
+                    bucket.append(line)
+                size = sizes(line)
+                reserved += size
+                budget.reserve(size)
+                if level < SPILL_LEVELS and budget.full(reserved):
+                    if paths is None:
+                        paths = _part_files(SPILL_PARTITIONS)
+                    _spill_parts(paths, chain.from_iterable(
+                        buckets.values()), key, level)
+                    buckets = {}
+                    budget.release(reserved)
+                    reserved = 0
+
+            if paths is None:
+                for value in list(buckets):
+                    yield value, buckets.pop(value)
+                return
+            _spill_parts(paths, chain.from_iterable(buckets.values()), key,
+                         level)
+            buckets = {}
+            budget.release(reserved)
+            reserved = 0
+            for path in paths:
+                yield from self.__spilled_buckets(_read_run(path), key,
+                                                  budget, level + 1)
+        finally:
+            budget.release(reserved)
+            if paths is not None:
+                _remove_files(paths)
+
+    def fingerprint(self):
+        return (type(self).__name__, _function_fingerprint(self.reducer),
+                self.columns, self.strategy,
+                self.workers is None or self.ordered)
+
+    def describe(self):
+        return 'Reduce {} by {}, {}'.format(_function_name(self.reducer),
+                                            self.columns, self.strategy)
+
+
+class BatchReduce(Reduce):
+    def __init__(self, function, columns, _input=None, _output=None,
+                 buffer_size=SORT_BUFFER_SIZE, strategy='sort',
+                 ordered=False, workers=None):
+        _check_batch_function(function, 'Batch reducer')
+        self.function = function
+        super().__init__(functools.partial(_reduce_batch, function), columns,
+                         _input, _output, buffer_size, strategy, ordered,
+                         workers)
+
+    def columnar_call(self, table):
+        """
+        Groups ColumnarTable with numpy, function gets columns of every
+        group as numpy arrays
+        :param table: ColumnarTable
+        :return: yields lines of function results
+        """
+
+        if self.workers is not None and self.workers > 1:
+            yield from self(table.to_rows())
+            return
+        for group in table.groups(self.columns):
+            yield from _batch_rows(self.function(group.columns))
+
+    def fingerprint(self):
+        return (type(self).__name__, _function_fingerprint(self.function),
+                self.columns, self.strategy,
+                self.workers is None or self.ordered)
+
+    def describe(self):
+        return 'BatchReduce {} by {}, {}'.format(
+            _function_name(self.function), self.columns, self.strategy)
 
 
 class Join(Operation):
+    materializing = True
+    spilling = True
+
     def __init__(self, on, keys, strategy,
-                 _input=None, _output=None):
+                 _input=None, _output=None, buffer_size=SORT_BUFFER_SIZE,
+                 method='merge'):
         super().__init__(_input, _output)
+        self.buffer_size = buffer_size
+        if method not in ['merge', 'hash']:
+            raise TypeError('Join method is not supported')
+        self.method = method
         self.on = on
         if not isinstance(keys, tuple):
             raise TypeError('Join columns must be tuple')
@@ -223,205 +2060,1095 @@ class Join(Operation):
         if len(self.keys) == 0:
             if self.strategy == 'outer':
                 self.strategy = 'cross'
+        self.key = itemgetter(*self.keys) if self.keys else _empty_key
 
-    def __call__(self, table):
+    def __call__(self, table, to_join=None, sorted_left=False,
+                 sorted_right=False, columns=None, budget=None):
         """
         Joins table with table from stated graph,
-        graph must be counted before use
+        graph must be counted before use if to_join is not given.
+        merge method: both tables are sorted by join keys and walked
+        together, lines with equal keys are joined group by group.
+        hash method: lines of the shorter table are put in a dict by keys
+        and the other table is streamed through it, result goes in
+        order of the streamed table
         :param table: A table to join graph result with
-        :return: resulting table
+        :param to_join: result of the stated graph, computed elsewhere
+        :param sorted_left: table is already sorted by join keys,
+        merge method does not sort it again
+        :param sorted_right: to_join is already sorted by join keys
+        :param columns: pair of lines of the left and the right table,
+        or None, which name columns of the result instead of the first
+        lines of the tables
+        :param budget: MemoryBudget, merge method spills runs of sorting
+        when it is full, hash method joins tables in parts when the build
+        side read from table does not fit in it, see __join_hashed
+        :return: yields lines of resulting table
         """
 
         self.table = table
-        if not self.on.is_counted:
-            raise RuntimeError("Graph must be computed before use in join")
-
-        self.to_join = self.on.result
-
-        if len(self.keys) > 0:
-            self.table = sorted(self.table, key=itemgetter(*self.keys))
-            self.to_join = sorted(self.to_join, key=itemgetter(*self.keys))
-
-        common = (set(self.table[0].keys()) & set(self.to_join[0].keys())) \
-                 - set(self.keys)
-
-        for column in common:
-            for left in self.table:
-                left["left_" + column] = left.pop(column)
-
-            for right in self.to_join:
-                right["right_" + column] = right.pop(column)
-
-        self.left_keys = list(self.table[0].keys())
-        self.right_keys = list(self.to_join[0].keys())
-
-        if self.strategy == "inner":
-            return list(self.__inner_join())
-        elif self.strategy == "left":
-            return list(self.__left_join())
-        elif self.strategy == "right":
-            return list(self.__right_join())
-        elif self.strategy == "outer":
-            return list(self.__outer_join())
-        elif self.strategy == "cross":
-            return list(self.__cross_join())
-
-    def __apply_reducer(self, table, reducer, keys):
-        if len(keys) > 1:
-            table = sorted(table, key=itemgetter(*keys))
-
-        def check_equil(first_line, second_line):
-            equal = True
-            for column in keys:
-                equal &= (first_line[column] == second_line[column])
-            return equal
-
-        bucket = []
-        for line in table:
-            if len(bucket) == 0:
-                bucket.append(line)
-                continue
-            if check_equil(bucket[-1], line):
-                bucket.append(line)
-            else:
-                yield from reducer(bucket)
-                bucket = [line]
+        if to_join is None:
+            if not self.on.is_counted:
+                raise RuntimeError("Graph must be computed before use "
+                                   "in join")
+            to_join = self.on.result
+
+        self.to_join = to_join
+
+        table = iter(table)
+        first = next(table, None)
+        if first is not None:
+            table = chain([first], table)
+        if columns is None:
+            columns = (first, self.to_join[0] if self.to_join else None)
+        self.__set_columns(*columns)
+
+        if self.strategy == "cross":
+            yield from self.__cross_join(table)
+        elif self.method == "hash":
+            yield from self.__hash_join(table, budget)
+        else:
+            yield from self.__merge_join(table, sorted_left, sorted_right,
+                                         budget)
+
+    def fingerprint(self):
+        return type(self).__name__, self.keys, self.strategy, self.method
+
+    def _release(self):
+        super()._release()
+        self.to_join = None
+
+    def describe(self):
+        return 'Join {} by {}, {}'.format(self.strategy, self.keys,
+                                          self.method)
 
-    def __inner_reducer(self, records):
+    def __set_columns(self, left, right):
         """
-        Reducer to use in inner join strategy
-        :param records:
+        Finds columns, which are present in both tables and are not keys,
+        they are renamed to left_column and right_column in result
+        :param left: first line of left table or None if it is empty
+        :param right: first line of right table or None if it is empty
         :return:
         """
 
-        if len(records) > 1:
-            first_elem_keys = records[0].keys()
-            second_elem_keys = records[1].keys()
-            neq_found = False
-
-            for first_key, second_key in zip(first_elem_keys,
-                                             second_elem_keys):
-                if first_key != second_key:
-                    neq_found = True
-                    break
-
-            if neq_found:
-                for value in records[1:]:
-                    value.update(records[0])
-                    new_line = {}
-                    for key in sorted(value):
-                        new_line[key] = value[key]
-                    yield new_line
+        left = left or {}
+        right = right or {}
+        self.common = (set(left) & set(right)) - set(self.keys)
+        self.left_keys = [self.__column(column, 'left_') for column in left]
+        self.right_keys = [self.__column(column, 'right_')
+                           for column in right]
+        self.left_nulls = {key: None for key in self.left_keys
+                           if key not in self.right_keys}
+        self.right_nulls = {key: None for key in self.right_keys
+                            if key not in self.left_keys}
+
+    def __column(self, column, prefix):
+        return prefix + column if column in self.common else column
+
+    def __line(self, left, right):
+        """
+        Builds a line of the result from lines of both tables,
+        missing side is filled with None
+        :param left: line from left table or None
+        :param right: line from right table or None
+        :return: line with columns in sorted order
+        """
+
+        line = {}
+        if left is None:
+            line.update(self.left_nulls)
+        else:
+            for column, value in left.items():
+                line[self.__column(column, 'left_')] = value
+        if right is None:
+            line.update(self.right_nulls)
+        else:
+            for column, value in right.items():
+                line[self.__column(column, 'right_')] = value
+
+        new_line = {}
+        for key in sorted(line):
+            new_line[key] = line[key]
+        return new_line
+
+    def __merge_join(self, table, sorted_left, sorted_right, budget=None):
+        keep_left = self.strategy in ('left', 'outer')
+        keep_right = self.strategy in ('right', 'outer')
+
+        if not sorted_left:
+            table = external_sorted(table, self.key, self.buffer_size,
+                                    budget=budget)
+        to_join = self.to_join
+        if not sorted_right:
+            to_join = external_sorted(to_join, self.key, self.buffer_size,
+                                      budget=budget)
+        left_groups = groupby(table, key=self.key)
+        right_groups = groupby(to_join, key=self.key)
+        left = next(left_groups, None)
+        right = next(right_groups, None)
+
+        while left is not None and right is not None:
+            if left[0] < right[0]:
+                if keep_left:
+                    for line in left[1]:
+                        yield self.__line(line, None)
+                left = next(left_groups, None)
+            elif right[0] < left[0]:
+                if keep_right:
+                    for line in right[1]:
+                        yield self.__line(None, line)
+                right = next(right_groups, None)
             else:
-                for value in records[:-1]:
-                    value.update(records[-1])
-                    new_line = {}
-                    for key in sorted(value):
-                        new_line[key] = value[key]
-                    yield new_line
+                right_lines = list(right[1])
+                for line in left[1]:
+                    for right_line in right_lines:
+                        yield self.__line(line, right_line)
+                left = next(left_groups, None)
+                right = next(right_groups, None)
+
+        while keep_left and left is not None:
+            for line in left[1]:
+                yield self.__line(line, None)
+            left = next(left_groups, None)
+        while keep_right and right is not None:
+            for line in right[1]:
+                yield self.__line(None, line)
+            right = next(right_groups, None)
+
+    def __hash_join(self, table, budget=None):
+        # left table is read until it turns out to be longer than
+        # the right one, the shorter table is the build side
+        head, reserved = self.__buffered(
+            islice(table, len(self.to_join) + 1), budget)
+        if reserved is None:
+            yield from self.__join_parts(head, table, self.to_join, False,
+                                         budget)
+            return
+        if budget is not None:
+            budget.release(reserved)
+
+        if len(head) <= len(self.to_join):
+            yield from self.__join_hashed(head, self.to_join, False, budget)
+        else:
+            # to_join is held in memory by its graph anyway, spilling it
+            # would only add a copy, so its size is only reserved
+            yield from self.__join_hashed(self.to_join, chain(head, table),
+                                          True, budget, resident=True)
 
-    def __left_reducer(self, records):
+    @staticmethod
+    def __buffered(lines, budget):
         """
-        Reducer to use in left join strategy
-        :param records:
-        :return:
+        :param lines: iterator of lines
+        :param budget: MemoryBudget or None
+        :return: list of lines read until the budget got full and number
+        of bytes reserved for them, None if it got full, the reservation
+        is released then
+        """
+
+        buffer = []
+        sizes = _Sizes()
+        reserved = 0
+        for line in lines:
+            buffer.append(line)
+            if budget is None:
+                continue
+            size = sizes(line)
+            budget.reserve(size)
+            reserved += size
+            if budget.full(reserved):
+                budget.release(reserved)
+                return buffer, None
+        return buffer, reserved
+
+    def __join_hashed(self, build, probe, swapped, budget=None, level=0,
+                      resident=False):
         """
+        :param build: iterable of lines put in a dict by keys
+        :param probe: iterable of lines of the other table
+        :param swapped: build is the right table
+        :param budget: MemoryBudget, when build does not fit in it,
+        tables are joined in parts, see __join_parts
+        :param level: number of times tables were spilled before
+        :param resident: build is a list kept in memory elsewhere,
+        so it is never spilled
+        :return: yields lines of resulting table
+        """
+
+        reserved = 0
+        if budget is not None and (resident or level >= SPILL_LEVELS):
+            build = build if resident else list(build)
+            reserved = sum(map(_Sizes(), build))
+            budget.reserve(reserved)
+        elif budget is not None:
+            rest = iter(build)
+            build, reserved = self.__buffered(rest, budget)
+            if reserved is None:
+                yield from self.__join_parts(build, rest, probe, swapped,
+                                             budget, level)
+                return
+
+        if swapped:
+            keep_build = self.strategy in ('right', 'outer')
+            keep_probe = self.strategy in ('left', 'outer')
+
+            def line(build_line, probe_line):
+                return self.__line(probe_line, build_line)
+        else:
+            keep_build = self.strategy in ('left', 'outer')
+            keep_probe = self.strategy in ('right', 'outer')
+
+            def line(build_line, probe_line):
+                return self.__line(build_line, probe_line)
 
-        if len(records) > 1:
-            yield from self.__inner_reducer(records)
+        try:
+            yield from self.__probe(build, probe, keep_build, keep_probe,
+                                    line)
+        finally:
+            if budget is not None:
+                budget.release(reserved)
 
-        if len(records) == 1:
-            for k1, k2 in zip(records[0].keys(), self.left_keys):
-                if k1 != k2:
-                    break
+    def __join_parts(self, build, rest, probe, swapped, budget, level=0):
+        """
+        Grace hash join: both tables are spilled to SPILL_PARTITIONS files
+        by hash of keys and files are joined pairwise. Result goes in order
+        of probe within a pair of files
+        :param build: list of lines of the build side read so far,
+        it is emptied once spilled
+        :param rest: iterator of other lines of the build side
+        :param probe: iterable of lines of the other table
+        :param swapped: build is the right table
+        :param budget: MemoryBudget
+        :param level: number of times tables were spilled before
+        :return: yields lines of resulting table
+        """
+
+        paths = _part_files(2 * SPILL_PARTITIONS)
+        try:
+            _spill_parts(paths[:SPILL_PARTITIONS], build, self.key, level)
+            build.clear()
+            _spill_parts(paths[:SPILL_PARTITIONS], rest, self.key, level)
+            _spill_parts(paths[SPILL_PARTITIONS:], probe, self.key, level)
+            for build_path, probe_path in zip(paths[:SPILL_PARTITIONS],
+                                              paths[SPILL_PARTITIONS:]):
+                yield from self.__join_hashed(
+                    _read_run(build_path), _read_run(probe_path), swapped,
+                    budget, level + 1)
+        finally:
+            _remove_files(paths)
+
+    def __probe(self, build, probe, keep_build, keep_probe, line):
+        groups = {}
+        for build_line in build:
+            value = self.key(build_line)
+            group = groups.get(value)
+            if group is None:
+                groups[value] = [build_line]
             else:
-                records[0].update({key: None for key in self.right_keys
-                                   if key not in self.left_keys})
+                group.append(build_line)
+
+        matched = set()
+        for probe_line in probe:
+            value = self.key(probe_line)
+            group = groups.get(value)
+            if group is None:
+                if keep_probe:
+                    yield line(None, probe_line)
+                continue
+            if keep_build:
+                matched.add(value)
+            for build_line in group:
+                yield line(build_line, probe_line)
+
+        if keep_build:
+            for value, group in groups.items():
+                if value not in matched:
+                    for build_line in group:
+                        yield line(build_line, None)
+
+    def __cross_join(self, table):
+        for line in table:
+            for right_line in self.to_join:
+                yield self.__line(line, right_line)
+
+
+def _json_decoder(decoder):
+    """
+    :param decoder: function of bytes to decode a line or name of
+    a decoder from JSON_DECODERS, the fastest one if None
+    :return: function to decode a line
+    """
+
+    if decoder is None:
+        return JSON_DECODERS.get('orjson',
+                                 JSON_DECODERS.get('ujson', json.loads))
+    if isinstance(decoder, str):
+        if decoder not in JSON_DECODERS:
+            raise TypeError('Decoder is not available')
+        return JSON_DECODERS[decoder]
+    if not callable(decoder):
+        raise TypeError('Decoder must be callable or name of decoder')
+    return decoder
 
-                new_line = {}
-                for key in sorted(records[0]):
-                    new_line[key] = records[0][key]
-                yield new_line
 
-    def __right_reducer(self, records):
+class JsonLinesSource(object):
+    """
+    Input file with one json object per line.
+    The file is memory-mapped (or read by chunk_size bytes), split into
+    lines chunk by chunk and every line is decoded only when it is
+    needed. orjson or ujson are used to decode lines if installed
+    """
+
+    def __init__(self, path, decoder=None, use_mmap=True,
+                 chunk_size=READ_CHUNK_SIZE, start=0, end=None):
         """
-        Reducer to use in right join strategy
-        :param records:
-        :return:
+        :param path: path to file
+        :param decoder: function of bytes to decode a line or name of
+        a decoder from JSON_DECODERS, the fastest one if None
+        :param use_mmap: memory-map the file instead of reading it
+        :param chunk_size: number of bytes split into lines at once
+        :param start: offset of the first line to read in bytes
+        :param end: offset in bytes where reading stops, must be
+        a beginning of a line, None -- end of file
         """
 
-        if len(records) > 1:
-            yield from self.__inner_reducer(records)
+        if not isinstance(path, str):
+            raise TypeError('Path must be a string')
+        self.path = path
+        self.decoder = _json_decoder(decoder)
+        self.use_mmap = use_mmap
+        self.chunk_size = chunk_size
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        decoder = self.decoder
+        for line in self.lines():
+            yield decoder(line)
+
+    def lines(self):
+        """
+        :return: yields non-empty lines of the file as bytes
+        """
 
-        if len(records) == 1:
-            for k1, k2 in zip(records[0].keys(), self.right_keys):
-                if k1 != k2:
-                    break
+        with open(self.path, 'rb') as input:
+            size = os.fstat(input.fileno()).st_size
+            end = size if self.end is None else min(self.end, size)
+            if self.start >= end:
+                return
+            if self.use_mmap:
+                with mmap.mmap(input.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    yield from self.__mapped_lines(data, self.start, end)
             else:
-                records[0].update({key: None for key in self.left_keys
-                                   if key not in self.right_keys})
+                input.seek(self.start)
+                yield from self.__read_lines(input, end - self.start)
+
+    def __mapped_lines(self, data, start, stop):
+        while start < stop:
+            end = data.rfind(b'\n', start, min(start + self.chunk_size,
+                                               stop))
+            if end == -1:
+                end = data.find(b'\n', start + self.chunk_size, stop)
+                if end == -1:
+                    end = stop
+            for line in data[start:end].split(b'\n'):
+                if line.strip():
+                    yield line
+            start = end + 1
+
+    def __read_lines(self, input, length):
+        rest = b''
+        while length > 0:
+            chunk = input.read(min(self.chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+class RowsSource(object):
+    """
+    Input file in binary row format, see write_rows. Blocks of lines are
+    unpickled as they are read, no json is parsed. Unpickling can run
+    arbitrary code, so only files from trusted sources must be read
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to file
+        """
+
+        if not isinstance(path, str):
+            raise TypeError('Path must be a string')
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as input:
+            yield from _read_rows(input)
+
+    def header(self):
+        """
+        :return: dict with compression and schema of the file,
+        dtypes of schema are given as strings
+        """
+
+        with open(self.path, 'rb') as input:
+            return _read_header(input)
+
+
+def _read_shard(mappers, sources):
+    result = []
+    for source in sources:
+        if mappers:
+            result.extend(_map_chunk(
+                functools.partial(_chain_mappers, mappers), source))
+        else:
+            result.extend(source)
+    return result
+
+
+class ShardedSource(object):
+    """
+    Input from several files: a directory, a glob pattern or a list of
+    paths. Json-lines files longer than split_size bytes are split into
+    byte ranges aligned to lines, files in binary row format are read
+    whole, see RowsSource. With several workers ranges are read and
+    decoded in worker processes, leading mappers of the graph are applied
+    there too, so input is not read on one core
+    """
+
+    def __init__(self, paths, workers=None, split_size=SPLIT_SIZE,
+                 decoder=None, ordered=True, format='json'):
+        """
+        :param paths: path to directory (every file in it except hidden
+        ones), glob pattern or list of paths. Directory and pattern are
+        listed on every read, files are taken in order of names
+        :param workers: number of processes, None or 1 -- read in this
+        process
+        :param split_size: number of bytes of a json-lines file read by
+        one worker
+        :param decoder: function of bytes to decode a line or name of
+        a decoder from JSON_DECODERS, the fastest one if None. It must be
+        picklable with several workers
+        :param ordered: keep order of files and lines, otherwise lines of
+        a range are yielded as soon as it is read
+        :param format: json -- json-lines files, rows -- files in binary
+        row format, see write_rows
+        """
+
+        if not (isinstance(paths, str)
+                or isinstance(paths, (list, tuple))
+                and all(isinstance(path, str) for path in paths)):
+            raise TypeError('Paths must be a directory, a glob pattern or '
+                            'a list of paths')
+        if not (isinstance(split_size, int) and split_size > 0):
+            raise TypeError('Split size must be positive int')
+        if format not in ['json', 'rows']:
+            raise TypeError('Input format is not supported')
+        self.decoder = _json_decoder(decoder)
+        _check_workers(workers, CHUNK_SIZE, self.decoder, 'Decoder')
+        self.paths = paths if isinstance(paths, str) else list(paths)
+        self.workers = workers
+        self.split_size = split_size
+        self.ordered = ordered
+        self.format = format
+
+    def __iter__(self):
+        return self.read()
+
+    def files(self):
+        """
+        :return: list of paths of files of the source
+        """
+
+        if not isinstance(self.paths, str):
+            return list(self.paths)
+        if os.path.isdir(self.paths):
+            return sorted(os.path.join(self.paths, name)
+                          for name in os.listdir(self.paths)
+                          if not name.startswith('.') and os.path.isfile(
+                              os.path.join(self.paths, name)))
+        return sorted(path for path in glob.glob(self.paths)
+                      if os.path.isfile(path))
+
+    def describe(self):
+        if isinstance(self.paths, str):
+            return self.paths
+        return ', '.join(self.paths)
+
+    def splits(self):
+        """
+        :return: list of JsonLinesSource for byte ranges of json-lines
+        files or RowsSource for files in binary row format
+        """
+
+        if self.format == 'rows':
+            return [RowsSource(path) for path in self.files()]
+        sources = []
+        for path in self.files():
+            sources.extend(JsonLinesSource(path, self.decoder,
+                                           start=start, end=end)
+                           for start, end in _split_file(path,
+                                                         self.split_size))
+        return sources
+
+    def read(self, mappers=()):
+        """
+        :param mappers: tuple of mappers applied to every line after it
+        is decoded, in worker processes with several workers. They must
+        be picklable then
+        :return: yields lines
+        """
+
+        splits = self.splits()
+        if (self.workers or 1) == 1 or len(splits) < 2:
+            for source in splits:
+                if mappers:
+                    for line in source:
+                        yield from _chain_mappers(mappers, line)
+                else:
+                    yield from source
+            return
+
+        for lines in _process_chunks(
+                functools.partial(_read_shard, mappers), splits,
+                self.workers, 1, self.ordered):
+            yield from lines
+
+
+def _describe_source(source):
+    if isinstance(source, (_Node, ComputationGraph)):
+        return 'result of other graph'
+    if isinstance(source, (JsonLinesSource, RowsSource)):
+        return source.path
+    if isinstance(source, ShardedSource):
+        return source.describe()
+    return source
+
+
+def _file_source(path):
+    """
+    :param path: path to file, directory or glob pattern
+    :return: ShardedSource for directory or pattern, JsonLinesSource
+    otherwise. Files in binary row format are read only from RowsSource
+    given explicitly, since they are unpickled
+    """
+
+    if os.path.isdir(path) or (glob.escape(path) != path
+                               and not os.path.isfile(path)):
+        return ShardedSource(path)
+    return JsonLinesSource(path)
+
+
+def _input_size(source):
+    """
+    :param source: input of a graph
+    :return: number of bytes of input files
+    """
+
+    if isinstance(source, str):
+        source = _file_source(source)
+    if isinstance(source, ShardedSource):
+        return sum(map(os.path.getsize, source.files()))
+    if isinstance(source, (JsonLinesSource, RowsSource)):
+        return os.path.getsize(source.path)
+    return 0
+
+
+class ResultCache(object):
+    """
+    On-disk cache of graph results. Results are stored by a key built
+    from the operations of the graph and everything it depends on,
+    including size, modification time and content of input files.
+    When the size of the cache exceeds max_size bytes, least recently
+    used results are removed. Results are stored in binary row format
+    with blocks compressed by compression
+    """
+
+    def __init__(self, directory, max_size=None, compression=None):
+        _compressor(compression, 0)
+        self.directory = directory
+        self.max_size = max_size
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + '.rows')
+
+    def __contains__(self, key):
+        return os.path.exists(self.__path(key))
 
-                new_line = {}
-                for key in sorted(records[0]):
-                    new_line[key] = records[0][key]
-                yield new_line
+    def get(self, key):
+        """
+        :param key: hex string
+        :return: cached table or None
+        """
 
-    def __outer_reducer(self, records):
+        path = self.__path(key)
+        try:
+            os.utime(path)
+            return list(_read_run(path))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, table, keep=()):
         """
-        Reducer to use in outer join strategy
-        :param records:
+        Stores table and evicts least recently used results
+        :param key: hex string
+        :param table: list of lines
+        :param keep: keys, which must not be evicted
         :return:
         """
 
-        if len(records) > 1:
-            yield from self.__inner_reducer(records)
+        path = _spill_run(table, self.directory, self.compression)
+        os.replace(path, self.__path(key))
+        if self.max_size is not None:
+            self.__evict(set(keep) | {key})
 
-        if len(records) == 1:
-            summary = {key: value for key, value in records[0].items()}
+    def __evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.rows'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            if name[:-len('.rows')] not in keep:
+                os.remove(os.path.join(self.directory, name))
+                size -= entry_size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.rows'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class _Node(object):
+    """
+    Computation of a graph on a particular input
+    """
 
-            for k1, k2 in zip(records[0].keys(), self.right_keys):
+    def __init__(self, graph, source):
+        self.graph = graph
+        self.source = source
+        self.joins = {}
+        self.dependencies = set()
 
-                if k1 != k2:
-                    summary.update({key: None for key in self.right_keys
-                                    if key not in self.left_keys})
-                    break
 
-            else:
-                summary.update({key: None for key in self.left_keys
-                                if key not in self.right_keys})
-
-            new_line = {}
-            for key in sorted(summary):
-                new_line[key] = summary[key]
-            yield new_line
-
-    def __inner_join(self):
-        both = sorted(self.table + self.to_join, key=itemgetter(*self.keys))
-        yield from self.__apply_reducer(both, self.__inner_reducer,
-                                        self.keys)
-
-    def __left_join(self):
-        both = sorted(self.table + self.to_join, key=itemgetter(*self.keys))
-        yield from self.__apply_reducer(both, self.__left_reducer,
-                                        self.keys)
-
-    def __right_join(self):
-        both = sorted(self.table + self.to_join, key=itemgetter(*self.keys))
-        yield from self.__apply_reducer(both, self.__right_reducer,
-                                        self.keys)
-
-    def __outer_join(self):
-        both = sorted(self.table + self.to_join, key=itemgetter(*self.keys))
-        yield from self.__apply_reducer(both, self.__outer_reducer, self.keys)
-
-    def __cross_join(self):
-        for first_dict in self.table:
-            for second_dict in self.to_join:
-                first_dict.update(second_dict)
-                new_line = {}
-                for key in sorted(first_dict):
-                    new_line[key] = first_dict[key]
-                yield new_line
+class _Scheduler(object):
+    """
+    Computes nodes of a plan in topological order, each node once.
+    With several workers nodes, which do not depend on each other, are
+    computed concurrently; nodes of one graph are never computed at the
+    same time, as they share operations.
+    With checkpoints results of nodes and of their materializing
+    operations are stored by keys of the plan prefix, with resume
+    computation starts after the last stored result
+    """
+
+    def __init__(self, root, workers=1, cache=None, profile=False,
+                 checkpoints=None, resume=False):
+        if not (isinstance(workers, int) and workers > 0):
+            raise TypeError('Number of workers must be positive int')
+        if profile not in [False, True, 'memory']:
+            raise TypeError('Profile must be bool or memory')
+        if profile == 'memory' and workers > 1:
+            # peak of tracemalloc is global for the process, concurrent
+            # nodes would reset and read peaks of each other
+            raise TypeError('Memory is profiled only with one worker')
+        if resume and checkpoints is None:
+            raise TypeError('Checkpoints are required to resume')
+        self.root = root
+        self.workers = workers
+        self.cache = cache
+        self.profile = profile
+        self.checkpoints = checkpoints
+        self.resume = resume
+        self.stats = {}
+        self.keys = {}
+        self.sources = {}
+        self.step_keys = {}
+        self.starts = {}
+        self.cached = set()
+        self.dependencies = {}
+        self.order = []
+        self.__sort(root)
+        self.consumers = {node: 0 for node in self.order}
+        self.dependants = {node: [] for node in self.order}
+        for node in self.order:
+            for dependency in self.dependencies[node]:
+                self.consumers[dependency] += 1
+                self.dependants[dependency].append(node)
+        self.results = {}
+
+    def __sort(self, node):
+        self.dependencies[node] = node.dependencies
+        if self.__store(node) is not None:
+            self.cached.add(self.__key(node))
+            self.dependencies[node] = set()
+        elif self.resume:
+            self.starts[node] = self.__start(node)
+            if self.starts[node]:
+                plan, _ = node.graph._plan()
+                self.dependencies[node] = {
+                    node.joins[operation]
+                    for operation, _ in plan[self.starts[node]:]
+                    if operation in node.joins}
+        for dependency in self.dependencies[node]:
+            if dependency not in self.dependencies:
+                self.__sort(dependency)
+        self.order.append(node)
+
+    def __source_digest(self, node):
+        """
+        :param node: _Node
+        :return: sha256 object updated with the input of the node
+        """
+
+        if node not in self.sources:
+            digest = hashlib.sha256()
+            if isinstance(node.source, _Node):
+                digest.update(self.__key(node.source).encode())
+            elif isinstance(node.source, str) \
+                    and not isinstance(_file_source(node.source),
+                                       ShardedSource):
+                digest.update(_file_fingerprint(node.source))
+            elif isinstance(node.source, (str, ShardedSource)):
+                source = node.source
+                if isinstance(source, str):
+                    source = _file_source(source)
+                digest.update(source.format.encode())
+                for path in source.files():
+                    digest.update(path.encode())
+                    digest.update(_file_fingerprint(path))
+            elif isinstance(node.source, (JsonLinesSource, RowsSource)):
+                digest.update(_file_fingerprint(node.source.path))
+                if isinstance(node.source, JsonLinesSource):
+                    digest.update(repr((node.source.start,
+                                        node.source.end)).encode())
+            if node.graph.schema is not None:
+                digest.update(json.dumps(_schema_strings(node.graph.schema),
+                                         sort_keys=True).encode())
+            self.sources[node] = digest
+        return self.sources[node].copy()
+
+    def __key(self, node):
+        """
+        :param node: _Node
+        :return: hex digest of operations of the node and its dependencies
+        """
+
+        if node in self.keys:
+            return self.keys[node]
+        digest = self.__source_digest(node)
+        for operation in node.graph.operations:
+            digest.update(repr(operation.fingerprint()).encode())
+            if operation in node.joins:
+                digest.update(self.__key(node.joins[operation]).encode())
+        self.keys[node] = digest.hexdigest()
+        return self.keys[node]
+
+    def __steps(self, node):
+        """
+        :param node: _Node
+        :return: list of hex digests of prefixes of the plan of the node
+        """
+
+        if node not in self.step_keys:
+            digest = self.__source_digest(node)
+            digest.update(b'plan')
+            keys = []
+            for operation, _ in node.graph._plan()[0]:
+                digest.update(repr(operation.fingerprint()).encode())
+                if operation in node.joins:
+                    digest.update(
+                        self.__key(node.joins[operation]).encode())
+                keys.append(digest.hexdigest())
+            self.step_keys[node] = keys
+        return self.step_keys[node]
+
+    def __store(self, node):
+        """
+        :param node: _Node
+        :return: ResultCache with result of the node or None
+        """
+
+        if self.cache is None and not self.resume:
+            return None
+        key = self.__key(node)
+        if self.cache is not None and key in self.cache:
+            return self.cache
+        if self.resume and key in self.checkpoints:
+            return self.checkpoints
+        return None
+
+    def __start(self, node):
+        """
+        :param node: _Node
+        :return: index of the step of the plan after the last stored
+        result of a materializing operation, 0 if there is none
+        """
+
+        plan, _ = node.graph._plan()
+        keys = self.__steps(node)
+        for index in reversed(range(len(plan))):
+            if plan[index][0].materializing \
+                    and keys[index] in self.checkpoints:
+                return index + 1
+        return 0
+
+    def __compute(self, node):
+        if not self.profile:
+            return self.__compute_cached(node)
+
+        stats = {'graph': self.order.index(node),
+                 'input': _describe_source(node.source),
+                 'dependencies': sorted(self.order.index(dependency)
+                                        for dependency in
+                                        self.dependencies[node]),
+                 'thread': threading.get_ident(), 'cached': False,
+                 'bytes_read': _input_size(node.source),
+                 'peak_memory': None, 'reserved_memory': None,
+                 'operations': []}
+        if self.profile == 'memory':
+            tracemalloc.reset_peak()
+        start, cpu = time.perf_counter(), time.thread_time()
+        result = self.__compute_cached(node, stats)
+        stats['end'] = time.perf_counter()
+        stats['start'] = start
+        stats['wall'] = stats['end'] - start
+        stats['cpu'] = time.thread_time() - cpu
+        stats['rows_out'] = len(result)
+        for name in ('sorts', 'spills', 'bytes_written'):
+            stats[name] = sum(operation[name]
+                              for operation in stats['operations'])
+        if self.profile == 'memory':
+            stats['peak_memory'] = max(
+                [tracemalloc.get_traced_memory()[1]] +
+                [operation['peak_memory'] or 0
+                 for operation in stats['operations']])
+        self.stats[node] = stats
+        return result
+
+    def __compute_cached(self, node, stats=None):
+        if self.cache is None and self.checkpoints is None:
+            return self.__compute_node(node, stats)
+        key = self.__key(node)
+        if key in self.cached:
+            result = self.__store(node).get(key)
+            if result is None:
+                raise RuntimeError('Stored result was removed during run')
+            if stats is not None:
+                stats['cached'] = True
+            return result
+        result = self.__compute_node(node, stats)
+        if self.cache is not None:
+            self.cache.put(key, result, self.cached)
+        if self.checkpoints is not None:
+            self.checkpoints.put(key, result)
+        return result
+
+    def __compute_node(self, node, stats=None):
+        start = self.starts.get(node, 0)
+        checkpoint = None
+        if self.checkpoints is not None:
+            checkpoint = (self.checkpoints, self.__steps(node), start)
+        if start:
+            table = self.checkpoints.get(self.__steps(node)[start - 1])
+            if table is None:
+                raise RuntimeError('Stored result was removed during run')
+        elif isinstance(node.source, _Node):
+            table = self.results[node.source]
+        elif isinstance(node.source, str):
+            table = _file_source(node.source)
+        elif isinstance(node.source, (JsonLinesSource, RowsSource,
+                                      ShardedSource)):
+            table = node.source
+        else:
+            table = []
+        joins = {operation: self.results[dependency]
+                 for operation, dependency in node.joins.items()
+                 if dependency in self.results}
+        budget = None
+        if node.graph.memory_limit is not None:
+            budget = MemoryBudget(node.graph.memory_limit)
+        if stats is None:
+            return node.graph._compute(table, joins, checkpoint=checkpoint,
+                                       budget=budget)
+        result = node.graph._compute(table, joins, stats['operations'],
+                                     self.profile == 'memory', checkpoint,
+                                     budget)
+        if budget is not None:
+            stats['reserved_memory'] = budget.peak
+        return result
+
+    def __finish(self, node, result):
+        self.results[node] = result
+        for dependency in self.dependencies[node]:
+            self.consumers[dependency] -= 1
+            if self.consumers[dependency] == 0:
+                del self.results[dependency]
+
+    def run(self):
+        """
+        :return: result of the root node
+        """
+
+        if self.profile != 'memory' or tracemalloc.is_tracing():
+            return self.__run()
+        tracemalloc.start()
+        try:
+            return self.__run()
+        finally:
+            tracemalloc.stop()
+
+    def profile_stats(self):
+        """
+        :return: dict with wall time of the run and list of statistics of
+        computed graphs in order of computation, times of start and end
+        are counted in seconds from the start of the run
+        """
+
+        graphs = [self.stats[node] for node in self.order
+                  if node in self.stats]
+        origin = min((graph['start'] for graph in graphs), default=0.0)
+        end = max((graph['end'] for graph in graphs), default=0.0)
+        for graph in graphs:
+            for stats in [graph] + graph['operations']:
+                if stats['start'] is not None:
+                    stats['start'] -= origin
+                    stats['end'] -= origin
+        return {'wall': end - origin, 'graphs': graphs}
+
+    def __run(self):
+        if self.workers == 1:
+            for node in self.order:
+                self.__finish(node, self.__compute(node))
+            return self.results[self.root]
+
+        waiting = {node: len(self.dependencies[node])
+                   for node in self.order}
+        ready = [node for node in self.order if waiting[node] == 0]
+        running = {}
+        with ThreadPoolExecutor(self.workers) as pool:
+            while ready or running:
+                busy = {node.graph for node in running.values()}
+                for node in list(ready):
+                    if len(running) == self.workers:
+                        break
+                    if node.graph not in busy:
+                        ready.remove(node)
+                        busy.add(node.graph)
+                        running[pool.submit(self.__compute, node)] = node
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    self.__finish(node, future.result())
+                    for dependant in self.dependants[node]:
+                        waiting[dependant] -= 1
+                        if waiting[dependant] == 0:
+                            ready.append(dependant)
+        return self.results[self.root]
+
+
+def _incremental_stages(operations):
+    """
+    Splits operations of a graph for incremental computation
+    :param operations: list of operations
+    :return: list of leading Maps, list of operations keeping state by
+    keys -- Aggregate, Fold with merge or Combine and Reduce, list of
+    operations applied to lines built from the state
+    """
+
+    if any(isinstance(operation, Join) for operation in operations):
+        raise TypeError('Joins can not be computed incrementally')
+    position = 0
+    while position < len(operations) \
+            and isinstance(operations[position], Map):
+        position += 1
+    stage = operations[position:position + 2]
+    if len(stage) == 2 and isinstance(stage[0], Combine) \
+            and isinstance(stage[1], Reduce) \
+            and stage[0].keys == stage[1].columns:
+        return operations[:position], stage, operations[position + 2:]
+    stage = stage[:1]
+    if not stage or not (isinstance(stage[0], Aggregate)
+                         or isinstance(stage[0], Fold)
+                         and stage[0].merge is not None):
+        raise TypeError('Incremental graph must have Aggregate, Fold '
+                        'with merge or Reduce with combiner after mappers')
+    return operations[:position], stage, operations[position + 1:]
+
+
+def _merge_delta(stage, state, table):
+    """
+    :param stage: operations keeping state, see _incremental_stages
+    :param state: state of the previous run or None
+    :param table: new lines
+    :return: updated state, set of keys, which got new lines
+    (None is the key of Fold)
+    """
+
+    operation = stage[0]
+    if isinstance(operation, Aggregate):
+        delta = operation.partial(table)
+        return operation.merge(state or {}, delta), set(delta)
+
+    if isinstance(operation, Combine):
+        state = state or {}
+        key = itemgetter(*operation.keys)
+        changed = set()
+        for line in table:
+            value = key(line)
+            current = state.get(value)
+            state[value] = line if current is None \
+                else operation.merge(current, line)
+            changed.add(value)
+        return state, changed
+
+    table = iter(table)
+    first = next(table, None)
+    if first is None:
+        return state, set()
+    delta = next(operation(chain([first], table)))
+    if state is None:
+        return delta, {None}
+    return operation.merge(state, delta), {None}
+
+
+def _state_lines(stage, state, keys=None):
+    """
+    :param stage: operations keeping state, see _incremental_stages
+    :param state: state built by _merge_delta
+    :param keys: keys to build lines for, None -- all keys
+    :return: iterable of lines
+    """
+
+    operation = stage[0]
+    if isinstance(operation, Fold):
+        if state is None:
+            state = copy.deepcopy(operation.begin_state)
+        return [state] if keys is None or keys else []
+
+    state = state or {}
+    values = [value for value in state if keys is None or value in keys]
+    if isinstance(operation, Aggregate):
+        return operation.lines({value: state[value] for value in values})
+    reduce = stage[1]
+    if reduce.strategy == 'sort':
+        values.sort()
+    return chain.from_iterable(reduce.reducer([state[value]])
+                               for value in values)
 
 
 class ComputationGraph(object):
@@ -430,16 +3157,50 @@ class ComputationGraph(object):
 
     Functions: add_mapper, add_sort, add_folder,
                add_reducer, add_join, set_input.
+
+    With streaming=True operations are chained as generators: lines are
+    read from the input one by one and only Sort, Reduce and Join keep a
+    whole table in memory.
+
+    sort_buffer_size is a memory budget of Sort, Reduce and Join in lines:
+    longer tables are sorted on disk.
+
+    With schema (dict of column name and numpy dtype) the input is
+    converted to a ColumnarTable, Sort and Reduce work on NumPy arrays
+    and the table is converted back to lines for other operations and
+    for the result.
+
+    Operations are optimized before computation, see explain.
+
+    memory_limit is an approximate memory budget in bytes of Sort, Reduce,
+    Join, Aggregate and Fold of the graph, see MemoryBudget: when their
+    lines and states do not fit in it, they are spilled to disk and
+    processed in parts. Fold state and buckets passed to reducers are
+    only reserved in the budget.
     """
 
-    def __init__(self):
+    def __init__(self, streaming=False, sort_buffer_size=SORT_BUFFER_SIZE,
+                 schema=None, memory_limit=None):
+        if memory_limit is not None and not (isinstance(memory_limit, int)
+                                             and memory_limit > 0):
+            raise TypeError('Memory limit must be positive int')
+        if schema is not None:
+            if numpy is None:
+                raise ImportError('numpy is required for columnar tables')
+            if not isinstance(schema, dict):
+                raise TypeError('Schema must be a dict of column name '
+                                'and dtype')
+        self.streaming = streaming
+        self.sort_buffer_size = sort_buffer_size
+        self.schema = schema
+        self.memory_limit = memory_limit
         self.dependencies = []
         self.dependencies_input = []
-        self.table = []
         self.result = []
         self.is_counted = False
         self.counted_input = None
         self.operations = []
+        self.__stats = None
         self.__input = None
         self.__output = None
 
@@ -447,43 +3208,318 @@ class ComputationGraph(object):
         """
         States input file for current graph instance, does nothing if graph
         was counted on that input and result was saved.
-        :param filename: path to file OR other ComputationGraph -- its result
-        will be use as an input to this instance
+        :param filename: path to file, directory or glob pattern OR
+        JsonLinesSource OR RowsSource OR ShardedSource OR
+        other ComputationGraph -- its result will be use as an input
+        to this instance. Paths are read as json lines, files in binary
+        row format (see write_output) must be given as RowsSource.
+        Directory and pattern are read as ShardedSource in this process
         :return:
         """
 
         if filename == self.counted_input and self.is_counted:
             return
-        if not (isinstance(filename, str) or isinstance(filename,
-                                                        ComputationGraph)):
+        if not (isinstance(filename, str)
+                or isinstance(filename, JsonLinesSource)
+                or isinstance(filename, RowsSource)
+                or isinstance(filename, ShardedSource)
+                or isinstance(filename, ComputationGraph)):
             raise TypeError("Wrong input type for ComputationGraph")
         self.__input = filename
         self.is_counted = False
 
-    def __read_input(self):
-        if isinstance(self.__input, str):
-            with open(self.__input, 'r') as input:
-                for line in input.readlines():
-                    self.table.append(json.loads(line))
-        elif isinstance(self.__input, ComputationGraph):
-            self.__input.run()
-            self.table = self.__input.result.copy()
+    def _node(self, source, nodes, visiting):
+        """
+        Plans computation of this graph on source together with all
+        computations it depends on
+        :param source: input of the graph -- path, other graph or None
+        :param nodes: dict of planned nodes by (graph, source)
+        :param visiting: keys of nodes being planned, to find cycles
+        :return: _Node
+        """
+
+        key = (self, source)
+        if key in nodes:
+            return nodes[key]
+        if key in visiting:
+            raise RuntimeError('Graphs must not depend on each other '
+                               'in a cycle')
+        visiting.add(key)
+
+        node = _Node(self, source)
+        if isinstance(source, ComputationGraph):
+            node.source = source._node(source.__input, nodes, visiting)
+            node.dependencies.add(node.source)
+        joins = [operation for operation in self.operations
+                 if isinstance(operation, Join)]
+        for operation, on_input in zip(joins, self.dependencies_input):
+            node.joins[operation] = operation.on._node(on_input, nodes,
+                                                       visiting)
+            node.dependencies.add(node.joins[operation])
+
+        visiting.remove(key)
+        nodes[key] = node
+        return node
+
+    def _plan(self, visiting=frozenset()):
+        """
+        Optimizes operations of the graph: mappers declared with pushdown
+        are moved before inner, left and cross joins, adjacent mappers
+        are fused to map a line in one pass, sorts satisfied by the order
+        of the table are removed, Reduce and merge Join do not sort
+        tables already sorted by their keys
+        :param visiting: graphs being planned, to find cycles
+        :return: list of pairs of operation and dict of options it is
+        called with, tuple of columns the result is sorted by
+        """
+
+        if self in visiting:
+            raise RuntimeError('Graphs must not depend on each other '
+                               'in a cycle')
+
+        operations = list(self.operations)
+        for i in range(1, len(operations)):
+            while i > 0 and isinstance(operations[i], Map) \
+                    and operations[i].pushdown \
+                    and isinstance(operations[i - 1], Join) \
+                    and operations[i - 1].strategy in ('inner', 'left',
+                                                       'cross'):
+                operations[i - 1], operations[i] = \
+                    operations[i], operations[i - 1]
+                i -= 1
+
+        fused = []
+        for operation in operations:
+            if isinstance(operation, Map) and fused \
+                    and isinstance(fused[-1], Map):
+                both = fused[-1].fuse(operation)
+                if both is not None:
+                    fused[-1] = both
+                    continue
+            fused.append(operation)
+
+        plan = []
+        order = ()
+        for operation in fused:
+            options = {}
+            if isinstance(operation, Sort):
+                if order[:len(operation.keys)] == operation.keys:
+                    continue
+                order = operation.keys
+            elif isinstance(operation, Reduce):
+                if operation.strategy == 'sort' \
+                        and (operation.workers or 1) == 1 \
+                        and order[:len(operation.columns)] == \
+                        operation.columns:
+                    options['presorted'] = True
+                order = ()
+            elif isinstance(operation, Join):
+                keys = operation.keys
+                if operation.strategy != 'cross' \
+                        and operation.method == 'merge':
+                    if order[:len(keys)] == keys:
+                        options['sorted_left'] = True
+                    _, on_order = operation.on._plan(visiting | {self})
+                    if on_order[:len(keys)] == keys:
+                        options['sorted_right'] = True
+                    order = keys
+                else:
+                    order = ()
+            elif isinstance(operation, Combine) or isinstance(
+                    operation, Aggregate) and self.memory_limit is None:
+                # spilled Aggregate yields groups by hash partitions
+                order = _sorted_prefix(order, operation.keys)
+            else:
+                order = ()
+            plan.append((operation, options))
+        return plan, order
+
+    @staticmethod
+    def _read_mappers(plan, source):
+        """
+        :param plan: plan of the graph, see _plan
+        :param source: input of the graph
+        :return: number of leading Map steps of plan, which are computed
+        by the worker processes reading source
+        """
 
-    def __count_dependencies(self):
-        for g, input in zip(self.dependencies, self.dependencies_input):
-            g.set_input(input)
+        if not (isinstance(source, ShardedSource)
+                and (source.workers or 1) > 1):
+            return 0
+        count = 0
+        for operation, _ in plan:
+            if not isinstance(operation, Map):
+                break
+            try:
+                pickle.dumps(operation.mappers)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                break
+            count += 1
+        return count
+
+    def explain(self):
+        """
+        Prints the plan the graph is computed with, see _plan
+        :return: the plan as a string
+        """
 
-        for g in self.dependencies:
-            g.run()
+        lines = ['Input: {}'.format(_describe_source(self.__input))]
+        plan, order = self._plan()
+        source = self.__input
+        if isinstance(source, str):
+            source = _file_source(source)
+        read = self._read_mappers(plan, source)
+        for number, (operation, options) in enumerate(plan, 1):
+            line = '{}. {}'.format(number, operation.describe())
+            if number <= read:
+                options = dict(options, in_readers=True)
+            if options:
+                line += ' [{}]'.format(', '.join(sorted(options)))
+            lines.append(line)
+        if order:
+            lines.append('Result is sorted by {}'.format(order))
+        explanation = '\n'.join(lines)
+        print(explanation)
+        return explanation
+
+    def _compute(self, table, joins, profile=None, memory=False,
+                 checkpoint=None, budget=None):
+        """
+        Applies operations of the graph to table
+        :param table: iterable of input lines. ShardedSource with
+        several workers also computes leading mappers in its workers
+        :param joins: dict -- table to join for each Join operation
+        :param profile: list -- statistics of reading the input and of
+        every operation are appended to it, see _operation_stats,
+        None -- nothing is measured
+        :param memory: measure peak memory of every operation with
+        tracemalloc, which must be tracing. Only without streaming
+        :param checkpoint: tuple of ResultCache, list of keys of results
+        of steps of the plan and index of the first step to compute,
+        table is the result of the previous step then. Results of
+        materializing operations are stored in ResultCache.
+        None -- no checkpoints
+        :param budget: MemoryBudget of spilling operations, a new one
+        if None and the graph has memory_limit
+        :return: list -- resulting table
+        """
 
-    def add_mapper(self, mapper):
+        try:
+            return self.__apply(table, joins, profile, memory, checkpoint,
+                                budget)
+        finally:
+            # operations must not keep tables after the run, the
+            # scheduler releases results of dependencies
+            for operation in self.operations:
+                operation._release()
+
+    def __apply(self, table, joins, profile, memory, checkpoint, budget):
+        start = 0
+        if checkpoint is not None:
+            checkpoints, keys, start = checkpoint
+        if budget is None and self.memory_limit is not None:
+            budget = MemoryBudget(self.memory_limit)
+        plan, _ = self._plan()
+        name = 'Read checkpoint' if start else 'Read'
+        read = 0 if start else self._read_mappers(plan, table)
+        if read:
+            mappers = sum((operation.mappers
+                           for operation, _ in plan[:read]), ())
+            name = ' + '.join([name] + [operation.describe()
+                                        for operation, _ in plan[:read]])
+            table = table.read(mappers)
+            start = read
+        if profile is not None:
+            profile.append(_operation_stats(name))
+            table = _profiled(table, profile[-1])
+        if self.schema is not None and not start:
+            # schema describes the input, not a checkpointed table or
+            # lines given by mappers in readers
+            table = ColumnarTable.from_rows(table, self.schema)
+        elif not self.streaming:
+            table = list(table)
+        for index, (operation, options) in enumerate(plan):
+            if index < start:
+                continue
+            call = operation
+            if isinstance(table, ColumnarTable):
+                if operation.columnar:
+                    call = operation.columnar_call
+                else:
+                    table = table.to_rows()
+            if isinstance(operation, Join):
+                args = (table, joins[operation])
+            else:
+                args = (table,)
+            if call is not operation:
+                # columnar calls sort by themselves and do not spill
+                options = {}
+            elif budget is not None and operation.spilling:
+                options = dict(options, budget=budget)
+
+            if profile is None:
+                table = call(*args, **options)
+            else:
+                stats = _operation_stats(operation.describe())
+                profile.append(stats)
+                if memory and not self.streaming:
+                    tracemalloc.reset_peak()
+                table = _profiled_call(stats, call, *args, **options)
+
+            if not self.streaming and not isinstance(table, ColumnarTable):
+                table = list(table)
+            if profile is not None and memory and not self.streaming:
+                stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            if checkpoint is not None and operation.materializing:
+                if isinstance(table, ColumnarTable):
+                    checkpoints.put(keys[index], table.to_rows())
+                else:
+                    table = list(table)
+                    checkpoints.put(keys[index], table)
+        if isinstance(table, ColumnarTable):
+            table = table.to_rows()
+        table = list(table)
+
+        if profile is not None:
+            profile[0]['rows_in'] = profile[0]['rows_out']
+            for previous, stats in zip(profile, profile[1:]):
+                stats['rows_in'] = previous['rows_out']
+        return table
+
+    def add_mapper(self, mapper, workers=None, chunk_size=CHUNK_SIZE,
+                   ordered=True, pushdown=False):
         """
         Adds mapper-node to graph
         :param mapper: mapper function. Must be generator
+        :param workers: number of worker processes to run mapper in.
+        Mapper is pickled by reference, so it must be defined at module
+        level (not a lambda, nested function or bound method) and
+        must not rely on state changed at runtime
+        :param chunk_size: number of lines sent to a worker at once
+        :param ordered: keep order of input lines in result
+        :param pushdown: mapper uses and changes only columns of the left
+        table, which are not join keys, so it may be computed before
+        preceding inner, left and cross joins. Order of lines with equal
+        join keys may change
         :return: True on success
         """
 
-        self.operations.append(Map(mapper))
+        self.operations.append(Map(mapper, workers=workers,
+                                   chunk_size=chunk_size, ordered=ordered,
+                                   pushdown=pushdown))
+        return True
+
+    def add_batch_mapper(self, function, batch_size=BATCH_SIZE):
+        """
+        Adds batch mapper-node to graph
+        :param function: function of a batch: list of lines, or
+        ColumnarTable if graph has schema. Must return list of lines,
+        dict of column name and values or ColumnarTable
+        :param batch_size: number of lines in a batch
+        :return: True on success
+        """
+
+        self.operations.append(BatchMap(function, batch_size=batch_size))
         return True
 
     def add_sort(self, keys):
@@ -495,32 +3531,152 @@ class ComputationGraph(object):
         :return: True on success
         """
 
-        self.operations.append(Sort(keys))
+        self.operations.append(Sort(keys, buffer_size=self.sort_buffer_size))
         return True
 
-    def add_folder(self, folder, begin_state):
+    def add_folder(self, folder, begin_state, merge=None, workers=None,
+                   chunk_size=CHUNK_SIZE):
         """
         Adds folder-node to graph
         :param folder: folder function, Must be callable
-        :param begin_state:  begin_state to use in folder
+        :param begin_state:  begin_state to use in folder, every run
+        starts from a copy of it
+        :param merge: associative function of two states, returns
+        a state as if lines of both were folded one after another
+        :param workers: number of worker processes folding chunks of
+        the table, requires merge. Folder must be picklable,
+        see add_mapper
+        :param chunk_size: number of lines sent to a worker at once
+        :return: True on success
+        """
+
+        self.operations.append(Fold(folder, begin_state, merge=merge,
+                                    workers=workers, chunk_size=chunk_size))
+        return True
+
+    def add_combiner(self, merge, keys, buffer_size=COMBINE_BUFFER_SIZE):
+        """
+        Adds combiner-node to graph
+        :param merge: associative function of two lines with equal keys,
+        returns one line
+        :param keys: keys of lines to merge
+        :param buffer_size: number of different keys combined in memory
         :return: True on success
         """
 
-        self.operations.append(Fold(folder, begin_state))
+        self.operations.append(Combine(merge, keys, buffer_size=buffer_size))
         return True
 
-    def add_reducer(self, reducer, keys):
+    def add_reducer(self, reducer, keys, strategy='sort', ordered=False,
+                    workers=None, combiner=None):
         """
         Adds reducer-node to graph
         :param reducer: reducer function, must be generator
         :param keys: keys to create buckets for reducer function
+        :param strategy: sort -- buckets are built by sorting the table,
+        hash -- buckets are collected in a dict in one pass,
+        output order is not defined
+        :param ordered: output must be sorted by keys, forces sort strategy
+        :param workers: number of worker processes, table is split between
+        them by hash of keys. Reducer must be picklable, see add_mapper
+        :param combiner: associative function of two lines with equal keys,
+        lines are merged with it before reducing, see add_combiner.
+        Reducer must accept merged lines
+        :return: True on success
+        """
+
+        reduce = Reduce(reducer, keys, buffer_size=self.sort_buffer_size,
+                        strategy=strategy, ordered=ordered, workers=workers)
+        if combiner is not None:
+            self.operations.append(Combine(combiner, keys))
+        self.operations.append(reduce)
+        return True
+
+    def add_batch_reducer(self, function, keys, strategy='sort',
+                          ordered=False, workers=None):
+        """
+        Adds batch reducer-node to graph
+        :param function: function of a block of lines with equal keys
+        given as dict of column name and values -- lists, or numpy arrays
+        if graph has schema. Must return list of lines, dict of column
+        name and values or ColumnarTable
+        :param keys: keys to create blocks for function
+        :param strategy: sort or hash, see add_reducer
+        :param ordered: output must be sorted by keys
+        :param workers: number of worker processes, see add_reducer
+        :return: True on success
+        """
+
+        self.operations.append(BatchReduce(function, keys,
+                                           buffer_size=self.sort_buffer_size,
+                                           strategy=strategy, ordered=ordered,
+                                           workers=workers))
+        return True
+
+    def add_aggregate(self, keys, count=None, sum=None, mean=None,
+                      min=None, max=None, count_distinct=None,
+                      workers=None, chunk_size=CHUNK_SIZE):
+        """
+        Adds aggregation-node to graph. Every aggregation but
+        count_distinct keeps constant memory per key
+        :param keys: column or tuple of columns to group lines by,
+        empty tuple -- aggregate whole table
+        :param count: name of column for number of lines
+        :param sum: dict of column and name of column for sum of values
+        :param mean: dict of column and name of column for mean value
+        :param min: dict of column and name of column for minimal value
+        :param max: dict of column and name of column for maximal value
+        :param count_distinct: dict of column and name of column for
+        number of different values
+        :param workers: number of worker processes computing partial
+        aggregates of chunks, which are merged afterwards
+        :param chunk_size: number of lines sent to a worker at once
         :return: True on success
         """
 
-        self.operations.append(Reduce(reducer, keys))
+        aggregations = []
+        if count is not None:
+            if not isinstance(count, str):
+                raise TypeError('Name of count column must be string')
+            aggregations.append(_Count(None, count))
+        for kind, columns in (('sum', sum), ('mean', mean), ('min', min),
+                              ('max', max),
+                              ('count_distinct', count_distinct)):
+            if columns is None:
+                continue
+            if not isinstance(columns, dict):
+                raise TypeError('Columns to aggregate must be dict '
+                                'of column and name of result column')
+            for column, name in columns.items():
+                if not (isinstance(column, str) and isinstance(name, str)):
+                    raise TypeError('Columns must be strings')
+                aggregations.append(AGGREGATIONS[kind](column, name))
+
+        self.operations.append(Aggregate(keys, aggregations, workers=workers,
+                                         chunk_size=chunk_size))
+        return True
+
+    def add_top_k(self, k, by, group_by=(), descending=True, workers=None,
+                  chunk_size=CHUNK_SIZE):
+        """
+        Adds top-k-node to graph. Keeps k lines of every group in memory
+        instead of sorting the table
+        :param k: number of lines to keep
+        :param by: column or tuple of columns to compare lines
+        :param group_by: column or tuple of columns to select top lines
+        for every value of them, empty tuple -- for the whole table
+        :param descending: keep the largest lines, otherwise the smallest
+        :param workers: number of worker processes selecting top lines of
+        chunks, which are merged afterwards
+        :param chunk_size: number of lines sent to a worker at once
+        :return: True on success
+        """
+
+        self.operations.append(TopK(k, by, group_by, descending,
+                                    workers=workers, chunk_size=chunk_size))
         return True
 
-    def add_join(self, gr_description, keys, strategy=None):
+    def add_join(self, gr_description, keys, strategy=None, method='merge'):
         """
         Adds join-node to graph
         :param gr_description: tuple of length 2:
@@ -530,6 +3686,8 @@ class ComputationGraph(object):
         Might be path to file or other graph
         :param keys: keys to use in join strategy
         :param strategy: inner, left, right, outer, cross -- SQL type operation
+        :param method: merge -- sort both tables and merge them,
+        hash -- build a dict on the shorter table, result is not sorted
         :return: True on success
         """
         if not isinstance(gr_description, tuple):
@@ -542,15 +3700,40 @@ class ComputationGraph(object):
         if strategy is None:
             strategy = 'cross'
 
+        join = Join(on, keys, strategy, buffer_size=self.sort_buffer_size,
+                    method=method)
         self.dependencies.append(on)
         self.dependencies_input.append(on_input)
-
-        self.operations.append(Join(on, keys, strategy))
+        self.operations.append(join)
         return True
 
-    def run(self):
+    def run(self, workers=1, cache=None, profile=False, checkpoint=None,
+            resume=False, cluster=None):
         """
-        Computes graph result. Input must be stated before use
+        Computes graph result. Input must be stated before use.
+        Every graph this one depends on is computed once per distinct
+        input, after everything it depends on. Results of dependencies
+        are released as soon as all graphs using them are computed
+        :param workers: number of independent graphs computed
+        at the same time in threads
+        :param cache: ResultCache -- results of this graph and its
+        dependencies are taken from it when neither operations nor input
+        files changed, computed results are stored in it
+        :param profile: True -- measure time, lines and spills of every
+        operation of this graph and its dependencies, see stats,
+        memory -- also measure peak memory with tracemalloc, only
+        with one worker
+        :param checkpoint: path to directory or ResultCache. Results of
+        this graph, its dependencies and of every Sort, Reduce, Join,
+        Aggregate, TopK and Fold in them are stored there by fingerprint
+        of operations before them and of their inputs. With streaming
+        these results are kept in memory to be stored
+        :param resume: take stored results from checkpoint: graphs with
+        stored results are not computed, other graphs start after their
+        last stored operation
+        :param cluster: distributed.Cluster -- compute this graph and its
+        dependencies on workers of the cluster, see distributed.py.
+        Other parameters must be left default then
         :return:
         """
 
@@ -560,27 +3743,154 @@ class ComputationGraph(object):
             self.counted_input = None
             self.is_counted = False
 
-        self.__count_dependencies()
-
-        self.__read_input()
-        _table = self.table.copy()
+        root = self._node(self.__input, {}, set())
+        if cluster is not None:
+            if workers != 1 or cache is not None or profile \
+                    or checkpoint is not None or resume:
+                raise TypeError('Cluster runs do not support workers, '
+                                'cache, profile and checkpoints')
+            self.result = cluster.compute(root)
+            self.__stats = None
+            self.is_counted = True
+            self.counted_input = self.__input
+            return
 
-        for operation in self.operations:
-            _table = list(operation(_table))
-        self.result = _table
+        if isinstance(checkpoint, str):
+            checkpoint = ResultCache(checkpoint)
+        scheduler = _Scheduler(root, workers, cache, profile, checkpoint,
+                               resume)
+        self.result = scheduler.run()
+        self.__stats = scheduler.profile_stats() if profile else None
         self.is_counted = True
         self.counted_input = self.__input
 
-    def write_output(self, filename):
+    def run_incremental(self, state_path, changed_only=False):
+        """
+        Computes graph on lines appended to the input file since the
+        previous run with the same state_path. Graph must start with
+        mappers followed by Aggregate, Fold with merge or Reduce with
+        combiner. Their state by keys is kept in state_path, operations
+        after them are applied to lines built from the state. Graph is
+        computed from the beginning of the file if operations before
+        the state changed or the consumed part of the file was
+        rewritten. The last line without newline is left for the next run
+        :param state_path: path to file with state
+        :param changed_only: result has lines only for keys, which got new
+        lines in this run, otherwise for all keys
+        :return:
+        """
+
+        path = self.__input
+        if not isinstance(path, str) or os.path.isdir(path):
+            raise TypeError('Incremental run requires path to json lines '
+                            'file as input')
+        maps, stage, rest = _incremental_stages(self.operations)
+        plan = hashlib.sha256(repr([operation.fingerprint()
+                                    for operation in maps + stage])
+                              .encode()).hexdigest()
+
+        saved = None
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as input:
+                saved = pickle.load(input)
+        end = _last_line_end(path)
+        if saved is None or saved['path'] != os.path.abspath(path) \
+                or saved['plan'] != plan or saved['offset'] > end \
+                or saved['tail'] != _tail_digest(path, saved['offset']):
+            saved = {'path': os.path.abspath(path), 'plan': plan,
+                     'offset': 0, 'state': None}
+
+        table = JsonLinesSource(path, start=saved['offset'], end=end)
+        for operation in maps:
+            table = operation(table)
+        state, changed = _merge_delta(stage, saved['state'], table)
+        table = _state_lines(stage, state, changed if changed_only else None)
+        for operation in rest:
+            table = operation(table)
+        self.result = list(table)
+
+        saved.update(offset=end, tail=_tail_digest(path, end), state=state)
+        fd, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(state_path)))
+        with os.fdopen(fd, 'wb') as output:
+            pickle.dump(saved, output, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, state_path)
+        # result may cover only a part of the input, so run recomputes it
+        self.is_counted = True
+        self.counted_input = None
+
+    def stats(self):
+        """
+        Statistics of the last run with profile. For every computed graph
+        and every operation of it: wall and CPU time of its thread
+        in seconds, excluding time of operations it reads lines from,
+        number of lines in and out, number of sorts and spill files,
+        bytes written to spill files, peak memory in bytes if measured.
+        Graphs with memory_limit also have the peak number of bytes
+        reserved in their MemoryBudget.
+        Read is the input of a graph, including parsing of json.
+        Work done in worker processes is counted only in wall time
+        :return: dict with wall time of the run and list of graphs,
+        the graph run is the last one
+        """
+
+        if self.__stats is None:
+            raise RuntimeError('Graph must be run with profile '
+                               'to get statistics')
+        return self.__stats
+
+    def export_trace(self, filename):
+        """
+        Writes statistics of the last run with profile in Chrome trace
+        format, which can be opened in chrome://tracing or Perfetto.
+        With streaming operations are shown nested in the operations
+        reading lines from them
+        :param filename: path to file
+        :return:
+        """
+
+        events = []
+        for graph in self.stats()['graphs']:
+            for stats in [graph] + graph['operations']:
+                if stats['start'] is None:
+                    continue
+                if stats is graph:
+                    name = 'graph {}: {}'.format(graph['graph'],
+                                                 graph['input'])
+                else:
+                    name = stats['operation']
+                events.append({
+                    'name': name, 'ph': 'X', 'pid': os.getpid(),
+                    'tid': graph['thread'],
+                    'ts': stats['start'] * 1e6,
+                    'dur': (stats['end'] - stats['start']) * 1e6,
+                    'args': {key: value for key, value in stats.items()
+                             if key not in ('operations', 'start', 'end',
+                                            'thread')}})
+        with open(filename, 'w') as output:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      output)
+
+    def write_output(self, filename, format='json', compression=None):
         """
         Writes result to filename
         :param filename: path to file
+        :param format: json -- one json object per line,
+        rows -- binary row format, which next graphs read without
+        parsing json, see write_rows
+        :param compression: compression of blocks in binary row format,
+        name from COMPRESSIONS or None
         :return:
         """
 
         if not self.is_counted:
             raise RuntimeError('Graph must be counted before writing result')
+        if format not in ['json', 'rows']:
+            raise TypeError('Output format is not supported')
 
+        if format == 'rows':
+            write_rows(filename, self.result, compression, self.schema)
+            return
         with open(filename, 'w') as output:
             for line in self.result:
-                output.write(json.dumps(line))
+                output.write(json.dumps(line) + '\n')
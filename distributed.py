@@ -0,0 +1,749 @@
+"""
+Distributed computation of ComputationGraph on workers, which connect to
+a coordinator over TCP.
+
+The coordinator splits the plan of every graph into stages at shuffle
+boundaries: Sort, Reduce, Aggregate, TopK, Fold and Join. A stage is
+computed by one task per part of its input. Tasks of the first stage
+read byte ranges of input files (see ShardedSource), so the files must
+be available to workers by the same paths. Tasks apply mappers, compute
+partial aggregates and split their output into partitions by a stable
+hash of keys (by ranges of keys for Sort). Partitions are passed through
+the coordinator to tasks of the next stage. Failed tasks and tasks of
+disconnected workers are computed again on other workers.
+
+Graphs are built as usual and computed with run(cluster=...):
+
+    with distributed.LocalCluster(workers=4) as cluster:
+        graph.run(cluster=cluster)
+
+Workers on other hosts need the same functions importable and
+the authentication key of the cluster:
+
+    cluster = distributed.Cluster(('0.0.0.0', 6000), authkey=b'secret')
+    graph.run(cluster=cluster)
+
+    # on every worker host
+    COUNTING_GRAPH_AUTHKEY=secret python distributed.py coordinator:6000
+"""
+import argparse
+import bisect
+import copy
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+import zlib
+from collections import deque
+from itertools import chain
+from multiprocessing import AuthenticationError, Process
+from multiprocessing.connection import Client, Listener, wait
+from operator import itemgetter
+
+import computations
+from computations import (Aggregate, BatchMap, Combine, Fold, Join,
+                          JsonLinesSource, Map, Reduce, ShardedSource,
+                          Sort, TopK)
+
+# Number of keys taken from output of every task to choose ranges of Sort
+SAMPLE_SIZE = 100
+# Seconds to wait for workers to connect
+CONNECT_TIMEOUT = 60
+# Environment variable with authentication key for the worker command
+AUTHKEY_VARIABLE = 'COUNTING_GRAPH_AUTHKEY'
+
+
+def _stable_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (tuple, list)):
+        return tuple(map(_stable_value, value))
+    return value
+
+
+def _partition_number(value, count):
+    """
+    :param value: value of keys
+    :param count: number of partitions
+    :return: number of partition of value, the same in every process,
+    unlike hash of strings
+    """
+
+    return zlib.crc32(repr(_stable_value(value)).encode()) % count
+
+
+class _Stage(object):
+    """
+    Operations computed by one task per partition of their input
+    """
+
+    def __init__(self):
+        # how parts of input of a task make a table: concat, merge
+        # sorted parts by keys, merge partial states of aggregate or fold
+        self.combine = ('concat',)
+        self.operations = []
+        # computed from output before partitioning: ('aggregate',
+        # Aggregate), ('fold', Fold), ('top', TopK) or None
+        self.partial = None
+        # ('hash', keys), ('range', keys), ('single',) or None for
+        # output of the graph
+        self.partition = None
+
+
+def _stages(plan):
+    """
+    Splits a plan of a graph into stages at shuffle boundaries
+    :param plan: list of pairs of operation and options, see _plan
+    :return: list of _Stage
+    """
+
+    stages = [_Stage()]
+    for operation, _ in plan:
+        stage = stages[-1]
+        if isinstance(operation, (Map, BatchMap, Combine)) or \
+                isinstance(operation, Join) and operation.strategy == 'cross':
+            stage.operations.append(operation)
+            continue
+
+        following = _Stage()
+        if isinstance(operation, Sort):
+            stage.partition = ('range', operation.keys)
+            following.combine = ('merge', operation.keys)
+        elif isinstance(operation, Aggregate):
+            stage.partial = ('aggregate', operation)
+            stage.partition = ('hash', operation.keys) if operation.keys \
+                else ('single',)
+            following.combine = ('aggregate', operation)
+        elif isinstance(operation, TopK):
+            stage.partial = ('top', operation)
+            stage.partition = ('hash', operation.group_by) \
+                if operation.group_by else ('single',)
+            following.operations.append(operation)
+        elif isinstance(operation, Fold) and operation.merge is not None:
+            stage.partial = ('fold', operation)
+            stage.partition = ('single',)
+            following.combine = ('fold', operation)
+        elif isinstance(operation, Reduce):
+            stage.partition = ('hash', operation.columns)
+            following.operations.append(operation)
+        elif isinstance(operation, Join):
+            stage.partition = ('hash', operation.keys) if operation.keys \
+                else ('single',)
+            following.operations.append(operation)
+        else:
+            stage.partition = ('single',)
+            following.operations.append(operation)
+        stages.append(following)
+    return stages
+
+
+def _portable(operation):
+    """
+    :param operation: Operation
+    :return: copy of operation to send to a worker: without tables of
+    previous runs and the graph of Join. Operations are not computed in
+    worker processes of their own, tasks are computed in parallel instead
+    """
+
+    operation = copy.copy(operation)
+    operation.table = []
+    operation.__dict__.pop('to_join', None)
+    if isinstance(operation, Join):
+        operation.on = None
+    if getattr(operation, 'workers', None) is not None:
+        operation.workers = None
+    return operation
+
+
+def _task_table(task):
+    """
+    :param task: dict, see Cluster.__run_stage
+    :return: iterable of input lines of the task
+    """
+
+    kind = task['combine'][0]
+    parts = task['input']
+    if kind == 'concat':
+        return chain.from_iterable(parts)
+    if kind == 'merge':
+        return heapq.merge(*parts, key=itemgetter(*task['combine'][1]))
+
+    operation = task['combine'][1]
+    if kind == 'aggregate':
+        states = {}
+        for part in parts:
+            operation.merge(states, dict(part))
+        return operation.lines(states)
+
+    states = [state for part in parts for state in part]
+    if not states:
+        return [copy.deepcopy(operation.begin_state)]
+    state = states[0]
+    for other in states[1:]:
+        state = operation.merge(state, other)
+    return [state]
+
+
+def _run_task(task):
+    """
+    :param task: dict, see Cluster.__run_stage
+    :return: pair of the first output line, before partial aggregation,
+    and output: list of lines or, with hash partitioning, list of lists
+    for every partition
+    """
+
+    table = _task_table(task)
+    for index, operation in enumerate(task['operations']):
+        if isinstance(operation, Join):
+            table = operation(table, task['tables'][index],
+                              columns=task['columns'].get(index))
+        else:
+            table = operation(table)
+    table = list(table)
+    first = table[0] if table else None
+
+    key = None
+    if task['partial'] is not None:
+        kind, operation = task['partial']
+        if kind == 'aggregate':
+            table = list(operation.partial(table).items())
+            key = itemgetter(0)
+        elif kind == 'fold':
+            table = [computations._fold_chunk(operation.folder,
+                                              operation.begin_state, table)]
+        else:
+            table = [line for top in operation.select(
+                enumerate(table)).values() for _, line in top]
+
+    partition = task['partition']
+    if partition is None or partition[0] == 'single':
+        return first, table
+    if key is None:
+        key = itemgetter(*partition[1])
+    if partition[0] == 'range':
+        table.sort(key=key)
+        return first, table
+    parts = [[] for _ in range(task['partitions'])]
+    for item in table:
+        parts[_partition_number(key(item), task['partitions'])].append(item)
+    return first, parts
+
+
+def run_worker(address, authkey):
+    """
+    Computes tasks of a coordinator until it closes the connection
+    :param address: pair of host and port of the coordinator
+    :param authkey: bytes -- authentication key of the cluster
+    :return:
+    """
+
+    with Client(address, authkey=authkey) as connection:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+            if message[0] == 'stop':
+                return
+            _, number, payload = message
+            try:
+                reply = ('result', number, pickle.dumps(
+                    _run_task(pickle.loads(payload)),
+                    computations.ROWS_PROTOCOL))
+            except Exception:
+                reply = ('error', number, traceback.format_exc())
+            connection.send(reply)
+
+
+def _nodes(root):
+    """
+    :param root: _Node
+    :return: list of nodes root depends on and root, each after its
+    dependencies
+    """
+
+    order = []
+
+    def visit(node):
+        for dependency in node.dependencies:
+            if dependency not in order:
+                visit(dependency)
+        order.append(node)
+
+    visit(root)
+    return order
+
+
+def _load(part):
+    if isinstance(part, str):
+        return list(computations._read_run(part))
+    return part
+
+
+def _lines(parts, order):
+    """
+    :param parts: list of paths to parts of a result, None for empty ones
+    :param order: tuple of columns every part is sorted by
+    :return: yields lines of the result, merged by order
+    """
+
+    runs = [computations._read_run(part) for part in parts
+            if part is not None]
+    if order:
+        return heapq.merge(*runs, key=itemgetter(*order))
+    return chain.from_iterable(runs)
+
+
+class Cluster(object):
+    """
+    Coordinator of workers computing graphs, see the module docstring.
+    Workers connect with run_worker at any time, a computation waits for
+    the first one for CONNECT_TIMEOUT seconds.
+
+    Results are the same as of a local run, but lines go in the same
+    order only when the plan sorts the result (see explain), and lines
+    of a group may come to a reducer in other order after several
+    shuffles. Schema, memory limit and workers of operations
+    are ignored
+    """
+
+    def __init__(self, address=('localhost', 0), authkey=None,
+                 partitions=None, split_size=computations.SPLIT_SIZE,
+                 retries=2, directory=None):
+        """
+        :param address: pair of host and port to listen on,
+        port 0 -- any free port, see address attribute
+        :param authkey: bytes -- key workers authenticate with, random if
+        None. Data from workers is unpickled, so the key must be secret
+        :param partitions: number of tasks of stages after a shuffle,
+        number of connected workers if None
+        :param split_size: number of bytes of an input file read by one
+        task, ShardedSource inputs are split by their own split_size
+        :param retries: number of times a failed task is computed again
+        :param directory: directory for parts of results, system default
+        if None
+        """
+
+        if authkey is None:
+            authkey = os.urandom(32)
+        if not isinstance(authkey, bytes):
+            raise TypeError('Authentication key must be bytes')
+        if partitions is not None and not (isinstance(partitions, int)
+                                           and partitions > 0):
+            raise TypeError('Number of partitions must be positive int')
+        if not (isinstance(split_size, int) and split_size > 0):
+            raise TypeError('Split size must be positive int')
+        if not (isinstance(retries, int) and retries >= 0):
+            raise TypeError('Number of retries must be non-negative int')
+        self.authkey = authkey
+        self.partitions = partitions
+        self.split_size = split_size
+        self.retries = retries
+        self.directory = directory
+        self.__listener = Listener(address, authkey=authkey)
+        self.address = self.__listener.address
+        self.__workers = []
+        # connection -- number of the task it computes
+        self.__busy = {}
+        self.__tasks = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+        self.__lock = threading.Lock()
+        self.__accepting = threading.Thread(target=self.__accept,
+                                            daemon=True)
+        self.__accepting.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__listener.accept()
+            except (AuthenticationError, EOFError):
+                continue
+            except OSError:
+                if self.__closed:
+                    return
+                continue
+            if self.__closed:
+                connection.close()
+                return
+            with self.__condition:
+                self.__workers.append(connection)
+                self.__condition.notify_all()
+
+    @property
+    def workers(self):
+        """
+        :return: number of connected workers
+        """
+
+        with self.__condition:
+            return len(self.__workers)
+
+    def wait_workers(self, count, timeout=None):
+        """
+        :param count: number of workers
+        :param timeout: seconds to wait, None -- forever
+        :return: True if at least count workers are connected
+        """
+
+        with self.__condition:
+            return self.__condition.wait_for(
+                lambda: len(self.__workers) >= count, timeout)
+
+    def close(self):
+        """
+        Stops listening and disconnects workers, run_worker returns then
+        :return:
+        """
+
+        if self.__closed:
+            return
+        self.__closed = True
+        try:
+            # wakes up accept
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        self.__accepting.join()
+        self.__listener.close()
+        with self.__condition:
+            workers, self.__workers = self.__workers, []
+        for connection in workers:
+            try:
+                connection.send(('stop',))
+            except OSError:
+                pass
+            connection.close()
+
+    def compute(self, root):
+        """
+        Computes a graph with everything it depends on,
+        see ComputationGraph.run
+        :param root: _Node of the graph
+        :return: list -- result of the graph
+        """
+
+        if self.__closed:
+            raise RuntimeError('Cluster is closed')
+        if not self.wait_workers(1, CONNECT_TIMEOUT):
+            raise RuntimeError('No workers connected to the cluster')
+        with self.__lock:
+            directory = tempfile.mkdtemp(prefix='cg_cluster_',
+                                         dir=self.directory)
+            try:
+                nodes = _nodes(root)
+                consumers = {node: 0 for node in nodes}
+                for node in nodes:
+                    for dependency in node.dependencies:
+                        consumers[dependency] += 1
+                results = {}
+                for node in nodes:
+                    results[node] = self.__compute_node(node, results,
+                                                        directory)
+                    for dependency in node.dependencies:
+                        consumers[dependency] -= 1
+                        if consumers[dependency] == 0:
+                            for part in results.pop(dependency)[0]:
+                                if part is not None:
+                                    os.remove(part)
+                return list(_lines(*results[root]))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def __inputs(self, node, results):
+        """
+        :return: list of parts of input for every task of the first stage,
+        parts are sources or paths to stored parts
+        """
+
+        source = node.source
+        if isinstance(source, computations._Node):
+            return [[part] for part in results[source][0]
+                    if part is not None] or [[]]
+        if source is None:
+            return [[]]
+        if isinstance(source, str):
+            source = computations._file_source(source)
+        if isinstance(source, JsonLinesSource) and source.start == 0 \
+                and source.end is None:
+            source = ShardedSource([source.path], split_size=self.split_size,
+                                   decoder=source.decoder)
+        if isinstance(source, ShardedSource):
+            return [[split] for split in source.splits()] or [[]]
+        return [[source]]
+
+    def __compute_node(self, node, results, directory):
+        """
+        :return: pair of list of paths to parts of the result, None for
+        empty ones, and tuple of columns every part is sorted by
+        """
+
+        plan, order = node.graph._plan()
+        stages = _stages(plan)
+        partitions = self.partitions or max(1, self.workers)
+        inputs = self.__inputs(node, results)
+        firsts = []
+        for number, stage in enumerate(stages):
+            tables, columns = {}, {}
+            for index, operation in enumerate(stage.operations):
+                if not isinstance(operation, Join):
+                    continue
+                right, _ = results[node.joins[operation]]
+                if operation.strategy == 'cross':
+                    tables[index] = [right] * len(inputs)
+                    continue
+                # the first operation of a stage after a shuffle
+                shuffle = _Stage()
+                shuffle.partition = stages[number - 1].partition
+                parts, _ = self.__run_stage(
+                    shuffle, [[part] for part in right if part is not None]
+                    or [[]], partitions, directory)
+                tables[index] = self.__partitions(shuffle, parts)
+                right_first = next((next(computations._read_run(part))
+                                    for part in right if part is not None),
+                                   None)
+                columns[index] = (next((line for line in firsts
+                                        if line is not None), None),
+                                  right_first)
+
+            outputs, firsts = self.__run_stage(stage, inputs, partitions,
+                                               directory, tables, columns)
+            if stage.partition is None:
+                return [output[0] for output in outputs], order
+            inputs = self.__partitions(stage, outputs)
+
+    @staticmethod
+    def __partitions(stage, outputs):
+        """
+        :param stage: _Stage
+        :param outputs: list of lists of parts of output of every task
+        :return: list of parts of input for every task of the next stage
+        """
+
+        count = len(outputs[0]) if outputs else 1
+        return [[output[number] for output in outputs
+                 if output[number] is not None]
+                for number in range(count)]
+
+    def __run_stage(self, stage, inputs, partitions, directory,
+                    tables=None, columns=None):
+        """
+        :param stage: _Stage
+        :param inputs: list of parts of input for every task
+        :param partitions: number of partitions of output
+        :param directory: directory for parts
+        :param tables: dict of index of Join in operations of the stage
+        and list of parts of the table to join for every task
+        :param columns: dict of index of Join and pair of lines naming
+        columns of its result
+        :return: list of lists of paths to parts of output of every task,
+        list of the first output lines of every task
+        """
+
+        task = {'combine': stage.combine,
+                'operations': [_portable(operation)
+                               for operation in stage.operations],
+                'partial': stage.partial and (stage.partial[0],
+                                              _portable(stage.partial[1])),
+                'partition': stage.partition, 'partitions': partitions,
+                'columns': columns or {}}
+        if stage.combine[0] in ('aggregate', 'fold'):
+            task['combine'] = (stage.combine[0],
+                               _portable(stage.combine[1]))
+        try:
+            pickle.dumps(task)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            raise TypeError('Functions of operations must be picklable to '
+                            'run on a cluster, define them at module level')
+        tables = tables or {}
+
+        def payload(number):
+            return pickle.dumps(dict(
+                task, input=[_load(part) for part in inputs[number]],
+                tables={index: [line for part in parts[number]
+                                if part is not None
+                                for line in _load(part)]
+                        for index, parts in tables.items()}),
+                computations.ROWS_PROTOCOL)
+
+        outputs = [None] * len(inputs)
+        firsts = [None] * len(inputs)
+        samples = []
+
+        def collect(number, result):
+            firsts[number], output = result
+            if stage.partition is not None and stage.partition[0] == 'hash':
+                outputs[number] = [self.__store(part, directory)
+                                   for part in output]
+                return
+            if stage.partition is not None and stage.partition[0] == 'range':
+                key = itemgetter(*stage.partition[1])
+                step = max(1, len(output) // SAMPLE_SIZE)
+                samples.extend(key(line) for line in output[::step])
+            outputs[number] = [self.__store(output, directory)]
+
+        self.__run_tasks(len(inputs), payload, collect)
+        if stage.partition is not None and stage.partition[0] == 'range':
+            outputs = self.__split_ranges(outputs, samples,
+                                          stage.partition[1], partitions,
+                                          directory)
+        return outputs, firsts
+
+    @staticmethod
+    def __store(lines, directory):
+        if not lines:
+            return None
+        return computations._spill_run(lines, directory)
+
+    def __split_ranges(self, outputs, samples, keys, partitions, directory):
+        """
+        Splits sorted outputs of tasks into ranges of keys chosen by
+        samples, equal keys go to one range
+        :return: list of lists of paths to parts for every range
+        """
+
+        samples.sort()
+        bounds = [samples[len(samples) * number // partitions]
+                  for number in range(1, partitions)] if samples else []
+        key = itemgetter(*keys)
+        result = []
+        for output in outputs:
+            lines = _load(output[0]) if output[0] is not None else []
+            values = [key(line) for line in lines]
+            cuts = [0] + [bisect.bisect_right(values, bound)
+                          for bound in bounds] + [len(lines)]
+            result.append([self.__store(lines[start:end], directory)
+                           for start, end in zip(cuts, cuts[1:])])
+            if output[0] is not None:
+                os.remove(output[0])
+        return result
+
+    def __drop(self, connection):
+        with self.__condition:
+            if connection in self.__workers:
+                self.__workers.remove(connection)
+        self.__busy.pop(connection, None)
+        connection.close()
+
+    def __run_tasks(self, count, payload, collect):
+        """
+        Sends tasks to idle workers, a task is computed again when it
+        fails or its worker disconnects, at most retries times
+        :param count: number of tasks
+        :param payload: function of task number returning pickled task
+        :param collect: function of task number and its result
+        :return:
+        """
+
+        pending = deque(range(count))
+        attempts = [0] * count
+        # number of sent task -- task number
+        running = {}
+        while pending or running:
+            with self.__condition:
+                idle = [connection for connection in self.__workers
+                        if connection not in self.__busy]
+            while pending and idle:
+                connection = idle.pop()
+                task = pending.popleft()
+                self.__tasks += 1
+                try:
+                    connection.send(('task', self.__tasks, payload(task)))
+                except OSError:
+                    self.__drop(connection)
+                    pending.appendleft(task)
+                    continue
+                self.__busy[connection] = self.__tasks
+                running[self.__tasks] = task
+
+            if not self.__busy:
+                if not self.wait_workers(1, CONNECT_TIMEOUT):
+                    raise RuntimeError('No workers connected to the '
+                                       'cluster')
+                continue
+            for connection in wait(list(self.__busy), timeout=0.1):
+                # tasks of a failed computation are not in running
+                task = running.pop(self.__busy.pop(connection), None)
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    self.__drop(connection)
+                    error = 'Worker disconnected'
+                else:
+                    if task is None:
+                        continue
+                    if message[0] == 'result':
+                        collect(task, pickle.loads(message[2]))
+                        continue
+                    error = message[2]
+                if task is None:
+                    continue
+                attempts[task] += 1
+                if attempts[task] > self.retries:
+                    raise RuntimeError('Task failed {} times, the last '
+                                       'error:\n{}'.format(attempts[task],
+                                                           error))
+                pending.append(task)
+
+
+class LocalCluster(Cluster):
+    """
+    Cluster with workers in processes of this machine
+    """
+
+    def __init__(self, workers=2, **kwargs):
+        """
+        :param workers: number of worker processes
+        :param kwargs: parameters of Cluster except address
+        """
+
+        if not (isinstance(workers, int) and workers > 0):
+            raise TypeError('Number of workers must be positive int')
+        super().__init__(('localhost', 0), **kwargs)
+        self.processes = [Process(target=run_worker,
+                                  args=(self.address, self.authkey),
+                                  daemon=True)
+                          for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+        if not self.wait_workers(workers, CONNECT_TIMEOUT):
+            self.close()
+            raise RuntimeError('Workers did not connect')
+
+    def close(self):
+        super().close()
+        for process in self.processes:
+            process.join()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Worker of a cluster computing graphs, authentication '
+                    'key is taken from {} environment '
+                    'variable'.format(AUTHKEY_VARIABLE))
+    parser.add_argument('address', help='host:port of the coordinator')
+    arguments = parser.parse_args(arguments)
+    host, _, port = arguments.address.rpartition(':')
+    if not host or not port.isdigit():
+        parser.error('address must be host:port')
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        parser.error('{} is not set'.format(AUTHKEY_VARIABLE))
+    run_worker((host, int(port)), authkey.encode())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
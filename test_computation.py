@@ -1,6 +1,23 @@
+import gc
+import json
+import os
+import tempfile
+import tracemalloc
 import unittest
+import weakref
+from unittest import mock
+from operator import itemgetter
 
 import computations
+import distributed
+
+
+def write_table(table):
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as output:
+        for line in table:
+            output.write(json.dumps(line) + '\n')
+    return path
 
 
 class TestInputSetting(unittest.TestCase):
@@ -196,5 +213,1771 @@ class TestJoinAdd(unittest.TestCase):
         self.assertRaises(TypeError, g1.add_join, (g2, 'input.txt'), ('key',),
                           'kek')
 
+
+class TestStreamingRun(unittest.TestCase):
+    calls = []
+
+    @staticmethod
+    def first_mapper(line):
+        TestStreamingRun.calls.append(('first', line['id']))
+        yield {'id': line['id'], 'value': line['value'] * 2}
+
+    @staticmethod
+    def second_mapper(line):
+        TestStreamingRun.calls.append(('second', line['id']))
+        yield line
+
+    def setUp(self):
+        TestStreamingRun.calls = []
+        self.path = write_table([{'id': i, 'value': 3 - i}
+                                 for i in range(3)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_maps_are_chained_lazily(self):
+        g = computations.ComputationGraph(streaming=True)
+        g.add_mapper(TestStreamingRun.first_mapper)
+        g.add_mapper(TestStreamingRun.second_mapper)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(TestStreamingRun.calls,
+                         [('first', 0), ('second', 0), ('first', 1),
+                          ('second', 1), ('first', 2), ('second', 2)])
+
+    def test_same_result_as_eager_run(self):
+        results = []
+        for streaming in (False, True):
+            g = computations.ComputationGraph(streaming=streaming)
+            g.add_mapper(TestStreamingRun.first_mapper)
+            g.add_sort('value')
+            g.set_input(self.path)
+            g.run()
+            results.append(g.result)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([line['id'] for line in results[1]], [2, 1, 0])
+
+
+class TestExternalSort(unittest.TestCase):
+    @staticmethod
+    def count_reducer(records):
+        yield {'key': records[0]['key'], 'count': len(records)}
+
+    def setUp(self):
+        self.table = [{'key': (i * 7) % 5, 'order': i} for i in range(23)]
+
+    def test_external_sorted_is_stable(self):
+        result = list(computations.external_sorted(
+            iter(self.table), lambda line: line['key'], buffer_size=4))
+        self.assertEqual(result, sorted(self.table,
+                                        key=lambda line: line['key']))
+
+    def test_spill_files_are_removed(self):
+        directory = tempfile.mkdtemp()
+        result = computations.external_sorted(
+            self.table, lambda line: line['key'], 2, directory)
+        next(result)
+        self.assertTrue(os.listdir(directory))
+        list(result)
+        self.assertFalse(os.listdir(directory))
+        os.rmdir(directory)
+
+    def test_many_runs_are_merged(self):
+        table = [{'key': (i * 13) % 101} for i in range(500)]
+        result = list(computations.external_sorted(
+            table, itemgetter('key'), buffer_size=3))
+        self.assertEqual(result, sorted(table, key=itemgetter('key')))
+
+    def test_reduce_with_small_budget(self):
+        path = write_table(self.table)
+        g = computations.ComputationGraph(sort_buffer_size=3)
+        g.add_reducer(TestExternalSort.count_reducer, 'key')
+        g.set_input(path)
+        g.run()
+        os.remove(path)
+        self.assertEqual(g.result, [{'key': key, 'count': count}
+                                    for key, count in
+                                    zip(range(5), (5, 4, 5, 4, 5))])
+
+
+class TestHashReduce(unittest.TestCase):
+    @staticmethod
+    def count_reducer(records):
+        yield {'key': records[0]['key'], 'count': len(records)}
+
+    def setUp(self):
+        self.path = write_table([{'key': key} for key in 'cabcaac'])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_reducer(self, **kwargs):
+        g = computations.ComputationGraph()
+        g.add_reducer(TestHashReduce.count_reducer, 'key', **kwargs)
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_hash_strategy_groups_by_first_appearance(self):
+        self.assertEqual(self.run_reducer(strategy='hash'),
+                         [{'key': 'c', 'count': 3}, {'key': 'a', 'count': 3},
+                          {'key': 'b', 'count': 1}])
+
+    def test_ordered_output_falls_back_to_sort(self):
+        self.assertEqual(self.run_reducer(strategy='hash', ordered=True),
+                         self.run_reducer())
+
+    def test_unknown_strategy(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_reducer,
+                          TestHashReduce.count_reducer, 'key', 'tree')
+
+
+class TestJoin(unittest.TestCase):
+    left = [{'k': 1, 'v': 'a'}, {'k': 2, 'v': 'b'}, {'k': 2, 'v': 'c'},
+            {'k': 4, 'v': 'd'}]
+    right = [{'k': 3, 'v': 'x', 'w': 0}, {'k': 2, 'v': 'y', 'w': 1},
+             {'k': 2, 'v': 'z', 'w': 2}]
+
+    def setUp(self):
+        self.left_path = write_table(TestJoin.left)
+        self.right_path = write_table(TestJoin.right)
+
+    def tearDown(self):
+        os.remove(self.left_path)
+        os.remove(self.right_path)
+
+    def join(self, strategy, keys=('k',), method='merge', **kwargs):
+        g, on = computations.ComputationGraph(**kwargs), \
+                computations.ComputationGraph()
+        g.add_join((on, self.right_path), keys, strategy, method)
+        g.set_input(self.left_path)
+        g.run()
+        return [(line['k'], line['left_v'], line['right_v'], line['w'])
+                for line in g.result]
+
+    def test_inner(self):
+        self.assertEqual(self.join('inner'),
+                         [(2, 'b', 'y', 1), (2, 'b', 'z', 2),
+                          (2, 'c', 'y', 1), (2, 'c', 'z', 2)])
+
+    def test_left(self):
+        self.assertEqual(self.join('left'),
+                         [(1, 'a', None, None), (2, 'b', 'y', 1),
+                          (2, 'b', 'z', 2), (2, 'c', 'y', 1),
+                          (2, 'c', 'z', 2), (4, 'd', None, None)])
+
+    def test_right(self):
+        self.assertEqual(self.join('right'),
+                         [(2, 'b', 'y', 1), (2, 'b', 'z', 2),
+                          (2, 'c', 'y', 1), (2, 'c', 'z', 2),
+                          (3, None, 'x', 0)])
+
+    def test_outer_with_small_budget(self):
+        result = self.join('outer', sort_buffer_size=1, streaming=True)
+        self.assertEqual(result,
+                         [(1, 'a', None, None), (2, 'b', 'y', 1),
+                          (2, 'b', 'z', 2), (2, 'c', 'y', 1),
+                          (2, 'c', 'z', 2), (3, None, 'x', 0),
+                          (4, 'd', None, None)])
+
+    def test_hash_join_matches_merge_join(self):
+        for strategy in ('inner', 'left', 'right', 'outer'):
+            self.assertEqual(sorted(self.join(strategy, method='hash'),
+                                    key=repr),
+                             sorted(self.join(strategy), key=repr))
+
+    def test_hash_join_builds_on_left_table(self):
+        os.remove(self.right_path)
+        self.right_path = write_table(TestJoin.right * 3)
+        for strategy in ('inner', 'left', 'right', 'outer'):
+            self.assertEqual(sorted(self.join(strategy, method='hash'),
+                                    key=repr),
+                             sorted(self.join(strategy), key=repr))
+
+    def test_unknown_join_method(self):
+        g1 = computations.ComputationGraph()
+        g2 = computations.ComputationGraph()
+        self.assertRaises(TypeError, g1.add_join, (g2, 'input.txt'), ('key',),
+                          'inner', 'nested')
+
+    def test_columns_are_sorted(self):
+        g, on = computations.ComputationGraph(), \
+                computations.ComputationGraph()
+        g.add_join((on, self.right_path), ('k',), 'inner')
+        g.set_input(self.left_path)
+        g.run()
+        self.assertEqual(list(g.result[0]), ['k', 'left_v', 'right_v', 'w'])
+
+    def test_cross(self):
+        g, on = computations.ComputationGraph(), \
+                computations.ComputationGraph()
+        g.add_join((on, self.right_path), (), 'cross')
+        g.set_input(self.left_path)
+        g.run()
+        self.assertEqual(len(g.result), 12)
+        self.assertEqual(list(g.result[0]),
+                         ['left_k', 'left_v', 'right_k', 'right_v', 'w'])
+
+
+class TestParallelMap(unittest.TestCase):
+    @staticmethod
+    def split_mapper(line):
+        for i in range(line['n']):
+            yield {'n': line['n'], 'i': i}
+
+    def setUp(self):
+        self.path = write_table([{'n': n % 7} for n in range(50)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_mapper(self, **kwargs):
+        g = computations.ComputationGraph(streaming=True)
+        g.add_mapper(TestParallelMap.split_mapper, **kwargs)
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_ordered_result_is_same(self):
+        self.assertEqual(self.run_mapper(workers=2, chunk_size=3),
+                         self.run_mapper())
+
+    def test_unordered_result_has_same_lines(self):
+        self.assertEqual(
+            sorted(self.run_mapper(workers=3, chunk_size=4, ordered=False),
+                   key=repr),
+            sorted(self.run_mapper(), key=repr))
+
+    def test_local_mapper_is_rejected(self):
+        def local_mapper(line):
+            yield line
+
+        g = computations.ComputationGraph()
+        self.assertTrue(g.add_mapper(local_mapper))
+        self.assertRaises(TypeError, g.add_mapper, local_mapper, 2)
+        self.assertRaises(TypeError, g.add_mapper,
+                          TestParallelMap.split_mapper, 0)
+        self.assertRaises(TypeError, g.add_mapper,
+                          TestParallelMap.split_mapper, 2, 0)
+
+
+class TestParallelReduce(unittest.TestCase):
+    @staticmethod
+    def sum_reducer(records):
+        yield {'key': records[0]['key'],
+               'sum': sum(record['value'] for record in records)}
+
+    def setUp(self):
+        self.path = write_table([{'key': 'k{}'.format(i % 11), 'value': i}
+                                 for i in range(100)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_reducer(self, sort_buffer_size=computations.SORT_BUFFER_SIZE,
+                    **kwargs):
+        g = computations.ComputationGraph(sort_buffer_size=sort_buffer_size)
+        g.add_reducer(TestParallelReduce.sum_reducer, 'key', **kwargs)
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_ordered_result_is_same(self):
+        self.assertEqual(self.run_reducer(workers=3, ordered=True),
+                         self.run_reducer())
+
+    def test_unordered_result_has_same_lines(self):
+        expected = sorted(self.run_reducer(), key=repr)
+        for strategy in ('sort', 'hash'):
+            self.assertEqual(
+                sorted(self.run_reducer(workers=2, strategy=strategy),
+                       key=repr), expected)
+
+    def test_parts_are_spilled(self):
+        self.assertEqual(self.run_reducer(sort_buffer_size=7, workers=4,
+                                          ordered=True),
+                         self.run_reducer())
+
+
+class TestScheduler(unittest.TestCase):
+    calls = 0
+
+    @staticmethod
+    def counting_mapper(line):
+        TestScheduler.calls += 1
+        yield line
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'k': records[0]['k'], 'count': len(records)}
+
+    class Tag(object):
+        pass
+
+    tags = []
+
+    @staticmethod
+    def tagging_mapper(line):
+        tag = TestScheduler.Tag()
+        TestScheduler.tags.append(weakref.ref(tag))
+        yield dict(line, tag=tag)
+
+    @staticmethod
+    def untagging_mapper(line):
+        yield {'k': line['k'], 'v': line['v']}
+
+    def setUp(self):
+        TestScheduler.calls = 0
+        TestScheduler.tags = []
+        self.path = write_table([{'k': i % 3, 'v': i} for i in range(9)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def make_graphs(self):
+        base = computations.ComputationGraph()
+        base.add_mapper(TestScheduler.counting_mapper)
+        base.set_input(self.path)
+
+        counts = computations.ComputationGraph()
+        counts.add_reducer(TestScheduler.count_reducer, 'k')
+        counts.set_input(base)
+
+        main = computations.ComputationGraph()
+        main.add_join((counts, base), ('k',), 'inner')
+        main.add_join((base, self.path), ('k',), 'inner')
+        main.set_input(base)
+        return main, counts
+
+    def test_shared_graph_is_computed_once(self):
+        main, _ = self.make_graphs()
+        main.run()
+        self.assertEqual(len(main.result), 27)
+        self.assertEqual(TestScheduler.calls, 9)
+
+    def test_concurrent_run_gives_same_result(self):
+        main, _ = self.make_graphs()
+        main.run()
+        expected = main.result
+        main, _ = self.make_graphs()
+        main.run(workers=3)
+        self.assertEqual(main.result, expected)
+
+    def test_intermediate_results_are_released(self):
+        main, counts = self.make_graphs()
+        main.run()
+        self.assertFalse(counts.is_counted)
+        self.assertEqual(counts.result, [])
+
+        tags = []
+
+        def tagging_reducer(records):
+            tag = TestScheduler.Tag()
+            tags.append(weakref.ref(tag))
+            yield {'k': records[0]['k'], 'tag': tag}
+
+        tagged = computations.ComputationGraph()
+        tagged.add_mapper(TestScheduler.tagging_mapper)
+        tagged.add_reducer(tagging_reducer, 'k')
+        tagged.set_input(self.path)
+        main = computations.ComputationGraph()
+        main.add_join((tagged, self.path), ('k',), 'inner')
+        main.add_mapper(TestScheduler.untagging_mapper)
+        main.set_input(self.path)
+        main.run()
+        self.assertEqual(len(main.result), 9)
+        gc.collect()
+        tags += TestScheduler.tags
+        self.assertEqual(len(tags), 12)
+        self.assertEqual([tag() for tag in tags], [None] * 12)
+
+    def test_cycle_raises_exception(self):
+        g1, g2 = computations.ComputationGraph(), \
+                 computations.ComputationGraph()
+        g1.set_input(g2)
+        g2.set_input(g1)
+        self.assertRaises(RuntimeError, g1.run)
+
+
+class TestResultCache(unittest.TestCase):
+    calls = 0
+
+    @staticmethod
+    def counting_mapper(line):
+        TestResultCache.calls += 1
+        yield line
+
+    @staticmethod
+    def doubling_mapper(line):
+        yield {'v': line['v'] * 2}
+
+    def setUp(self):
+        TestResultCache.calls = 0
+        self.directory = tempfile.mkdtemp()
+        self.cache = computations.ResultCache(self.directory,
+                                              compression='zlib')
+        self.path = write_table([{'v': i} for i in range(5)])
+
+    def tearDown(self):
+        self.cache.clear()
+        os.rmdir(self.directory)
+        os.remove(self.path)
+
+    def run_graph(self, mapper, cache):
+        dependency = computations.ComputationGraph()
+        dependency.add_mapper(mapper)
+        g = computations.ComputationGraph()
+        g.add_join((dependency, self.path), (), 'cross')
+        g.set_input(self.path)
+        g.run(cache=cache)
+        return g.result
+
+    def test_result_is_loaded_from_cache(self):
+        expected = self.run_graph(TestResultCache.counting_mapper, self.cache)
+        self.assertEqual(TestResultCache.calls, 5)
+        self.assertEqual(
+            self.run_graph(TestResultCache.counting_mapper, self.cache),
+            expected)
+        self.assertEqual(TestResultCache.calls, 5)
+
+    def test_changed_input_is_recomputed(self):
+        self.run_graph(TestResultCache.counting_mapper, self.cache)
+        with open(self.path, 'a') as output:
+            output.write(json.dumps({'v': 5}) + '\n')
+        self.assertEqual(
+            len(self.run_graph(TestResultCache.counting_mapper, self.cache)),
+            36)
+        self.assertEqual(TestResultCache.calls, 11)
+
+    def test_changed_operations_are_recomputed(self):
+        self.run_graph(TestResultCache.counting_mapper, self.cache)
+        self.assertEqual(
+            self.run_graph(TestResultCache.doubling_mapper, self.cache),
+            self.run_graph(TestResultCache.doubling_mapper, None))
+
+    @unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+    def test_changed_schema_is_recomputed(self):
+        results = []
+        for schema in (None, {'v': 'float64'}):
+            g = computations.ComputationGraph(schema=schema)
+            g.add_sort('v')
+            g.set_input(self.path)
+            g.run(cache=self.cache)
+            results.append(g.result)
+        self.assertIsInstance(results[0][0]['v'], int)
+        self.assertIsInstance(results[1][0]['v'], float)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = computations.ResultCache(self.directory, max_size=1)
+        cache.put('first', [{'v': 1}])
+        cache.put('second', [{'v': 2}])
+        self.assertNotIn('first', cache)
+        self.assertEqual(cache.get('second'), [{'v': 2}])
+
+
+class TestJsonLinesSource(unittest.TestCase):
+    def setUp(self):
+        self.table = [{'id': i, 'text': 'line ' * i} for i in range(20)]
+        fd, self.path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'w') as output:
+            output.write('\n'.join(json.dumps(line) for line in self.table))
+            output.write('\n\n')
+        self.empty = write_table([])
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.empty)
+
+    def test_lines_are_split_between_chunks(self):
+        for decoder in computations.JSON_DECODERS:
+            for use_mmap in (True, False):
+                source = computations.JsonLinesSource(self.path, decoder,
+                                                      use_mmap, 16)
+                self.assertEqual(list(source), self.table)
+
+    def test_empty_file(self):
+        self.assertEqual(list(computations.JsonLinesSource(self.empty)), [])
+
+    def test_graph_input(self):
+        g = computations.ComputationGraph()
+        g.set_input(computations.JsonLinesSource(self.path, 'json'))
+        g.run()
+        self.assertEqual(g.result, self.table)
+
+    def test_unknown_decoder(self):
+        self.assertRaises(TypeError, computations.JsonLinesSource,
+                          self.path, 'yaml')
+        self.assertRaises(TypeError, computations.JsonLinesSource,
+                          self.path, 10)
+
+
+@unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+class TestColumnarTable(unittest.TestCase):
+    schema = {'start': 'float64', 'end': 'float64', 'edge_id': 'int64'}
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'start': records[0]['start'], 'count': len(records),
+               'ids': [record['edge_id'] for record in records]}
+
+    def setUp(self):
+        self.table = [{'start': [37.5 + i % 3, 55.7 - i % 2],
+                       'end': [37.6, 55.8 + i],
+                       'edge_id': 8414926848168493057 - i}
+                      for i in range(12)]
+        self.path = write_table(self.table)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_graph(self, schema):
+        g = computations.ComputationGraph(schema=schema)
+        g.add_sort('edge_id')
+        g.add_reducer(TestColumnarTable.count_reducer, 'start')
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_rows_round_trip(self):
+        table = computations.ColumnarTable.from_rows(self.table,
+                                                     TestColumnarTable.schema)
+        self.assertEqual(table['start'].shape, (12, 2))
+        self.assertEqual(list(table.to_rows()), self.table)
+
+    def test_same_result_as_rows(self):
+        self.assertEqual(self.run_graph(TestColumnarTable.schema),
+                         self.run_graph(None))
+
+    def test_reduce_after_sort_by_same_keys(self):
+        def graph(schema):
+            g = computations.ComputationGraph(schema=schema)
+            g.add_sort('start')
+            g.add_reducer(TestColumnarTable.count_reducer, 'start')
+            g.set_input(self.path)
+            g.run()
+            return g.result
+
+        self.assertEqual(graph(TestColumnarTable.schema), graph(None))
+
+    def test_schema_must_describe_all_columns(self):
+        self.assertRaises(TypeError, computations.ColumnarTable.from_rows,
+                          self.table, {'start': 'float64'})
+        self.assertRaises(TypeError, computations.ComputationGraph,
+                          schema=['start'])
+
+
+class TestBatchOperations(unittest.TestCase):
+    @staticmethod
+    def length_mapper(batch):
+        if isinstance(batch, computations.ColumnarTable):
+            delta = batch['end'] - batch['start']
+            lengths = (delta ** 2).sum(axis=1) ** 0.5
+            return computations.ColumnarTable({'edge_id': batch['edge_id'],
+                                               'length': lengths})
+        return [{'edge_id': line['edge_id'],
+                 'length': sum((end - start) ** 2 for start, end in
+                               zip(line['start'], line['end'])) ** 0.5}
+                for line in batch]
+
+    @staticmethod
+    def total_reducer(columns):
+        return {'parity': [columns['edge_id'][0] % 2],
+                'total': [float(sum(columns['length']))],
+                'count': [len(columns['length'])]}
+
+    @staticmethod
+    def parity_mapper(line):
+        yield {'edge_id': line['edge_id'] % 2, 'length': line['length']}
+
+    @staticmethod
+    def count_reducer(columns):
+        return {'edge_id': [columns['edge_id'][0]],
+                'count': [len(columns['edge_id'])]}
+
+    def setUp(self):
+        self.path = write_table([{'start': [0.0, float(i)],
+                                  'end': [3.0, i + 4.0], 'edge_id': i}
+                                 for i in range(10)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def run_graph(self, **kwargs):
+        g = computations.ComputationGraph(**kwargs)
+        g.add_batch_mapper(TestBatchOperations.length_mapper, batch_size=3)
+        g.add_mapper(TestBatchOperations.parity_mapper)
+        g.add_batch_reducer(TestBatchOperations.total_reducer, 'edge_id')
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_row_batches(self):
+        self.assertEqual(self.run_graph(),
+                         [{'parity': 0, 'total': 25.0, 'count': 5},
+                          {'parity': 1, 'total': 25.0, 'count': 5}])
+
+    @unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+    def test_columnar_batches(self):
+        schema = {'start': 'float64', 'end': 'float64', 'edge_id': 'int64'}
+        self.assertEqual(self.run_graph(schema=schema), self.run_graph())
+
+    @unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+    def test_columnar_batch_reducer(self):
+        results = []
+        for schema in (None, {'start': 'float64', 'end': 'float64',
+                              'edge_id': 'int64'}):
+            g = computations.ComputationGraph(schema=schema)
+            g.add_batch_mapper(TestBatchOperations.length_mapper)
+            g.add_batch_reducer(TestBatchOperations.total_reducer,
+                                'length')
+            g.set_input(self.path)
+            g.run()
+            results.append(g.result)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], [{'parity': 0, 'total': 50.0,
+                                       'count': 10}])
+
+    @unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+    def test_columnar_batch_reducer_after_sort(self):
+        g = computations.ComputationGraph(
+            schema={'start': 'float64', 'end': 'float64', 'edge_id': 'int64'})
+        g.add_sort('edge_id')
+        g.add_batch_reducer(TestBatchOperations.count_reducer, 'edge_id')
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(g.result, [{'edge_id': i, 'count': 1}
+                                    for i in range(10)])
+
+    def test_incorrect_batch_functions(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_batch_mapper, 10)
+        self.assertRaises(TypeError, g.add_batch_mapper, lambda x, y: x)
+        self.assertRaises(TypeError, g.add_batch_mapper, lambda x: x, 0)
+        self.assertRaises(TypeError, g.add_batch_reducer, lambda: 1, 'key')
+
+
+class TestCombiner(unittest.TestCase):
+    @staticmethod
+    def word_mapper(line):
+        for word in line['text'].split():
+            yield {'word': word, 'count': 1}
+
+    @staticmethod
+    def merge_counts(first, second):
+        return {'word': first['word'],
+                'count': first['count'] + second['count']}
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'word': records[0]['word'],
+               'count': sum(record['count'] for record in records)}
+
+    def setUp(self):
+        self.path = write_table([{'text': 'a b a c'}, {'text': 'b a d'}])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_combiner_shrinks_table(self):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestCombiner.word_mapper)
+        g.add_combiner(TestCombiner.merge_counts, 'word', buffer_size=2)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(len(g.result), 6)
+
+    def test_buffer_size_is_part_of_cache_key(self):
+        directory = tempfile.mkdtemp()
+        cache = computations.ResultCache(directory)
+        try:
+            for buffer_size, length in ((1, 7), (100, 4)):
+                g = computations.ComputationGraph()
+                g.add_mapper(TestCombiner.word_mapper)
+                g.add_combiner(TestCombiner.merge_counts, 'word',
+                               buffer_size=buffer_size)
+                g.set_input(self.path)
+                g.run(cache=cache)
+                self.assertEqual(len(g.result), length)
+        finally:
+            cache.clear()
+            os.rmdir(directory)
+
+    def test_reducer_with_combiner(self):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestCombiner.word_mapper)
+        g.add_reducer(TestCombiner.count_reducer, 'word',
+                      combiner=TestCombiner.merge_counts)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(g.result, [{'word': 'a', 'count': 3},
+                                    {'word': 'b', 'count': 2},
+                                    {'word': 'c', 'count': 1},
+                                    {'word': 'd', 'count': 1}])
+
+    def test_incorrect_combiner(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_combiner, lambda x: x, 'word')
+        self.assertRaises(TypeError, g.add_combiner,
+                          TestCombiner.merge_counts, ['word'])
+        self.assertRaises(TypeError, g.add_reducer,
+                          TestCombiner.count_reducer, 'word', combiner=10)
+        self.assertEqual(g.operations, [])
+
+
+class TestAggregate(unittest.TestCase):
+    def setUp(self):
+        self.path = write_table([{'word': word, 'doc_id': i % 3, 'tf': i}
+                                 for i, word in enumerate('abacabad')])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def aggregate(self, keys, **kwargs):
+        g = computations.ComputationGraph()
+        g.add_aggregate(keys, **kwargs)
+        g.set_input(self.path)
+        g.run()
+        return g.result
+
+    def test_aggregations(self):
+        self.assertEqual(
+            self.aggregate('word', count='n', sum={'tf': 'tf_sum'},
+                           mean={'tf': 'tf_mean'}, min={'tf': 'tf_min'},
+                           max={'doc_id': 'doc_max'},
+                           count_distinct={'doc_id': 'docs'}),
+            [{'word': 'a', 'n': 4, 'tf_sum': 12, 'tf_mean': 3.0,
+              'tf_min': 0, 'doc_max': 2, 'docs': 3},
+             {'word': 'b', 'n': 2, 'tf_sum': 6, 'tf_mean': 3.0,
+              'tf_min': 1, 'doc_max': 2, 'docs': 2},
+             {'word': 'c', 'n': 1, 'tf_sum': 3, 'tf_mean': 3.0,
+              'tf_min': 3, 'doc_max': 0, 'docs': 1},
+             {'word': 'd', 'n': 1, 'tf_sum': 7, 'tf_mean': 7.0,
+              'tf_min': 7, 'doc_max': 1, 'docs': 1}])
+
+    def test_whole_table(self):
+        self.assertEqual(self.aggregate((), count='docs_count'),
+                         [{'docs_count': 8}])
+
+    def test_partial_aggregates_in_workers(self):
+        kwargs = {'count': 'n', 'mean': {'tf': 'tf_mean'},
+                  'count_distinct': {'word': 'words'}}
+        self.assertEqual(self.aggregate('doc_id', workers=2, chunk_size=3,
+                                        **kwargs),
+                         self.aggregate('doc_id', **kwargs))
+
+    def test_incorrect_aggregations(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_aggregate, 'word')
+        self.assertRaises(TypeError, g.add_aggregate, 'word', count=1)
+        self.assertRaises(TypeError, g.add_aggregate, 'word', sum='tf')
+        self.assertRaises(TypeError, g.add_aggregate, ['word'], count='n')
+
+
+class TestFold(unittest.TestCase):
+    @staticmethod
+    def counter_folder(line, state):
+        state['count'] += 1
+        return state
+
+    @staticmethod
+    def order_folder(line, state):
+        return state + [line['i']]
+
+    @staticmethod
+    def concat(first, second):
+        return first + second
+
+    def setUp(self):
+        self.path = write_table([{'i': i} for i in range(25)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_rerun_starts_from_begin_state(self):
+        g = computations.ComputationGraph()
+        g.add_folder(TestFold.counter_folder, {'count': 0})
+        g.set_input(self.path)
+        g.run()
+        g.set_input(write_table([{'i': 0}]))
+        g.run()
+        os.remove(g.counted_input)
+        self.assertEqual(g.result, [{'count': 1}])
+
+    def test_parallel_fold_keeps_order(self):
+        g = computations.ComputationGraph()
+        g.add_folder(TestFold.order_folder, [], merge=TestFold.concat,
+                     workers=3, chunk_size=2)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(g.result, [list(range(25))])
+
+    def test_workers_require_merge(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_folder, TestFold.order_folder,
+                          [], None, 2)
+        self.assertRaises(TypeError, g.add_folder, TestFold.order_folder,
+                          [], lambda state: state)
+
+
+class TestTopK(unittest.TestCase):
+    def setUp(self):
+        self.table = [{'group': i % 3, 'value': (i * 7) % 10, 'i': i}
+                      for i in range(30)]
+        self.path = write_table(self.table)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def expected(self, k, descending):
+        result = []
+        for group in range(3):
+            lines = [line for line in self.table if line['group'] == group]
+            lines.sort(key=itemgetter('value'), reverse=descending)
+            result.extend(lines[:k])
+        return result
+
+    def test_global_top_k(self):
+        g = computations.ComputationGraph()
+        g.add_top_k(4, 'value')
+        g.set_input(self.path)
+        g.run()
+        expected = sorted(self.table, key=itemgetter('value'),
+                          reverse=True)[:4]
+        self.assertEqual(g.result, expected)
+
+    def test_top_k_by_group(self):
+        for descending in (True, False):
+            g = computations.ComputationGraph()
+            g.add_top_k(3, 'value', group_by='group', descending=descending)
+            g.set_input(self.path)
+            g.run()
+            self.assertEqual(g.result, self.expected(3, descending))
+
+    def test_parallel_top_k(self):
+        g = computations.ComputationGraph()
+        g.add_top_k(3, ('value',), group_by=('group',), workers=2,
+                    chunk_size=4)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(g.result, self.expected(3, True))
+
+    def test_wrong_arguments(self):
+        g = computations.ComputationGraph()
+        self.assertRaises(TypeError, g.add_top_k, 0, 'value')
+        self.assertRaises(TypeError, g.add_top_k, 3, ())
+        self.assertRaises(TypeError, g.add_top_k, 3, 'value', ['group'])
+
+
+
+class TestOptimizer(unittest.TestCase):
+    @staticmethod
+    def double_mapper(line):
+        yield {'k': line['k'], 'v': line['v'] * 2}
+
+    @staticmethod
+    def split_mapper(line):
+        yield line
+        yield {'k': line['k'], 'v': -line['v']}
+
+    @staticmethod
+    def positive_mapper(line):
+        if line['v'] > 0:
+            yield line
+
+    @staticmethod
+    def sum_reducer(records):
+        yield {'k': records[0]['k'],
+               'v': sum(record['v'] for record in records)}
+
+    def setUp(self):
+        self.path = write_table([{'k': i % 4, 'v': i} for i in range(12)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def count_sorts(self, g):
+        with mock.patch('computations.external_sorted',
+                        wraps=computations.external_sorted) as sort:
+            g.run()
+        return sort.call_count
+
+    def test_reduce_after_sort_is_not_sorted_again(self):
+        g = computations.ComputationGraph()
+        g.add_sort('k')
+        g.add_sort('k')
+        g.add_reducer(TestOptimizer.sum_reducer, 'k')
+        g.set_input(self.path)
+        self.assertEqual(self.count_sorts(g), 1)
+        self.assertEqual(g.result, [{'k': k, 'v': 12 + 3 * k}
+                                    for k in range(4)])
+        self.assertEqual(g.explain().splitlines()[1:],
+                         ["1. Sort by ('k',)",
+                          "2. Reduce TestOptimizer.sum_reducer by ('k',), "
+                          "sort [presorted]"])
+
+    def test_merge_join_of_sorted_tables(self):
+        on = computations.ComputationGraph()
+        on.add_sort('k')
+        g = computations.ComputationGraph()
+        g.add_sort('k')
+        g.add_join((on, self.path), ('k',), 'inner')
+        g.add_aggregate('k', count='n')
+        g.set_input(self.path)
+        self.assertEqual(self.count_sorts(g), 2)
+        self.assertIn("Join inner by ('k',), merge "
+                      "[sorted_left, sorted_right]", g.explain())
+        self.assertEqual(g.result, [{'k': k, 'n': 9} for k in range(4)])
+
+    def test_maps_are_fused(self):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestOptimizer.split_mapper)
+        g.add_mapper(TestOptimizer.double_mapper)
+        g.add_mapper(TestOptimizer.positive_mapper)
+        g.set_input(self.path)
+        g.run()
+        self.assertEqual(g.result, [{'k': i % 4, 'v': 2 * i}
+                                    for i in range(1, 12)])
+        self.assertEqual(
+            g.explain().splitlines()[1:],
+            ['1. Map TestOptimizer.split_mapper + '
+             'TestOptimizer.double_mapper + TestOptimizer.positive_mapper'])
+
+    def test_map_is_pushed_below_join(self):
+        on = computations.ComputationGraph()
+        on.add_sort('k')
+        on.add_aggregate('k', count='n')
+        results = []
+        for pushdown in (False, True):
+            g = computations.ComputationGraph()
+            g.add_join((on, self.path), ('k',), 'inner')
+            g.add_mapper(TestOptimizer.positive_mapper, pushdown=pushdown)
+            g.set_input(self.path)
+            g.run()
+            results.append(g.result)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(g.explain().splitlines()[1:3],
+                         ['1. Map TestOptimizer.positive_mapper',
+                          "2. Join inner by ('k',), merge [sorted_right]"])
+
+
+
+class TestRowsFormat(unittest.TestCase):
+    table = [{'id': i, 'text': 'line {}'.format(i), 'values': [i, -i]}
+             for i in range(2500)]
+
+    def setUp(self):
+        self.path = write_table(TestRowsFormat.table)
+        fd, self.output = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.output)
+
+    def copy_graph(self):
+        g = computations.ComputationGraph()
+        g.set_input(self.path)
+        g.run()
+        return g
+
+    def test_rows_output_is_graph_input(self):
+        for compression in (None, 'zlib'):
+            self.copy_graph().write_output(self.output, 'rows', compression)
+            self.assertTrue(computations.is_rows_file(self.output))
+            g = computations.ComputationGraph()
+            g.set_input(computations.RowsSource(self.output))
+            g.run()
+            self.assertEqual(g.result, TestRowsFormat.table)
+
+    def test_paths_are_not_unpickled(self):
+        self.copy_graph().write_output(self.output, 'rows')
+        g = computations.ComputationGraph()
+        g.set_input(self.output)
+        with mock.patch('pickle.loads') as loads:
+            self.assertRaises(ValueError, g.run)
+        loads.assert_not_called()
+
+    def test_json_output_has_line_per_row(self):
+        self.copy_graph().write_output(self.output)
+        with open(self.output) as input:
+            lines = input.read().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         TestRowsFormat.table)
+
+    def test_header(self):
+        computations.write_rows(self.output, [], 'zlib', {'id': 'int64'})
+        self.assertEqual(computations.RowsSource(self.output).header(),
+                         {'compression': 'zlib', 'schema': {'id': 'int64'}})
+        self.assertEqual(list(computations.RowsSource(self.output)), [])
+
+    def test_wrong_arguments(self):
+        g = self.copy_graph()
+        self.assertRaises(TypeError, g.write_output, self.output, 'xml')
+        self.assertRaises(TypeError, g.write_output, self.output, 'rows',
+                          'unknown')
+        self.assertRaises(TypeError, computations.ResultCache,
+                          tempfile.gettempdir(), None, 'unknown')
+
+
+
+class TestProfile(unittest.TestCase):
+    @staticmethod
+    def count_reducer(records):
+        yield {'k': records[0]['k'], 'n': len(records)}
+
+    def setUp(self):
+        self.path = write_table([{'k': i % 3, 'v': i} for i in range(30)])
+        fd, self.trace = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.trace)
+
+    def graph(self, streaming):
+        on = computations.ComputationGraph()
+        on.add_aggregate('k', count='total')
+        g = computations.ComputationGraph(streaming=streaming,
+                                          sort_buffer_size=10)
+        g.add_sort('k')
+        g.add_reducer(TestProfile.count_reducer, 'k')
+        g.add_join((on, self.path), ('k',), 'inner')
+        g.set_input(self.path)
+        return g
+
+    def test_stats(self):
+        for streaming in (False, True):
+            g = self.graph(streaming)
+            g.run(profile=True)
+            graphs = g.stats()['graphs']
+            self.assertEqual([graph['dependencies'] for graph in graphs],
+                             [[], [0]])
+            operations = graphs[1]['operations']
+            self.assertEqual([operation['operation'][:4]
+                              for operation in operations],
+                             ['Read', 'Sort', 'Redu', 'Join'])
+            self.assertEqual([(operation['rows_in'], operation['rows_out'])
+                              for operation in operations],
+                             [(30, 30), (30, 30), (30, 3), (3, 3)])
+            self.assertEqual(operations[1]['sorts'], 1)
+            self.assertEqual(operations[1]['spills'], 3)
+            self.assertGreater(operations[1]['bytes_written'], 0)
+            self.assertEqual(graphs[1]['sorts'], 3)
+            self.assertEqual(graphs[1]['rows_out'], 3)
+            for operation in operations:
+                self.assertGreaterEqual(operation['wall'], 0)
+                self.assertIsNone(operation['peak_memory'])
+
+    def test_memory_and_trace(self):
+        g = self.graph(False)
+        g.run(profile='memory')
+        for graph in g.stats()['graphs']:
+            self.assertGreater(graph['peak_memory'], 0)
+        g.export_trace(self.trace)
+        with open(self.trace) as input:
+            events = json.load(input)['traceEvents']
+        self.assertEqual(len(events), 8)
+        self.assertEqual(events[0]['name'], 'graph 0: ' + self.path)
+
+    def test_stats_require_profile(self):
+        g = self.graph(False)
+        self.assertRaises(TypeError, g.run, profile='time')
+        self.assertRaises(TypeError, g.run, workers=2, profile='memory')
+        g.run()
+        self.assertRaises(RuntimeError, g.stats)
+
+
+
+class TestIncremental(unittest.TestCase):
+    @staticmethod
+    def word_mapper(line):
+        for word in line['text'].split():
+            yield {'word': word, 'count': 1}
+
+    @staticmethod
+    def merge_counts(first, second):
+        return {'word': first['word'],
+                'count': first['count'] + second['count']}
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'word': records[0]['word'],
+               'count': sum(record['count'] for record in records)}
+
+    @staticmethod
+    def count_folder(line, state):
+        return {'lines': state['lines'] + 1}
+
+    @staticmethod
+    def merge_states(first, second):
+        return {'lines': first['lines'] + second['lines']}
+
+    def setUp(self):
+        self.path = write_table([{'text': 'a b a'}, {'text': 'c b'}])
+        self.directory = tempfile.mkdtemp()
+        self.state = os.path.join(self.directory, 'state')
+
+    def tearDown(self):
+        os.remove(self.path)
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def append(self, text):
+        with open(self.path, 'a') as output:
+            output.write(text)
+
+    def word_count(self, **kwargs):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestIncremental.word_mapper)
+        g.add_reducer(TestIncremental.count_reducer, 'word',
+                      combiner=TestIncremental.merge_counts, **kwargs)
+        g.set_input(self.path)
+        return g
+
+    def test_reducer_with_combiner(self):
+        g = self.word_count()
+        g.run_incremental(self.state)
+        self.append(json.dumps({'text': 'b d'}) + '\n')
+        g = self.word_count()
+        g.run_incremental(self.state)
+        expected = self.word_count()
+        expected.run()
+        self.assertEqual(g.result, expected.result)
+
+        self.append(json.dumps({'text': 'd e'}) + '\n')
+        g = self.word_count()
+        g.run_incremental(self.state, changed_only=True)
+        self.assertEqual(g.result, [{'word': 'd', 'count': 2},
+                                    {'word': 'e', 'count': 1}])
+        g.run()
+        self.assertEqual(g.result, [{'word': 'a', 'count': 2},
+                                    {'word': 'b', 'count': 3},
+                                    {'word': 'c', 'count': 1},
+                                    {'word': 'd', 'count': 2},
+                                    {'word': 'e', 'count': 1}])
+
+    def test_aggregate_and_unfinished_line(self):
+        def graph():
+            g = computations.ComputationGraph()
+            g.add_mapper(TestIncremental.word_mapper)
+            g.add_aggregate('word', count='n')
+            g.set_input(self.path)
+            return g
+
+        graph().run_incremental(self.state)
+        self.append(json.dumps({'text': 'a'}) + '\n{"text": "a')
+        g = graph()
+        g.run_incremental(self.state, changed_only=True)
+        self.assertEqual(g.result, [{'word': 'a', 'n': 3}])
+        self.append(' b"}\n')
+        g = graph()
+        g.run_incremental(self.state)
+        self.assertEqual(g.result, [{'word': 'a', 'n': 4},
+                                    {'word': 'b', 'n': 3},
+                                    {'word': 'c', 'n': 1}])
+
+    def test_fold_and_rewritten_input(self):
+        def graph():
+            g = computations.ComputationGraph()
+            g.add_folder(TestIncremental.count_folder, {'lines': 0},
+                         merge=TestIncremental.merge_states)
+            g.set_input(self.path)
+            return g
+
+        graph().run_incremental(self.state)
+        self.append(json.dumps({'text': 'x'}) + '\n')
+        g = graph()
+        g.run_incremental(self.state)
+        self.assertEqual(g.result, [{'lines': 3}])
+        g = graph()
+        g.run_incremental(self.state, changed_only=True)
+        self.assertEqual(g.result, [])
+
+        with open(self.path, 'w') as output:
+            output.write(json.dumps({'text': 'y'}) + '\n')
+        g = graph()
+        g.run_incremental(self.state)
+        self.assertEqual(g.result, [{'lines': 1}])
+
+    def test_not_incremental_graph(self):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestIncremental.word_mapper)
+        g.add_reducer(TestIncremental.count_reducer, 'word')
+        g.set_input(self.path)
+        self.assertRaises(TypeError, g.run_incremental, self.state)
+
+
+
+class TestCheckpoint(unittest.TestCase):
+    calls = 0
+    fail = False
+
+    @staticmethod
+    def counting_mapper(line):
+        TestCheckpoint.calls += 1
+        yield line
+
+    @staticmethod
+    def failing_reducer(records):
+        if TestCheckpoint.fail:
+            raise ValueError('reducer failed')
+        yield {'k': records[0]['k'], 'n': len(records)}
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'k': records[0]['k'], 'n': len(records)}
+
+    @staticmethod
+    def failing_mapper(line):
+        if TestCheckpoint.fail:
+            raise ValueError('mapper failed')
+        yield line
+
+    def setUp(self):
+        TestCheckpoint.calls = 0
+        TestCheckpoint.fail = False
+        self.path = write_table([{'k': i % 2, 'v': i} for i in range(5)])
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        computations.ResultCache(self.directory).clear()
+        os.rmdir(self.directory)
+        os.remove(self.path)
+
+    def graph(self):
+        dependency = computations.ComputationGraph()
+        dependency.add_mapper(TestCheckpoint.counting_mapper)
+        g = computations.ComputationGraph()
+        g.add_mapper(TestCheckpoint.counting_mapper)
+        g.add_sort('k')
+        g.add_reducer(TestCheckpoint.failing_reducer, 'k')
+        g.add_join((dependency, self.path), ('k',), 'inner')
+        g.set_input(self.path)
+        return g
+
+    def test_resume_after_failure(self):
+        expected = self.graph()
+        expected.run()
+        TestCheckpoint.calls = 0
+
+        TestCheckpoint.fail = True
+        self.assertRaises(ValueError, self.graph().run,
+                          checkpoint=self.directory)
+        self.assertEqual(TestCheckpoint.calls, 10)
+        TestCheckpoint.fail = False
+        g = self.graph()
+        g.run(checkpoint=self.directory, resume=True)
+        self.assertEqual(TestCheckpoint.calls, 10)
+        self.assertEqual(g.result, expected.result)
+
+    def test_changed_input_is_recomputed(self):
+        self.graph().run(checkpoint=self.directory)
+        with open(self.path, 'a') as output:
+            output.write(json.dumps({'k': 1, 'v': 5}) + '\n')
+        g = self.graph()
+        g.run(checkpoint=self.directory, resume=True)
+        self.assertEqual(TestCheckpoint.calls, 22)
+        self.assertEqual([line['n'] for line in g.result], [3] * 6)
+
+    def test_resume_requires_checkpoint(self):
+        self.assertRaises(TypeError, self.graph().run, resume=True)
+
+    @unittest.skipIf(computations.numpy is None, 'numpy is not installed')
+    def test_resume_with_schema(self):
+        def graph():
+            g = computations.ComputationGraph(
+                schema={'k': 'int64', 'v': 'int64'})
+            g.add_reducer(TestCheckpoint.count_reducer, 'k')
+            g.add_mapper(TestCheckpoint.failing_mapper)
+            g.set_input(self.path)
+            return g
+
+        TestCheckpoint.fail = True
+        self.assertRaises(ValueError, graph().run,
+                          checkpoint=self.directory)
+        TestCheckpoint.fail = False
+        g = graph()
+        g.run(checkpoint=self.directory, resume=True)
+        self.assertEqual(g.result, [{'k': 0, 'n': 3}, {'k': 1, 'n': 2}])
+
+    def test_plain_run_does_not_fingerprint_input(self):
+        with mock.patch('computations._file_fingerprint',
+                        wraps=computations._file_fingerprint) as fingerprint:
+            self.graph().run()
+        self.assertEqual(fingerprint.call_count, 0)
+
+
+class TestShardedSource(unittest.TestCase):
+    @staticmethod
+    def double_mapper(line):
+        yield {'id': line['id'], 'value': line['id'] * 2}
+
+    @staticmethod
+    def sum_reducer(records):
+        yield {'parity': records[0]['parity'],
+               'total': sum(record['value'] for record in records)}
+
+    @staticmethod
+    def parity_mapper(line):
+        yield dict(line, parity=line['id'] % 2)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.table = [{'id': i, 'text': 'x' * (i % 5)} for i in range(30)]
+        for number in range(3):
+            with open(os.path.join(self.directory,
+                                   'part-{}.txt'.format(number)),
+                      'w') as output:
+                for line in self.table[number * 10:(number + 1) * 10]:
+                    output.write(json.dumps(line) + '\n')
+        with open(os.path.join(self.directory, '.hidden'), 'w') as output:
+            output.write('not json\n')
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def graph(self, source):
+        g = computations.ComputationGraph(streaming=True)
+        g.add_mapper(TestShardedSource.double_mapper)
+        g.add_mapper(TestShardedSource.parity_mapper)
+        g.add_reducer(TestShardedSource.sum_reducer, 'parity')
+        g.set_input(source)
+        return g
+
+    def test_ranges_are_aligned_to_lines(self):
+        path = os.path.join(self.directory, 'part-0.txt')
+        with open(path, 'rb') as input:
+            data = input.read()
+        for split_size in (1, 7, 40, len(data), len(data) + 1):
+            ranges = computations._split_file(path, split_size)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[start - 1:start], b'\n')
+            lines = [line for start, end in ranges
+                     for line in computations.JsonLinesSource(
+                         path, start=start, end=end)]
+            self.assertEqual(lines, self.table[:10])
+
+    def test_directory_and_pattern(self):
+        pattern = os.path.join(self.directory, 'part-*.txt')
+        for paths in (self.directory, pattern):
+            source = computations.ShardedSource(paths, split_size=50)
+            self.assertEqual(len(source.files()), 3)
+            self.assertEqual(list(source), self.table)
+            g = computations.ComputationGraph()
+            g.set_input(paths)
+            g.run()
+            self.assertEqual(g.result, self.table)
+
+    def test_rows_files_are_read_whole(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for number in range(3):
+                computations.write_rows(
+                    os.path.join(directory, 'part-{}.rows'.format(number)),
+                    self.table[number * 10:(number + 1) * 10])
+            source = computations.ShardedSource(directory, 2, 50,
+                                                format='rows')
+            self.assertEqual(len(source.splits()), 3)
+            self.assertEqual(list(source), self.table)
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def test_workers_compute_leading_mappers(self):
+        expected = self.graph(self.directory)
+        expected.run()
+        source = computations.ShardedSource(self.directory, 2, 50)
+        g = self.graph(source)
+        self.assertIn('1. Map TestShardedSource.double_mapper + '
+                      'TestShardedSource.parity_mapper [in_readers]',
+                      g.explain())
+        g.run(profile=True)
+        self.assertEqual(g.result, expected.result)
+        operations = g.stats()['graphs'][0]['operations']
+        self.assertEqual([operation['operation'] for operation in operations],
+                         ['Read + Map TestShardedSource.double_mapper + '
+                          'TestShardedSource.parity_mapper',
+                          'Reduce TestShardedSource.sum_reducer by '
+                          "('parity',), sort"])
+        self.assertEqual(operations[0]['rows_out'], 30)
+
+    def test_unordered_read_has_same_lines(self):
+        source = computations.ShardedSource(self.directory, 3, 20,
+                                            ordered=False)
+        self.assertEqual(sorted(source, key=itemgetter('id')), self.table)
+
+    def test_cache_sees_new_files(self):
+        cache = computations.ResultCache(tempfile.mkdtemp())
+        try:
+            g = self.graph(self.directory)
+            g.run(cache=cache)
+            with open(os.path.join(self.directory, 'part-3.txt'),
+                      'w') as output:
+                output.write(json.dumps({'id': 30, 'text': ''}) + '\n')
+            g = self.graph(self.directory)
+            g.run(cache=cache)
+            self.assertEqual(g.result, [{'parity': 0, 'total': 480},
+                                        {'parity': 1, 'total': 450}])
+        finally:
+            cache.clear()
+            os.rmdir(cache.directory)
+
+    def test_wrong_parameters(self):
+        self.assertRaises(TypeError, computations.ShardedSource, 10)
+        self.assertRaises(TypeError, computations.ShardedSource,
+                          self.directory, 0)
+        self.assertRaises(TypeError, computations.ShardedSource,
+                          self.directory, None, 0)
+        self.assertRaises(TypeError, computations.ShardedSource,
+                          self.directory, 2, decoder=lambda line: line)
+        self.assertRaises(TypeError, computations.ShardedSource,
+                          self.directory, format='xml')
+
+
+class TestCluster(unittest.TestCase):
+    @staticmethod
+    def word_mapper(line):
+        for word in line['text'].split():
+            yield {'word': word, 'count': 1}
+
+    @staticmethod
+    def count_reducer(records):
+        yield {'word': records[0]['word'],
+               'count': sum(record['count'] for record in records)}
+
+    @staticmethod
+    def length_folder(line, state):
+        return {'words': state['words'] + line['count'],
+                'first': state['first'] or line['word']}
+
+    @staticmethod
+    def merge_lengths(first, second):
+        return {'words': first['words'] + second['words'],
+                'first': first['first'] or second['first']}
+
+    @staticmethod
+    def flaky_mapper(line):
+        try:
+            os.remove(line['flag'])
+        except FileNotFoundError:
+            yield line
+            return
+        if line['exit']:
+            os._exit(1)
+        raise ValueError('flaky')
+
+    @staticmethod
+    def failing_mapper(line):
+        raise ValueError('always')
+        yield line
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cluster = distributed.LocalCluster(2, partitions=3,
+                                               split_size=64)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cluster.close()
+
+    def setUp(self):
+        self.table = [{'doc': i, 'text': ' '.join(
+            'w{}'.format(j) for j in range(i % 7, 9))} for i in range(40)]
+        self.path = write_table(self.table)
+        self.names = write_table([{'word': 'w{}'.format(j),
+                                   'name': 'word {}'.format(j)}
+                                  for j in range(0, 12, 2)])
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.names)
+
+    def compare(self, g, ordered=False):
+        g.run()
+        expected = g.result
+        g.run(cluster=self.cluster)
+        if ordered:
+            self.assertEqual(g.result, expected)
+        else:
+            self.assertEqual(sorted(g.result, key=repr),
+                             sorted(expected, key=repr))
+
+    def graph(self, *operations):
+        g = computations.ComputationGraph()
+        g.add_mapper(TestCluster.word_mapper)
+        for name, args, kwargs in operations:
+            getattr(g, name)(*args, **kwargs)
+        g.set_input(self.path)
+        return g
+
+    def test_stages(self):
+        g = self.graph(('add_sort', ('word',), {}),
+                       ('add_aggregate', ('word',), {'count': 'n'}))
+        stages = distributed._stages(g._plan()[0])
+        self.assertEqual([stage.partition for stage in stages],
+                         [('range', ('word',)), ('hash', ('word',)), None])
+        self.assertEqual(stages[1].partial[0], 'aggregate')
+
+    def test_reduce_and_aggregate(self):
+        self.compare(self.graph(('add_reducer',
+                                 (TestCluster.count_reducer, 'word'), {})))
+        self.compare(self.graph(('add_aggregate', ('word',),
+                                 {'count': 'n', 'sum': {'count': 'total'}})))
+        self.compare(self.graph(('add_aggregate', ((),), {'count': 'n'})))
+
+    def test_sorted_result_keeps_order(self):
+        self.compare(self.graph(('add_sort', (('word', 'count'),), {})),
+                     ordered=True)
+        self.compare(self.graph(('add_sort', ('word',), {}),
+                                ('add_aggregate', ('word',),
+                                 {'count': 'n'})), ordered=True)
+
+    def test_top_k_and_fold(self):
+        self.compare(self.graph(('add_top_k', (3, 'count'),
+                                 {'group_by': 'word'})), ordered=False)
+        self.compare(self.graph(('add_top_k', (2, 'word'), {})),
+                     ordered=True)
+        begin = {'words': 0, 'first': None}
+        self.compare(self.graph(('add_folder',
+                                 (TestCluster.length_folder, begin),
+                                 {'merge': TestCluster.merge_lengths})),
+                     ordered=True)
+        self.compare(self.graph(('add_folder',
+                                 (TestCluster.length_folder, begin), {})),
+                     ordered=True)
+
+    def test_joins(self):
+        names = computations.ComputationGraph()
+        for strategy in ('inner', 'left', 'right', 'outer'):
+            for method in ('merge', 'hash'):
+                self.compare(self.graph(
+                    ('add_reducer', (TestCluster.count_reducer, 'word'), {}),
+                    ('add_join', ((names, self.names), ('word',), strategy),
+                     {'method': method})))
+        self.compare(self.graph(('add_top_k', (2, 'word'), {}),
+                                ('add_join', ((names, self.names), (),
+                                              'cross'), {})))
+
+    def test_graph_and_sharded_inputs(self):
+        base = self.graph(('add_reducer',
+                           (TestCluster.count_reducer, 'word'), {}))
+        g = computations.ComputationGraph()
+        g.add_sort('count')
+        g.set_input(base)
+        self.compare(g, ordered=True)
+        g = computations.ComputationGraph()
+        g.add_mapper(TestCluster.word_mapper)
+        g.set_input(computations.ShardedSource([self.path, self.path],
+                                               split_size=200))
+        self.compare(g, ordered=True)
+
+    def test_failed_tasks_are_retried(self):
+        fd, flag = tempfile.mkstemp()
+        os.close(fd)
+        path = write_table([{'flag': flag, 'exit': False, 'i': i}
+                            for i in range(5)])
+        try:
+            g = computations.ComputationGraph()
+            g.add_mapper(TestCluster.flaky_mapper)
+            g.set_input(path)
+            g.run(cluster=self.cluster)
+            self.assertEqual([line['i'] for line in g.result],
+                             list(range(5)))
+            self.assertFalse(os.path.exists(flag))
+
+            g = computations.ComputationGraph()
+            g.add_mapper(TestCluster.failing_mapper)
+            g.set_input(path)
+            with self.assertRaises(RuntimeError) as context:
+                g.run(cluster=self.cluster)
+            self.assertIn('ValueError: always', str(context.exception))
+        finally:
+            os.remove(path)
+
+    def test_disconnected_worker_is_replaced(self):
+        fd, flag = tempfile.mkstemp()
+        os.close(fd)
+        path = write_table([{'flag': flag, 'exit': True, 'i': i}
+                            for i in range(5)])
+        try:
+            with distributed.LocalCluster(2) as cluster:
+                g = computations.ComputationGraph()
+                g.add_mapper(TestCluster.flaky_mapper)
+                g.set_input(path)
+                g.run(cluster=cluster)
+                self.assertEqual(len(g.result), 5)
+                self.assertEqual(cluster.workers, 1)
+        finally:
+            os.remove(path)
+
+    def test_wrong_parameters(self):
+        g = computations.ComputationGraph()
+        g.add_mapper(lambda line: (yield line))
+        g.set_input(self.path)
+        self.assertRaises(TypeError, g.run, cluster=self.cluster)
+        g = self.graph()
+        self.assertRaises(TypeError, g.run, workers=2, cluster=self.cluster)
+        self.assertRaises(TypeError, distributed.Cluster, authkey='key')
+        self.assertRaises(TypeError, distributed.LocalCluster, 0)
+
+
+class TestMemoryBudget(unittest.TestCase):
+    @staticmethod
+    def count_reducer(records):
+        yield {'key': records[0]['key'], 'count': len(records),
+               'first': records[0]['i']}
+
+    @staticmethod
+    def collect_folder(line, state):
+        return {'texts': state['texts'] + [line['text']]}
+
+    def setUp(self):
+        self.table = [{'key': i % 37, 'i': i, 'text': 'text {}'.format(i)}
+                      for i in range(600)]
+        self.path = write_table(self.table)
+        self.names = write_table([{'key': key, 'name': 'name {}'.format(n)}
+                                  for key in range(0, 50, 2)
+                                  for n in range(3)])
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.names)
+
+    def run_graph(self, memory_limit, *operations):
+        g = computations.ComputationGraph(streaming=True,
+                                          memory_limit=memory_limit)
+        for name, args, kwargs in operations:
+            getattr(g, name)(*args, **kwargs)
+        g.set_input(self.path)
+        g.run(profile=True)
+        return g.result, g.stats()['graphs'][-1]
+
+    def compare(self, *operations, ordered=False, spills=True):
+        expected, stats = self.run_graph(None, *operations)
+        self.assertIsNone(stats['reserved_memory'])
+        result, stats = self.run_graph(20000, *operations)
+        if ordered:
+            self.assertEqual(result, expected)
+        else:
+            self.assertEqual(sorted(result, key=repr),
+                             sorted(expected, key=repr))
+        self.assertEqual(stats['spills'] > 0, spills)
+        return stats
+
+    def test_sort_and_sort_reduce(self):
+        self.compare(('add_sort', ('text',), {}), ordered=True)
+        self.compare(('add_reducer', (TestMemoryBudget.count_reducer, 'key'),
+                      {}), ordered=True)
+
+    def test_hash_reduce(self):
+        self.compare(('add_reducer', (TestMemoryBudget.count_reducer, 'key',
+                                      'hash'), {}))
+
+    def test_aggregate(self):
+        self.compare(('add_aggregate', ('i',),
+                      {'count': 'n', 'sum': {'key': 'total'}}))
+
+    def test_joins(self):
+        names = computations.ComputationGraph()
+        longer = write_table([{'key': key, 'name': 'name {}'.format(key)}
+                              for key in range(0, 1300, 2)])
+        try:
+            for path in (self.names, longer):
+                for strategy in ('inner', 'left', 'right', 'outer'):
+                    for method in ('merge', 'hash'):
+                        self.compare(('add_join', ((names, path), ('key',),
+                                                   strategy),
+                                      {'method': method}))
+        finally:
+            os.remove(longer)
+
+    def test_resident_build_side_is_not_spilled(self):
+        # the shorter side is a result of another graph, it is in memory
+        # anyway, so it is only reserved
+        os.remove(self.names)
+        self.names = write_table([{'key': key, 'name': 'x' * 5000}
+                                  for key in range(0, 50, 2)])
+        names = computations.ComputationGraph()
+        stats = self.compare(('add_join', ((names, self.names), ('key',),
+                                           'outer'), {'method': 'hash'}),
+                             spills=False)
+        self.assertGreater(stats['reserved_memory'], 100000)
+
+    def test_hash_join_holds_less_memory(self):
+        left = write_table([{'key': i, 'text': 'x' * 1000}
+                            for i in range(10000)])
+        right = write_table([{'key': i} for i in range(9990, 19991)])
+
+        def peak(memory_limit):
+            dimension = computations.ComputationGraph()
+            g = computations.ComputationGraph(streaming=True,
+                                              memory_limit=memory_limit)
+            g.add_join((dimension, right), ('key',), 'inner', method='hash')
+            g.set_input(left)
+            tracemalloc.start()
+            try:
+                g.run()
+                return g.result, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        try:
+            expected, unlimited = peak(None)
+            result, limited = peak(100000)
+        finally:
+            os.remove(left)
+            os.remove(right)
+        self.assertEqual(sorted(result, key=repr),
+                         sorted(expected, key=repr))
+        self.assertEqual(len(result), 10)
+        self.assertLess(limited, unlimited / 2)
+
+    def test_spilled_aggregate_is_not_sorted(self):
+        aggregate = (('add_sort', ('i',), {}),
+                     ('add_aggregate', ('i',), {'count': 'n'}))
+        result, stats = self.run_graph(20000, *aggregate,
+                                       ('add_sort', ('i',), {}))
+        self.assertGreater(stats['spills'], 0)
+        self.assertEqual(result, [{'i': i, 'n': 1} for i in range(600)])
+
+        counts = computations.ComputationGraph(memory_limit=20000)
+        for name, args, kwargs in aggregate:
+            getattr(counts, name)(*args, **kwargs)
+        result, _ = self.run_graph(None, ('add_sort', ('i',), {}),
+                                   ('add_join', ((counts, self.path), ('i',),
+                                                 'inner'), {}))
+        self.assertEqual(len(result), 600)
+
+    def test_hot_key(self):
+        for line in self.table:
+            line['key'] = 0
+        os.remove(self.path)
+        self.path = write_table(self.table)
+        self.compare(('add_reducer', (TestMemoryBudget.count_reducer, 'key',
+                                      'hash'), {}))
+
+    def test_fold_state_is_reported(self):
+        folder = ('add_folder', (TestMemoryBudget.collect_folder,
+                                 {'texts': []}), {})
+        expected, _ = self.run_graph(None, folder)
+        result, stats = self.run_graph(20000, folder)
+        self.assertEqual(result, expected)
+        self.assertGreater(stats['reserved_memory'], 20000)
+        self.assertEqual(stats['spills'], 0)
+
+    def test_wrong_limit(self):
+        self.assertRaises(TypeError, computations.ComputationGraph,
+                          memory_limit=0)
+        self.assertRaises(TypeError, computations.MemoryBudget, 1.5)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file